@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# Benchmarks for the agent and plugin code that runs every epoch, on synthetic
+# bettercap sessions (10 to 5,000 APs) and handshake directories (1k to 50k
+# pcaps). Results go to a JSON baseline; --compare flags anything slower than
+# an earlier baseline, so a regression shows up here instead of on the Pi.
+#
+#   python3 bench/hotpaths.py -o bench/baseline.json
+#   python3 bench/hotpaths.py --compare bench/baseline.json
+#
+# The agent and plugin modules are imported from this tree; the rest of
+# pwnagotchi (ui, bettercap client, mesh, ...) has to be importable, e.g. run
+# it with the Pi's venv or a checkout of the full package on PYTHONPATH.
+# Methods are timed on an Agent built without __init__, so nothing talks to
+# bettercap, the display or the network.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import timeit
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SITE_PACKAGES = os.path.join(ROOT, 'home', 'pi', '.pwn', 'lib', 'python3.11', 'site-packages')
+CUSTOM_PLUGINS = os.path.join(ROOT, 'usr', 'local', 'share', 'pwnagotchi', 'custom-plugins')
+
+SESSION_SIZES = (10, 100, 1000, 5000)
+HANDSHAKE_SIZES = (1000, 10000, 50000)
+QUICK_SESSION_SIZES = (10, 100, 1000)
+QUICK_HANDSHAKE_SIZES = (1000, 5000)
+THRESHOLD = 0.25   # slower than the baseline by more than this is a regression
+
+# channel mix of a city walk: mostly 1/6/11, some 5GHz
+CHANNELS = [1] * 20 + [6] * 20 + [11] * 20 + [2, 3, 4, 5, 7, 8, 9, 10, 13] * 2 + [36, 40, 44, 48, 149, 153, 157, 161] * 3
+ENCRYPTIONS = ['WPA2'] * 70 + ['WPA2/WPA3'] * 8 + ['WPA3'] * 4 + ['WPA'] * 4 + ['OPEN'] * 10 + ['WEP'] * 2 + [''] * 2
+VENDORS = ['TP-LINK TECHNOLOGIES', 'NETGEAR', 'Apple, Inc.', 'Samsung Electronics', 'ASUSTek COMPUTER', '']
+PCAP_HEADER = bytes.fromhex('d4c3b2a1020004000000000000000000ffff000069000000')
+
+
+def _mac(rng):
+    return ':'.join('%02x' % rng.randrange(256) for _ in range(6))
+
+
+def _client_count(rng):
+    # most APs show no or one client, a few are busy
+    count = 0
+    while rng.random() < 0.55 and count < 40:
+        count += 1
+    return count
+
+
+def synthetic_session(n_aps, seed=0):
+    """A bettercap session() response with n_aps APs."""
+    rng = random.Random(seed)
+    aps = []
+    for i in range(n_aps):
+        mac = _mac(rng)
+        aps.append({
+            'mac': mac,
+            'hostname': '<hidden>' if rng.random() < 0.05 else 'net-%05d' % i,
+            'vendor': rng.choice(VENDORS),
+            'channel': rng.choice(CHANNELS),
+            'encryption': rng.choice(ENCRYPTIONS),
+            'cipher': 'CCMP',
+            'authentication': 'PSK',
+            'rssi': -rng.randrange(30, 95),
+            'frequency': 2437,
+            'first_seen': '2024-01-01T00:00:00Z',
+            'last_seen': '2024-01-01T00:05:00Z',
+            'clients': [{'mac': _mac(rng), 'vendor': rng.choice(VENDORS), 'rssi': -rng.randrange(40, 95)}
+                        for _ in range(_client_count(rng))],
+        })
+    return {'wifi': {'aps': aps}, 'modules': [], 'interfaces': []}
+
+
+def synthetic_handshakes(directory, n_pcaps, seed=0):
+    """Fill directory with n_pcaps captures named like bettercap's; returns the agent's handshake table."""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    handshakes = {}
+    now = time.time()
+    for i in range(n_pcaps):
+        ap, sta = _mac(rng), _mac(rng)
+        filename = os.path.join(directory, 'net-%05d_%s.pcap' % (i, ap.replace(':', '')))
+        with open(filename, 'wb') as fp:
+            fp.write(PCAP_HEADER)
+        handshakes['%s -> %s' % (sta, ap)] = {'ap': ap, 'station': sta, 'file': filename, 'time': now - i}
+    return handshakes
+
+
+def synthetic_potfile(path, n_lines, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'wt') as fp:
+        for i in range(n_lines):
+            fp.write('%s:%s:net-%05d:password%d\n' % (_mac(rng).replace(':', ''), _mac(rng).replace(':', ''), i, i))
+
+
+def _load_plugin(name, filename):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(CUSTOM_PLUGINS, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class _NullView(object):
+    # the display is not what is being measured
+    def set(self, key, value):
+        pass
+
+    def add_element(self, key, element):
+        pass
+
+
+class _Epoch(object):
+    epoch = 0
+
+    def observe(self, aps, peers):
+        pass
+
+
+def _measure(fn, min_time=0.2, repeat=5):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {'best_us': round(min(runs) * 1e6, 3), 'median_us': round(statistics.median(runs) * 1e6, 3),
+            'calls': number * repeat}
+
+
+class Bench(object):
+    def __init__(self, workdir, session_sizes, handshake_sizes, min_time):
+        from pwnagotchi import whitelist
+        from pwnagotchi.agent import Agent
+        from pwnagotchi.channels import ChannelScheduler
+        from pwnagotchi.history import InteractionHistory
+        from pwnagotchi.recovery import RecoveryStore
+
+        self.workdir = workdir
+        self.session_sizes = session_sizes
+        self.handshake_sizes = handshake_sizes
+        self.min_time = min_time
+        self.results = {}
+
+        agent = Agent.__new__(Agent)
+        agent._config = {'personality': {'channels': [], 'max_interactions': 3},
+                         'main': {'whitelist': ['home-net', '00:11:22', 'aa:bb:cc:dd:ee:ff']},
+                         'bettercap': {'handshakes': os.path.join(workdir, 'handshakes')}}
+        agent._whitelist = whitelist.compiled(agent._config['main']['whitelist'])
+        agent._view = _NullView()
+        agent._epoch = _Epoch()
+        agent._peers = {}
+        agent._access_points = []
+        agent._tot_aps = 0
+        agent._aps_on_channel = 0
+        agent._current_channel = 6
+        agent._channels = ChannelScheduler()
+        agent._channel_snapshots = None
+        agent._handshakes = {}
+        agent._history = InteractionHistory()
+        agent._started_at = time.time()
+        agent._last_pwnd = None
+        agent._recovery = RecoveryStore(os.path.join(workdir, 'recovery'), state=agent._recovery_state)
+        self.agent = agent
+
+    def _record(self, name, fn):
+        self.results[name] = _measure(fn, self.min_time)
+        print("%-48s %12.1f us" % (name, self.results[name]['median_us']))
+
+    def _skip(self, name, err):
+        self.results[name] = {'skipped': str(err)}
+        print("%-48s skipped: %s" % (name, err))
+
+    def agent_sessions(self):
+        agent = self.agent
+        for n in self.session_sizes:
+            session = synthetic_session(n, seed=n)
+            agent.session = lambda sess='session', s=session: s
+            aps = session['wifi']['aps']
+            last = aps[-1]
+            station = last['clients'][-1]['mac'] if last['clients'] else 'de:ad:be:ef:00:00'
+
+            self._record('get_access_points/aps=%d' % n, agent.get_access_points)
+            self._record('get_access_points_by_channel/aps=%d' % n, agent.get_access_points_by_channel)
+            agent.get_access_points()
+            self._record('_update_counters/aps=%d' % n, agent._update_counters)
+            self._record('_find_ap_sta_in/hit/aps=%d' % n, lambda: agent._find_ap_sta_in(station, last['mac'], session))
+            self._record('_find_ap_sta_in/miss/aps=%d' % n,
+                         lambda: agent._find_ap_sta_in(station, 'de:ad:be:ef:00:01', session))
+
+    def agent_handshakes(self):
+        agent = self.agent
+        for n in self.handshake_sizes:
+            directory = os.path.join(self.workdir, 'handshakes-%d' % n)
+            agent._handshakes = synthetic_handshakes(directory, n, seed=n)
+            known = next(iter(agent._handshakes.values()))['ap'].upper()
+
+            self._record('_has_handshake/hit/pcaps=%d' % n, lambda: agent._has_handshake(known))
+            self._record('_has_handshake/miss/pcaps=%d' % n, lambda: agent._has_handshake('DE:AD:BE:EF:00:01'))
+            self._record('_save_recovery_data/pcaps=%d' % n, agent._save_recovery_data)
+            shutil.rmtree(directory)
+
+    def display_password(self):
+        try:
+            module = _load_plugin('display_password', 'display-password.py')
+        except Exception as err:
+            return self._skip('display-password', err)
+        plugin = module.DisplayPassword()
+        for n in self.handshake_sizes:
+            potfiles = [os.path.join(self.workdir, 'quickdic-%d.potfile' % n), os.path.join(self.workdir, 'wpa-sec-%d.potfile' % n)]
+            synthetic_potfile(potfiles[0], n, seed=n)
+            synthetic_potfile(potfiles[1], n // 4, seed=n + 1)
+            plugin.potfiles = potfiles
+            self._record('display-password/potfile_lines=%d' % n, plugin._get_most_recent_password)
+
+    def deauth_sniffer(self):
+        try:
+            module = _load_plugin('deauth_sniffer', 'deauth_sniffer.py')
+        except Exception as err:
+            return self._skip('deauth_sniffer', err)
+        from pwnagotchi import logwriter, whitelist
+
+        plugin = module.DeauthSniffer()
+        plugin.options = {'cleanup_interval': 3600, 'detection_timeout': 300, 'ui_update_interval': 0,
+                          'max_detections': 1000, 'message_duration': 10}
+        plugin.whitelist = whitelist.compiled(['00:11:22:33:44:55', 'aa:bb:cc:dd:ee:ff'])
+        plugin.log_file = os.path.join(self.workdir, 'deauth.log')
+        plugin.log_sink = logwriter.sink(plugin.log_file)
+        plugin.ready = True
+        agent = self.agent
+        agent.view = lambda: agent._view
+        for n in self.session_sizes:
+            aps = synthetic_session(n, seed=n)['wifi']['aps']
+            # a few APs carry a deauth marker, as the plugin expects
+            for ap in aps[::50]:
+                ap['last_frame'] = 'deauthentication'
+
+            def run():
+                plugin.last_ui_update = 0
+                plugin.on_wifi_update(agent, aps)
+
+            self._record('deauth_sniffer.on_wifi_update/aps=%d' % n, run)
+
+    def run(self):
+        self.agent_sessions()
+        self.agent_handshakes()
+        self.display_password()
+        self.deauth_sniffer()
+        return {
+            'meta': {
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'platform': platform.platform(),
+                'min_time': self.min_time,
+            },
+            'results': self.results,
+        }
+
+
+def compare(current, baseline, threshold=THRESHOLD):
+    """Names of benchmarks that got slower than baseline by more than threshold, with the ratio."""
+    regressions = {}
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before or 'median_us' not in before or 'median_us' not in result or not before['median_us']:
+            continue
+        ratio = result['median_us'] / before['median_us']
+        if ratio > 1 + threshold:
+            regressions[name] = round(ratio, 2)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='agent and plugin hot path benchmarks')
+    parser.add_argument('-o', '--output', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', help='baseline to compare against; exits 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='allowed slowdown (0.25 = 25%%)')
+    parser.add_argument('--quick', action='store_true', help='smaller sessions and handshake dirs')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per timing run')
+    parser.add_argument('--site-packages', default=SITE_PACKAGES, help='where the pwnagotchi under test lives')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, args.site_packages)
+    # the agent logs every recovery write; keep the timings readable
+    logging.disable(logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix='pwnagotchi-bench-')
+    try:
+        bench = Bench(workdir,
+                      QUICK_SESSION_SIZES if args.quick else SESSION_SIZES,
+                      QUICK_HANDSHAKE_SIZES if args.quick else HANDSHAKE_SIZES,
+                      args.min_time)
+        results = bench.run()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'wt') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+        print("baseline written to %s" % args.output)
+
+    if args.compare:
+        with open(args.compare, 'rt') as fp:
+            regressions = compare(results, json.load(fp), args.threshold)
+        for name, ratio in sorted(regressions.items()):
+            print("REGRESSION %-48s %.2fx slower" % (name, ratio))
+        if regressions:
+            return 1
+        print("no regressions against %s" % args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
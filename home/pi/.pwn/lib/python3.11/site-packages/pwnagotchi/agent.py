@@ -11,6 +11,17 @@ import subprocess
 import pwnagotchi
 import pwnagotchi.utils as utils
 import pwnagotchi.plugins as plugins
+from pwnagotchi import bootprof
+from pwnagotchi import metrics
+from pwnagotchi import power
+from pwnagotchi.recovery import RecoveryStore, slim_handshake
+from pwnagotchi.history import InteractionHistory, MAX_ENTRIES, HALF_LIFE
+from pwnagotchi.pollrate import AdaptiveInterval, Skipper, session_digest, MAX_INTERVAL
+from pwnagotchi import channels as scheduling
+from pwnagotchi import logwriter
+from pwnagotchi import whitelist
+from pwnagotchi import handshakepack
+from pwnagotchi.coalesce import CoalescingView, MIN_INTERVAL
 from pwnagotchi.ui.web.server import Server
 from pwnagotchi.automata import Automata
 from pwnagotchi.log import LastSession
@@ -18,16 +29,24 @@ from pwnagotchi.bettercap import Client
 from pwnagotchi.mesh.utils import AsyncAdvertiser
 
 RECOVERY_DATA_FILE = '/root/.pwnagotchi-recovery'
+FETCH_INTERVAL = 5
+REFRESH_INTERVAL = 60   # seconds; advertisement and peers are redrawn at least this often
 
 
 class Agent(Client, Automata, AsyncAdvertiser):
     def __init__(self, view, config, keypair):
+        # times the plugin callbacks from here until set_ready()
+        bootprof.install()
         Client.__init__(self,
                         "127.0.0.1" if "hostname" not in config['bettercap'] else config['bettercap']['hostname'],
                         "http" if "scheme" not in config['bettercap'] else config['bettercap']['scheme'],
                         8081 if "port" not in config['bettercap'] else config['bettercap']['port'],
                         "pwnagotchi" if "username" not in config['bettercap'] else config['bettercap']['username'],
                         "pwnagotchi" if "password" not in config['bettercap'] else config['bettercap']['password'])
+        if config['bettercap'].get('record'):
+            # session, command and websocket traffic for `python3 -m pwnagotchi.bcapsim serve`
+            from pwnagotchi import bcapsim
+            bcapsim.install(self, config['bettercap']['record'])
         Automata.__init__(self, config, view)
         AsyncAdvertiser.__init__(self, config, view, keypair)
 
@@ -35,17 +54,39 @@ class Agent(Client, Automata, AsyncAdvertiser):
         self._current_channel = 0
         self._tot_aps = 0
         self._aps_on_channel = 0
-        self._supported_channels = utils.iface_channels(config['main']['iface'])
-        self._view = view
-        self._view.set_agent(self)
-        self._web_ui = Server(self, config['ui'])
+        with bootprof.phase('iface_channels'):
+            self._supported_channels = utils.iface_channels(config['main']['iface'])
+        view.set_agent(self)
+        # plugins and the stats fetcher get a rate limited view; e-ink refreshes are expensive
+        self._view = CoalescingView(view, config['ui'].get('min_refresh_interval', MIN_INTERVAL))
+        metrics.register('view', self._view.stats)
+        if config['ui']['faces'].get('png') and config['ui']['faces'].get('atlas'):
+            try:
+                from pwnagotchi import faceatlas
+                faceatlas.install(view, config['ui']['faces']['atlas'])
+            except Exception as e:
+                logging.warning("face atlas disabled, drawing faces from png: %s", e)
+        with bootprof.phase('web_ui'):
+            self._web_ui = Server(self, config['ui'])
 
         self._access_points = []
+        self._whitelist = whitelist.compiled(config['main']['whitelist'])
         self._last_pwnd = None
-        self._history = {}
+        self._history = InteractionHistory(config['personality'].get('history_max_entries', MAX_ENTRIES),
+                                           config['personality'].get('history_half_life', HALF_LIFE))
+        metrics.register('history', self._history.stats)
         self._handshakes = {}
+        # kept open: its name table is read once and then only extended with new records
+        self._pack = handshakepack.HandshakePack(config['bettercap']['handshakes'])
+        self._channels = scheduling.ChannelScheduler() if config['personality'].get('channel_scheduler', False) else None
+        self._channel_snapshots = logwriter.sink(config['personality']['channel_snapshots'], max_bytes=4194304) \
+            if config['personality'].get('channel_snapshots') else None
+        self._recovery = RecoveryStore(RECOVERY_DATA_FILE, state=self._recovery_state)
         self.last_session = LastSession(self._config)
         self.mode = 'auto'
+        self._poller = AdaptiveInterval(FETCH_INTERVAL, config['personality'].get('fetch_max_interval', MAX_INTERVAL))
+        self._skipper = Skipper()
+        self._on_power_profile(power.default().subscribe(self._on_power_profile), None)
         
         # Scrolling text variables (ZeroDumb)
         self._scroll_text = None
@@ -138,15 +179,21 @@ class Agent(Client, Automata, AsyncAdvertiser):
                 time.sleep(1)
 
     def start(self):
-        self._wait_bettercap()
-        self.setup_events()
+        with bootprof.phase('wait_bettercap'):
+            self._wait_bettercap()
+        with bootprof.phase('setup_events'):
+            self.setup_events()
         self.set_starting()
-        self.start_monitor_mode()
+        with bootprof.phase('monitor_mode'):
+            self.start_monitor_mode()
         self.start_event_polling()
         self.start_session_fetcher()
         # print initial stats
-        self.next_epoch()
+        with bootprof.phase('first_epoch'):
+            self.next_epoch()
         self.set_ready()
+        # heavy plugin setup that asked to wait (lazy_init) runs from here on, off the main loop
+        bootprof.ready(self._config['main'].get('boot_profile', bootprof.REPORT_FILE))
 
     def recon(self):
         recon_time = self._config['personality']['recon_time']
@@ -159,16 +206,17 @@ class Agent(Client, Automata, AsyncAdvertiser):
 
         self._view.set('channel', '*')
 
-        if not channels:
-            self._current_channel = 0
-            logging.debug("RECON %ds", recon_time)
-            self.run('wifi.recon.channel clear')
-        else:
-            logging.debug("RECON %ds ON CHANNELS %s", recon_time, ','.join(map(str, channels)))
-            try:
-                self.run('wifi.recon.channel %s' % ','.join(map(str, channels)))
-            except Exception as e:
-                logging.exception("Error while setting wifi.recon.channels (%s)", e)
+        with metrics.phase('recon'):
+            if not channels:
+                self._current_channel = 0
+                logging.debug("RECON %ds", recon_time)
+                self.run('wifi.recon.channel clear')
+            else:
+                logging.debug("RECON %ds ON CHANNELS %s", recon_time, ','.join(map(str, channels)))
+                try:
+                    self.run('wifi.recon.channel %s' % ','.join(map(str, channels)))
+                except Exception as e:
+                    logging.exception("Error while setting wifi.recon.channels (%s)", e)
 
         self.wait_for(recon_time, sleeping=False)
 
@@ -179,7 +227,6 @@ class Agent(Client, Automata, AsyncAdvertiser):
         return self._access_points
 
     def get_access_points(self):
-        whitelist = self._config['main']['whitelist']
         aps = []
         try:
             s = self.session()
@@ -187,7 +234,7 @@ class Agent(Client, Automata, AsyncAdvertiser):
             for ap in s['wifi']['aps']:
                 if ap['encryption'] == '' or ap['encryption'] == 'OPEN':
                     continue
-                elif ap['hostname'] in whitelist or ap['mac'][:13].lower() in whitelist or ap['mac'].lower() in whitelist:
+                elif self._whitelist.match_ap(ap):
                     continue
                 else:
                     aps.append(ap)
@@ -207,25 +254,34 @@ class Agent(Client, Automata, AsyncAdvertiser):
         return self._current_channel
 
     def get_access_points_by_channel(self):
-        aps = self.get_access_points()
-        channels = self._config['personality']['channels']
-        grouped = {}
-
-        # group by channel
-        for ap in aps:
-            ch = ap['channel']
-            # if we're sticking to a channel, skip anything
-            # which is not on that channel
-            if channels and ch not in channels:
-                continue
-
-            if ch not in grouped:
-                grouped[ch] = [ap]
-            else:
-                grouped[ch].append(ap)
+        with metrics.phase('access_points_by_channel'):
+            aps = self.get_access_points()
+            channels = self._config['personality']['channels']
+            grouped = {}
+
+            # group by channel
+            for ap in aps:
+                ch = ap['channel']
+                # if we're sticking to a channel, skip anything
+                # which is not on that channel
+                if channels and ch not in channels:
+                    continue
+
+                if ch not in grouped:
+                    grouped[ch] = [ap]
+                else:
+                    grouped[ch].append(ap)
+
+            if self._channel_snapshots is not None:
+                scheduling.record_snapshot(self._channel_snapshots, aps)
 
-        # sort by more populated channels
-        return sorted(grouped.items(), key=lambda kv: len(kv[1]), reverse=True)
+            if self._channels is not None:
+                # by expected handshake yield, leaving out APs we already have
+                captured = [hs['ap'] for hs in list(self._handshakes.values()) if hs.get('ap')]
+                return self._channels.order(list(grouped.items()), captured)
+
+            # sort by more populated channels
+            return sorted(grouped.items(), key=lambda kv: len(kv[1]), reverse=True)
 
     def _find_ap_sta_in(self, station_mac, ap_mac, session):
         for ap in session['wifi']['aps']:
@@ -258,7 +314,8 @@ class Agent(Client, Automata, AsyncAdvertiser):
         if new_shakes > 0:
             self._epoch.track(handshake=True, inc=new_shakes)
 
-        tot = utils.total_unique_handshakes(self._config['bettercap']['handshakes'])
+        # captures compacted into the handshake pack still count, restored ones only once
+        tot = handshakepack.unique_count(self._config['bettercap']['handshakes'], self._pack)
         txt = '%d (%d)' % (len(self._handshakes), tot)
 
         if self._last_pwnd is not None:
@@ -313,73 +370,111 @@ class Agent(Client, Automata, AsyncAdvertiser):
         self._save_recovery_data()
         pwnagotchi.restart(mode)
 
+    def _recovery_state(self):
+        # plain dict copies; the event and stats threads keep mutating the originals
+        return {
+            'started_at': self._started_at,
+            'epoch': self._epoch.epoch,
+            'history': self._history.to_dict(),
+            'handshakes': dict(self._handshakes),
+            'last_pwnd': self._last_pwnd
+        }
+
     def _save_recovery_data(self):
         logging.warning("writing recovery data to %s ...", RECOVERY_DATA_FILE)
-        with open(RECOVERY_DATA_FILE, 'w') as fp:
-            data = {
-                'started_at': self._started_at,
-                'epoch': self._epoch.epoch,
-                'history': self._history,
-                'handshakes': self._handshakes,
-                'last_pwnd': self._last_pwnd
-            }
-            json.dump(data, fp)
+        self._recovery.snapshot(final=True)
 
     def _load_recovery_data(self, delete=True, no_exceptions=True):
         try:
-            with open(RECOVERY_DATA_FILE, 'rt') as fp:
-                data = json.load(fp)
-                logging.info("found recovery data: %s", data)
+            data = self._recovery.load()
+            if data is not None:
+                logging.info("found recovery data: %d handshakes, last pwnd %s",
+                             len(data['handshakes']), data['last_pwnd'])
                 self._started_at = data['started_at']
                 self._epoch.epoch = data['epoch']
                 self._handshakes = data['handshakes']
-                self._history = data['history']
+                self._history.load(data['history'])
                 self._last_pwnd = data['last_pwnd']
 
-                if delete:
-                    logging.info("deleting %s", RECOVERY_DATA_FILE)
-                    os.unlink(RECOVERY_DATA_FILE)
+            if delete:
+                logging.info("deleting %s", RECOVERY_DATA_FILE)
+                self._recovery.clear()
+                if data is not None:
+                    # the journal starts over, so carry the recovered state into a fresh snapshot
+                    self._recovery.snapshot()
+            self._recovery.record_session(self._started_at, self._epoch.epoch)
         except:
             if not no_exceptions:
                 raise
 
+    def _on_power_profile(self, profile, previous):
+        # poll bettercap (and redraw the stats) less often as the battery runs down
+        self._poller.set_scale(power.INTERVAL_SCALE[profile])
+
     def start_session_fetcher(self):
         #_thread.start_new_thread(self._fetch_stats, ())
         threading.Thread(target=self._fetch_stats, args=(), name="Session Fetcher", daemon=True).start()
 
+    def _handshakes_key(self):
+        if self._last_pwnd is not None and len(self._last_pwnd) > self._max_display_length:
+            # the last pwnd name is scrolling; every poll moves it
+            return None
+        try:
+            mtime = os.stat(self._config['bettercap']['handshakes']).st_mtime_ns
+        except OSError:
+            mtime = None
+        return len(self._handshakes), self._last_pwnd, mtime
+
     def _fetch_stats(self):
+        s = None
         while True:
-            try:
-                s = self.session()
-            except Exception as err:
-                logging.error("[agent:_fetch_stats] self.session: %s" % repr(err))
-
-            try:
-                self._update_uptime(s)
-            except Exception as err:
-                logging.error("[agent:_fetch_stats] self.update_uptimes: %s" % repr(err))
-
-            try:
-                self._update_advertisement(s)
-            except Exception as err:
-                logging.error("[agent:_fetch_stats] self.update_advertisements: %s" % repr(err))
-
-            try:
-                self._update_peers()
-            except Exception as err:
-                logging.error("[agent:_fetch_stats] self.update_peers: %s" % repr(err))
-            try:
-                self._update_counters()
-            except Exception as err:
-                logging.error("[agent:_fetch_stats] self.update_counters: %s" % repr(err))
-            try:
-                self._update_handshakes(0)
-            except Exception as err:
-                logging.error("[agent:_fetch_stats] self.update_handshakes: %s" % repr(err))
-
-            time.sleep(5)
+            with metrics.phase('fetch_stats'):
+                try:
+                    s = self.session()
+                except Exception as err:
+                    s = None
+                    logging.error("[agent:_fetch_stats] self.session: %s" % repr(err))
+
+                try:
+                    self._update_uptime(s)
+                except Exception as err:
+                    logging.error("[agent:_fetch_stats] self.update_uptimes: %s" % repr(err))
+
+                # the rest only runs when what it shows has changed
+                if self._skipper.changed('advertisement', (len(self._handshakes), self._epoch.epoch),
+                                         REFRESH_INTERVAL):
+                    try:
+                        self._update_advertisement(s)
+                    except Exception as err:
+                        logging.error("[agent:_fetch_stats] self.update_advertisements: %s" % repr(err))
+
+                if self._skipper.changed('peers', (self._closest_peer, len(self._peers)), REFRESH_INTERVAL):
+                    try:
+                        self._update_peers()
+                    except Exception as err:
+                        logging.error("[agent:_fetch_stats] self.update_peers: %s" % repr(err))
+                if self._skipper.changed('counters', (self._access_points, self._current_channel)):
+                    try:
+                        self._update_counters()
+                    except Exception as err:
+                        logging.error("[agent:_fetch_stats] self.update_counters: %s" % repr(err))
+                key = self._handshakes_key()
+                if key is None or self._skipper.changed('handshakes', key):
+                    try:
+                        self._update_handshakes(0)
+                    except Exception as err:
+                        logging.error("[agent:_fetch_stats] self.update_handshakes: %s" % repr(err))
+
+            # back off while nothing changes, events bring the next poll forward
+            self._poller.update((session_digest(s), len(self._handshakes), len(self._peers)))
+            self._poller.wait()
 
     async def _on_event(self, msg):
+        with metrics.phase('event'):
+            await self._handle_event(msg)
+        self._poller.poke()
+
+    async def _handle_event(self, msg):
         found_handshake = False
         jmsg = json.loads(msg)
 
@@ -395,17 +490,24 @@ class Agent(Client, Automata, AsyncAdvertiser):
             ap_mac = jmsg['data']['ap']
             key = "%s -> %s" % (sta_mac, ap_mac)
             if key not in self._handshakes:
-                self._handshakes[key] = jmsg
+                self._handshakes[key] = slim_handshake(jmsg)
+                self._recovery.record_handshake(key, self._handshakes[key])
                 s = self.session()
                 ap_and_station = self._find_ap_sta_in(sta_mac, ap_mac, s)
                 if ap_and_station is None:
                     logging.warning("!!! captured new handshake: %s !!!", key)
                     self._last_pwnd = ap_mac
+                    self._recovery.record_last_pwnd(self._last_pwnd)
+                    if self._channels is not None and self._current_channel:
+                        self._channels.record_handshake(self._current_channel)
                     plugins.on('handshake', self, filename, ap_mac, sta_mac)
                 else:
                     (ap, sta) = ap_and_station
                     self._last_pwnd = ap['hostname'] if ap['hostname'] != '' and ap[
                         'hostname'] != '<hidden>' else ap_mac
+                    self._recovery.record_last_pwnd(self._last_pwnd)
+                    if self._channels is not None:
+                        self._channels.record_handshake(ap['channel'])
                     logging.warning(
                         "!!! captured new handshake on channel %d, %d dBm: %s (%s) -> %s [%s (%s)] !!!",
                         ap['channel'], ap['rssi'], sta['mac'], sta['vendor'], ap['hostname'], ap['mac'], ap['vendor'])
@@ -454,14 +556,13 @@ class Agent(Client, Automata, AsyncAdvertiser):
         if self._has_handshake(who):
             return False
 
-        elif who not in self._history:
-            self._history[who] = 1
+        first = who not in self._history
+        count = self._history.hit(who)
+        self._recovery.record_interaction(who, round(count, 2))
+        if first:
             return True
 
-        else:
-            self._history[who] += 1
-
-        return self._history[who] < self._config['personality']['max_interactions']
+        return count < self._config['personality']['max_interactions']
 
     def associate(self, ap, throttle=-1):
         if self.is_stale():
@@ -476,7 +577,8 @@ class Agent(Client, Automata, AsyncAdvertiser):
             try:
                 logging.info("sending association frame to %s (%s %s) on channel %d [%d clients], %d dBm...",
                              ap['hostname'], ap['mac'], ap['vendor'], ap['channel'], len(ap['clients']), ap['rssi'])
-                self.run('wifi.assoc %s' % ap['mac'])
+                with metrics.phase('associate'):
+                    self.run('wifi.assoc %s' % ap['mac'])
                 self._epoch.track(assoc=True)
             except Exception as e:
                 self._on_error(ap['mac'], e)
@@ -501,7 +603,8 @@ class Agent(Client, Automata, AsyncAdvertiser):
                 logging.info("deauthing %s (%s) from %s (%s %s) on channel %d, %d dBm ...",
                              sta['mac'], sta['vendor'], ap['hostname'], ap['mac'], ap['vendor'], ap['channel'],
                              ap['rssi'])
-                self.run('wifi.deauth %s' % sta['mac'])
+                with metrics.phase('deauth'):
+                    self.run('wifi.deauth %s' % sta['mac'])
                 self._epoch.track(deauth=True)
             except Exception as e:
                 self._on_error(sta['mac'], e)
@@ -525,6 +628,8 @@ class Agent(Client, Automata, AsyncAdvertiser):
             wait = self._config['personality']['hop_recon_time']
         elif self._epoch.did_associate:
             wait = self._config['personality']['min_recon_time']
+        if self._channels is not None:
+            wait = int(round(self._channels.dwell(self._current_channel, wait)))
 
         if channel != self._current_channel:
             if self._current_channel != 0 and wait > 0:
@@ -536,8 +641,11 @@ class Agent(Client, Automata, AsyncAdvertiser):
             if verbose and self._epoch.any_activity:
                 logging.info("CHANNEL %d", channel)
             try:
-                self.run('wifi.recon.channel %d' % channel)
+                with metrics.phase('set_channel'):
+                    self.run('wifi.recon.channel %d' % channel)
                 self._current_channel = channel
+                if self._channels is not None:
+                    self._channels.visited(channel)
                 self._epoch.track(hop=True)
                 self._view.set('channel', '%d' % channel)
 
@@ -0,0 +1,301 @@
+import os
+import time
+import json
+import gzip
+import atexit
+import bisect
+import logging
+import threading
+from collections import deque
+
+# Incremental aggregator over the quickdic security audit log. It remembers
+# the inode, the first bytes and the offset it has consumed up to (inodes get
+# reused after rotation, the head does not), so every refresh only
+# parses lines appended since the last one (including the tail of a segment
+# that logwriter rotated away in between, and any whole segments rotated past
+# it). Every counter is updated as a line is ingested and only the wordlists
+# a line touched are recomputed, so neither refresh() nor snapshot() depends
+# on the size of the history. The state file is written at most every
+# SAVE_INTERVAL seconds (and at exit), not on every request.
+
+HEAD_BYTES = 64
+SAVE_INTERVAL = 60.0
+MAX_SEGMENTS = 100
+SCORE_BUCKETS = ('0-19', '20-39', '40-59', '60-79', '80-89', '90-100')
+
+_lock = threading.Lock()
+_savers = {}   # state path -> the AuditStats that writes it at exit
+
+
+def _save_all():
+    with _lock:
+        savers = list(_savers.values())
+    for stats in savers:
+        stats.save()
+
+
+atexit.register(_save_all)
+
+
+def _bucket(score):
+    if score >= 90:
+        return '90-100'
+    if score >= 80:
+        return '80-89'
+    return SCORE_BUCKETS[max(0, min(3, int(score) // 20))]
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return round(ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo), 2)
+
+
+class AuditStats(object):
+    def __init__(self, path, state_path=None, window=500):
+        self.path = path
+        self.state_path = state_path
+        self.window = window
+        self._lock = threading.Lock()
+        self._inode = None
+        self._head = ''
+        self._offset = 0
+        self._records = 0
+        self._cracked = 0
+        self._outcomes = deque(maxlen=window)     # 1 cracked, 0 not found
+        self._window_cracked = 0
+        self._crack_times = deque(maxlen=window)  # seconds to crack, in log order
+        self._sorted_times = []                   # the same window, sorted for percentiles
+        self._scores = dict.fromkeys(SCORE_BUCKETS, 0)
+        self._wordlists = {}
+        self._wordlist_stats = {}
+        self._touched = set()
+        self._dirty = False
+        self._last_save = time.time()
+        self._load_state()
+        self._window_cracked = sum(self._outcomes)
+        self._sorted_times = sorted(self._crack_times)
+        self._touched = set(self._wordlists)
+        self._update_wordlists()
+        if state_path:
+            # one exit save per state file: an instance built to replace this one takes its place
+            with _lock:
+                _savers[state_path] = self
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'rt') as fp:
+                state = json.load(fp)
+            self._inode = state['inode']
+            self._head = state['head']
+            self._offset = state['offset']
+            self._records = state['records']
+            self._cracked = state['cracked']
+            self._outcomes.extend(state['outcomes'])
+            self._crack_times.extend(state['crack_times'])
+            self._scores.update(state['scores'])
+            self._wordlists = state['wordlists']
+        except Exception as e:
+            logging.warning("[auditstats] ignoring unreadable state %s: %s", self.state_path, e)
+
+    def _save_state(self):
+        state = {
+            'inode': self._inode,
+            'head': self._head,
+            'offset': self._offset,
+            'records': self._records,
+            'cracked': self._cracked,
+            'outcomes': list(self._outcomes),
+            'crack_times': list(self._crack_times),
+            'scores': self._scores,
+            'wordlists': self._wordlists,
+        }
+        tmp = '%s.tmp' % self.state_path
+        with open(tmp, 'wt') as fp:
+            json.dump(state, fp)
+        os.replace(tmp, self.state_path)
+
+    def save(self):
+        """Write the state file if anything was ingested since the last write."""
+        with self._lock:
+            if not self.state_path or not self._dirty:
+                return
+            try:
+                self._save_state()
+                self._dirty = False
+            except Exception as e:
+                logging.error("[auditstats] error saving state: %s", e)
+            self._last_save = time.time()
+
+    def _wordlist(self, name):
+        wl = self._wordlists.get(name)
+        if wl is None:
+            wl = self._wordlists[name] = {'tried': 0, 'hits': 0, 'seconds': 0.0,
+                                          'scores': dict.fromkeys(SCORE_BUCKETS, 0)}
+        return wl
+
+    def _ingest(self, record):
+        cracked = record.get('result', 'KEY NOT FOUND') != 'KEY NOT FOUND'
+        score = record.get('security_score', 0)
+        bucket = _bucket(score)
+
+        self._records += 1
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._window_cracked -= self._outcomes[0]
+        self._outcomes.append(1 if cracked else 0)
+        self._window_cracked += 1 if cracked else 0
+        self._scores[bucket] += 1
+        if cracked:
+            self._cracked += 1
+            taken = float(record.get('time_taken', 0))
+            if len(self._crack_times) == self._crack_times.maxlen:
+                oldest = self._crack_times[0]
+                del self._sorted_times[bisect.bisect_left(self._sorted_times, oldest)]
+            self._crack_times.append(taken)
+            bisect.insort(self._sorted_times, taken)
+
+        cracked_by = set(record.get('cracked_by') or ())
+        seconds = record.get('wordlist_seconds') or {}
+        for name in record.get('wordlists') or ():
+            wl = self._wordlist(name)
+            wl['tried'] += 1
+            wl['seconds'] += float(seconds.get(name, 0))
+            wl['scores'][bucket] += 1
+            if name in cracked_by:
+                wl['hits'] += 1
+            self._touched.add(name)
+
+    def _consume(self, fp):
+        """Ingest every complete line from fp's position, returning bytes consumed."""
+        consumed = 0
+        for raw in fp:
+            if not raw.endswith(b'\n'):
+                break
+            consumed += len(raw)
+            try:
+                self._ingest(json.loads(raw))
+            except ValueError:
+                logging.debug("[auditstats] skipping malformed line in %s", self.path)
+        return consumed
+
+    def _segments(self):
+        # logwriter shifts rotated segments to <path>.1(.gz), .2(.gz), ... newest first
+        found = []
+        for n in range(1, MAX_SEGMENTS + 1):
+            for name in ('%s.%d.gz' % (self.path, n), '%s.%d' % (self.path, n)):
+                if os.path.exists(name):
+                    found.append(name)
+                    break
+            else:
+                break
+        return found
+
+    @staticmethod
+    def _open_segment(name):
+        return gzip.open(name, 'rb') if name.endswith('.gz') else open(name, 'rb')
+
+    def _finish_rotated(self):
+        """Finish the segment we were reading and ingest every segment rotated after it."""
+        if self._offset <= 0:
+            return
+        segments = self._segments()
+        for i, name in enumerate(segments):
+            try:
+                with self._open_segment(name) as fp:
+                    head = fp.read(HEAD_BYTES).decode('utf-8', 'replace')
+                    if not head.startswith(self._head):
+                        continue
+                    fp.seek(self._offset)
+                    self._consume(fp)
+                # the newer segments in between were never read at all
+                for newer in reversed(segments[:i]):
+                    with self._open_segment(newer) as fp:
+                        self._consume(fp)
+                return
+            except Exception as e:
+                logging.debug("[auditstats] could not finish rotated segment %s: %s", name, e)
+                return
+        logging.debug("[auditstats] segment at offset %d of %s was rotated out of reach", self._offset, self.path)
+
+    def _rotated_away(self, st, fp):
+        if self._inode != st.st_ino or st.st_size < self._offset:
+            return True
+        head = fp.read(HEAD_BYTES).decode('utf-8', 'replace')
+        return not head.startswith(self._head)
+
+    def refresh(self):
+        """Read anything appended since the last call. Returns True if stats changed."""
+        with self._lock:
+            before = self._records
+            try:
+                fp = open(self.path, 'rb')
+            except OSError:
+                # rotated and not yet reopened by the writer
+                if self._offset:
+                    self._finish_rotated()
+                    self._inode, self._head, self._offset = None, '', 0
+                fp = None
+
+            if fp is not None:
+                with fp:
+                    st = os.fstat(fp.fileno())
+                    if self._offset and self._rotated_away(st, fp):
+                        self._finish_rotated()
+                        self._offset = 0
+                    if self._offset == 0:
+                        self._inode = st.st_ino
+                        fp.seek(0)
+                        self._head = fp.read(HEAD_BYTES).decode('utf-8', 'replace')
+                    if st.st_size > self._offset:
+                        fp.seek(self._offset)
+                        self._offset += self._consume(fp)
+
+            if self._records == before:
+                return False
+            self._update_wordlists()
+            self._dirty = True
+            due = time.time() - self._last_save >= SAVE_INTERVAL
+        if due:
+            self.save()
+        return True
+
+    def _update_wordlists(self):
+        # only the wordlists the new lines mentioned
+        for name in self._touched:
+            wl = self._wordlists[name]
+            hours = wl['seconds'] / 3600.0
+            self._wordlist_stats[name] = {
+                'tried': wl['tried'],
+                'hits': wl['hits'],
+                'crack_rate': round(wl['hits'] / wl['tried'], 4) if wl['tried'] else 0.0,
+                'cpu_seconds': round(wl['seconds'], 1),
+                'hits_per_hour': round(wl['hits'] / hours, 3) if hours > 0 else None,
+                'scores': dict(wl['scores']),
+            }
+        self._touched = set()
+
+    def snapshot(self):
+        with self._lock:
+            times = self._sorted_times
+            return {
+                'records': self._records,
+                'cracked': self._cracked,
+                'crack_rate': round(self._cracked / self._records, 4) if self._records else 0.0,
+                'window': {
+                    'size': len(self._outcomes),
+                    'crack_rate': round(self._window_cracked / len(self._outcomes), 4) if self._outcomes else 0.0,
+                    'time_to_crack': {
+                        'p50': _percentile(times, 50),
+                        'p90': _percentile(times, 90),
+                        'p99': _percentile(times, 99),
+                        'max': times[-1] if times else None,
+                    },
+                },
+                'scores': dict(self._scores),
+                'wordlists': dict(self._wordlist_stats),
+            }
@@ -0,0 +1,294 @@
+import sys
+import time
+import gzip
+import json
+import zlib
+import base64
+import bisect
+import atexit
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+
+# Bettercap recorder and stand-in server, so the agent can be profiled and
+# regression tested without a radio.
+#
+# Recording: with bettercap.record set in config.toml the agent logs every
+# session() response, every websocket event and every command it runs to a
+# gzipped JSON lines file. Repeated identical session responses are stored
+# as a one line marker.
+#
+# Replay: `python3 -m pwnagotchi.bcapsim serve rec.jsonl.gz --speed 10`
+# answers the agent's REST calls with the session that was current at the
+# same (scaled) point of the recording and pushes the recorded events over
+# a websocket at their original (scaled) times. Point bettercap.hostname /
+# bettercap.port at it. Only the standard library is used.
+
+FLUSH_INTERVAL = 10.0
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class Recorder(object):
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self.repeats = 0
+        self._fp = gzip.open(path, 'at')
+        self._lock = threading.Lock()
+        self._last_digest = {}
+        self._last_flush = time.time()
+        atexit.register(self.close)
+
+    def _write(self, record):
+        record['t'] = round(time.time(), 3)
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._fp is None:
+                return
+            self._fp.write(line)
+            self.records += 1
+            if time.time() - self._last_flush >= FLUSH_INTERVAL:
+                # a sync flush keeps everything so far readable if we die
+                self._fp.flush(zlib.Z_SYNC_FLUSH)
+                self._last_flush = time.time()
+
+    def session(self, sess, data):
+        digest = hashlib.blake2b(json.dumps(data, sort_keys=True).encode('utf-8'), digest_size=16).digest()
+        if self._last_digest.get(sess) == digest:
+            self.repeats += 1
+            self._write({'k': 'session', 'p': sess, 'same': True})
+            return
+        self._last_digest[sess] = digest
+        self._write({'k': 'session', 'p': sess, 'd': data})
+
+    def event(self, msg):
+        self._write({'k': 'event', 'd': msg})
+
+    def command(self, cmd):
+        self._write({'k': 'run', 'd': cmd})
+
+    def close(self):
+        with self._lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+
+def install(agent, path):
+    """Record agent's bettercap traffic to path by wrapping its client methods on the instance."""
+    recorder = Recorder(path)
+    session, run, on_event = agent.session, agent.run, agent._on_event
+
+    def recorded_session(sess="session"):
+        data = session(sess)
+        recorder.session(sess, data)
+        return data
+
+    def recorded_run(command, *args, **kwargs):
+        recorder.command(command)
+        return run(command, *args, **kwargs)
+
+    async def recorded_on_event(msg):
+        recorder.event(msg)
+        return await on_event(msg)
+
+    agent.session = recorded_session
+    agent.run = recorded_run
+    agent._on_event = recorded_on_event
+    logging.info("recording bettercap traffic to %s", path)
+    return recorder
+
+
+def load(path):
+    """Recording as (sessions by path: [(t, data)], events: [(t, msg)], start, end)."""
+    sessions = {}
+    events = []
+    start = end = None
+    with gzip.open(path, 'rt') as fp:
+        try:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                t = record['t']
+                start = t if start is None else start
+                end = t
+                if record['k'] == 'session':
+                    timeline = sessions.setdefault(record['p'], [])
+                    if record.get('same') and timeline:
+                        continue
+                    timeline.append((t, record.get('d')))
+                elif record['k'] == 'event':
+                    events.append((t, record['d']))
+        except (EOFError, OSError, zlib.error):
+            # recording cut short; use what was flushed
+            pass
+    return sessions, events, start or 0.0, end or 0.0
+
+
+class ReplayServer(object):
+    def __init__(self, path, speed=1.0, loop=False):
+        self.sessions, self.events, self.start, self.end = load(path)
+        self.speed = speed
+        self.loop = loop
+        self.commands = 0
+        self._event_times = [t for t, _ in self.events]
+        self._t0 = None
+
+    def clock(self):
+        """Recording time that corresponds to now."""
+        if self._t0 is None:
+            self._t0 = time.time()
+        elapsed = (time.time() - self._t0) * self.speed
+        span = max(self.end - self.start, 1e-3)
+        if self.loop:
+            elapsed %= span
+        return self.start + elapsed
+
+    def session_at(self, sess, t):
+        timeline = self.sessions.get(sess) or self.sessions.get('session') or [(0, {})]
+        # before the first recorded session, serve the first one
+        return timeline[max(0, bisect.bisect_right(timeline, t, key=lambda entry: entry[0]) - 1)][1]
+
+    async def _http(self, writer, status, body, content_type='application/json'):
+        data = body.encode('utf-8')
+        writer.write(('HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: keep-alive\r\n\r\n'
+                      % (status, content_type, len(data))).encode('ascii') + data)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    return
+                method, target, _ = request.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0) or 0))
+                path = target.split('?', 1)[0].rstrip('/')
+
+                if path.endswith('/events') and headers.get('upgrade', '').lower() == 'websocket':
+                    await self._websocket(reader, writer, headers)
+                    return
+                if method == 'GET' and path.startswith('/api/'):
+                    sess = path[len('/api/'):]
+                    await self._http(writer, '200 OK', json.dumps(self.session_at(sess, self.clock())))
+                elif method == 'POST' and path == '/api/session':
+                    self.commands += 1
+                    logging.debug("command: %s", json.loads(body or b'{}').get('cmd'))
+                    await self._http(writer, '200 OK', json.dumps({'success': True, 'msg': ''}))
+                else:
+                    await self._http(writer, '404 Not Found', '{}')
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _frame(opcode, payload):
+        n = len(payload)
+        if n < 126:
+            head = bytes((0x80 | opcode, n))
+        elif n < 65536:
+            head = bytes((0x80 | opcode, 126)) + n.to_bytes(2, 'big')
+        else:
+            head = bytes((0x80 | opcode, 127)) + n.to_bytes(8, 'big')
+        return head + payload
+
+    async def _control(self, reader, writer, closed):
+        # answer the client's pings and notice when it goes away
+        try:
+            while True:
+                b1, b2 = await reader.readexactly(2)
+                n = b2 & 0x7f
+                if n == 126:
+                    n = int.from_bytes(await reader.readexactly(2), 'big')
+                elif n == 127:
+                    n = int.from_bytes(await reader.readexactly(8), 'big')
+                mask = await reader.readexactly(4) if b2 & 0x80 else b'\0\0\0\0'
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(n)))
+                opcode = b1 & 0x0f
+                if opcode == 0x9:
+                    writer.write(self._frame(0xA, payload))
+                elif opcode == 0x8:
+                    writer.write(self._frame(0x8, payload[:2]))
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        closed.set()
+
+    async def _websocket(self, reader, writer, headers):
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WS_GUID).encode('ascii')).digest())
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        await writer.drain()
+
+        closed = asyncio.Event()
+        control = asyncio.ensure_future(self._control(reader, writer, closed))
+        sent = 0
+        try:
+            while not closed.is_set():
+                now = self.clock()
+                due = bisect.bisect_right(self._event_times, now)
+                if due < sent:
+                    # looped back to the start of the recording
+                    sent = 0
+                for _, msg in self.events[sent:due]:
+                    writer.write(self._frame(0x1, msg.encode('utf-8')))
+                sent = due
+                await writer.drain()
+                if not self.loop and now >= self.end and sent == len(self.events):
+                    await closed.wait()
+                    break
+                await asyncio.sleep(0.05)
+        except ConnectionError:
+            pass
+        finally:
+            control.cancel()
+
+    async def serve(self, host='127.0.0.1', port=8081):
+        server = await asyncio.start_server(self._handle, host, port)
+        logging.info("replaying %d sessions / %d events (%.0fs recorded) at %sx on %s:%d",
+                     sum(len(t) for t in self.sessions.values()), len(self.events),
+                     self.end - self.start, self.speed, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pwnagotchi.bcapsim', description='bettercap recording replay')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='serve a recording to the agent')
+    serve.add_argument('recording')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8081)
+    serve.add_argument('--speed', type=float, default=1.0, help='replay speed factor')
+    serve.add_argument('--loop', action='store_true', help='start over at the end of the recording')
+    info = sub.add_parser('info', help='summarize a recording')
+    info.add_argument('recording')
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        sessions, events, start, end = load(args.recording)
+        print(json.dumps({'seconds': round(end - start, 1), 'events': len(events),
+                          'sessions': {p: len(t) for p, t in sessions.items()}}, indent=2))
+        return 0
+    try:
+        asyncio.run(ReplayServer(args.recording, args.speed, args.loop).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
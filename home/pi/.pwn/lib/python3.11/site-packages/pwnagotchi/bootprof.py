@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from pwnagotchi.hooktimer import HookTimer
+
+# Boot profiler. Agent startup is split into named phases, and the plugin
+# callbacks that run between install() and ready() (on_ui_setup, on_ready,
+# the first epoch's hooks, ...) are timed per plugin through a HookTimer.
+# When the agent calls ready() the report is written out and the deferred
+# queue - heavy plugin setup that asked to run later with defer() - is
+# drained on a background thread, so dpkg checks, wordlist scans and I2C
+# probing no longer hold up the face; each deferred task is timed as a phase.
+#
+# install() is called by the Agent constructor. Plugins are loaded before
+# the agent exists, so on_loaded itself is not timed.
+
+REPORT_FILE = '/var/tmp/pwnagotchi/boot_profile.json'
+
+_lock = threading.Lock()
+_imported_at = time.time()
+_phases = []
+_plugins = {}
+_deferred = []
+_ready_at = None
+_report_path = REPORT_FILE
+
+
+def _process_started_at():
+    # /proc/self/stat field 22 is the start time in clock ticks since boot
+    try:
+        with open('/proc/self/stat', 'rt') as fp:
+            ticks = int(fp.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'rt') as fp:
+            uptime = float(fp.read().split()[0])
+        return time.time() - uptime + ticks / os.sysconf('SC_CLK_TCK')
+    except Exception:
+        return _imported_at
+
+
+_started_at = _process_started_at()
+
+
+@contextmanager
+def phase(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        with _lock:
+            _phases.append((name, start, time.time()))
+
+
+def _observe(plugin_name, event_name, seconds):
+    key = '%s.on_%s' % (plugin_name, event_name)
+    with _lock:
+        _plugins[key] = _plugins.get(key, 0.0) + seconds
+
+
+_timer = HookTimer(_observe)
+
+
+def install():
+    """Time plugin callbacks until ready()."""
+    with _lock:
+        if _ready_at is not None:
+            return
+    _timer.install()
+
+
+def defer(callback, name=None):
+    """Run callback after the agent is ready (right away, off-thread, if it already is)."""
+    name = name or getattr(callback, '__qualname__', repr(callback))
+    with _lock:
+        if _ready_at is None:
+            _deferred.append((name, callback))
+            return
+    threading.Thread(target=_run, args=([(name, callback)],), name="Deferred init", daemon=True).start()
+
+
+def _run(tasks):
+    for name, callback in tasks:
+        start = time.time()
+        try:
+            callback()
+        except Exception as e:
+            logging.error("[bootprof] deferred %s failed: %s", name, e)
+        finally:
+            with _lock:
+                _phases.append(('deferred:%s' % name, start, time.time()))
+    if tasks:
+        logging.info("[bootprof] %d deferred tasks done", len(tasks))
+        write_report(_report_path)
+
+
+def report():
+    with _lock:
+        phases = [{'phase': name, 'start': round(start - _started_at, 3), 'seconds': round(end - start, 3)}
+                  for name, start, end in _phases]
+        slowest = sorted(_plugins.items(), key=lambda kv: -kv[1])
+        return {
+            'process_started_at': _started_at,
+            'ready_after': round(_ready_at - _started_at, 3) if _ready_at else None,
+            'phases': phases,
+            'plugins': [{'callback': key, 'seconds': round(seconds, 3)} for key, seconds in slowest],
+            'deferred_pending': [name for name, _ in _deferred],
+        }
+
+
+def write_report(path=None):
+    path = path or _report_path
+    data = report()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '%s.tmp' % path
+        with open(tmp, 'wt') as fp:
+            json.dump(data, fp, indent=2)
+        os.replace(tmp, path)
+    except Exception as e:
+        logging.error("[bootprof] error writing %s: %s", path, e)
+    return data
+
+
+def ready(path=REPORT_FILE):
+    """Mark the agent ready: stop timing plugins, write the report and drain the deferred queue."""
+    global _ready_at, _report_path
+    with _lock:
+        if _ready_at is not None:
+            return
+        _ready_at = time.time()
+        _report_path = path
+    _timer.uninstall()
+    data = write_report(path)
+    slow = ', '.join('%s %.1fs' % (p['callback'], p['seconds']) for p in data['plugins'][:3])
+    logging.info("[bootprof] ready %.1fs after start (slowest plugins: %s)", data['ready_after'], slow or 'none')
+
+    with _lock:
+        tasks = list(_deferred)
+        del _deferred[:]
+    if tasks:
+        threading.Thread(target=_run, args=(tasks,), name="Deferred init", daemon=True).start()
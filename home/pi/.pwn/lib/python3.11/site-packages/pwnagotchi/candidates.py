@@ -0,0 +1,294 @@
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from pwnagotchi import wordlistio
+
+# Rule-based candidate generation for the quickdic pre-wordlist stage.
+# Candidates derived from the ESSID, the BSSID and a few vendor default
+# formats are produced in rough order of likelihood and cut at a budget,
+# so the stage costs well under a second of aircrack-ng time.
+#
+# PotfileCandidates is the reuse stage in front of it: every password already
+# cracked (quickdic's and wpa-sec's potfiles), those seen on the most networks
+# first. The potfiles are tailed from the last offset read, so keeping the set
+# current costs a stat() per handshake.
+
+WPA_MIN = 8
+WPA_MAX = 63
+
+DIGIT_SUFFIXES = ('1', '12', '123', '1234', '12345', '123456', '01', '!', '1!', '123!', '@123', '2.4', '5g')
+POTFILE_MAX = 500
+
+SSID_NOISE = re.compile(r'[\s_\-.]*(2\.4|2g|5g|5ghz|2\.4ghz|ext|extender|guest|plus|home|wifi|wlan)$', re.IGNORECASE)
+
+# vendor substring (lowercase) -> BSSID derived default formats worth trying
+VENDOR_FORMATS = {
+    'tp-link': ('tail8', 'tail8_upper'),
+    'tplink': ('tail8', 'tail8_upper'),
+    'huawei': ('tail8_upper', 'mac_upper'),
+    'zte': ('tail8_upper', 'mac_upper'),
+    'technicolor': ('tail8_upper', 'tail10_upper'),
+    'thomson': ('tail10_upper',),
+    'arris': ('mac', 'mac_upper'),
+    'sagemcom': ('tail8_upper', 'mac_upper'),
+    'avm': ('tail8',),
+    'netgear': ('mac', 'mac_upper'),
+    'belkin': ('tail8', 'mac'),
+    'd-link': ('tail8', 'mac'),
+    'zyxel': ('tail8_upper', 'mac_upper'),
+}
+
+
+# potfile lines start with bssid:station, both with or without colons (wpa-sec
+# writes bare hex, quickdic aircrack-ng's AA:BB:..); quickdic appends
+# :lat:lon:alt:isotimestamp after the password
+_POT_MAC = r'[0-9A-Fa-f]{2}(?::?[0-9A-Fa-f]{2}){5}'
+_POT_HEAD = re.compile(r'^(%s):(?:%s|[^:]*):' % (_POT_MAC, _POT_MAC))
+_POT_TAIL = re.compile(r':[^:]*:[^:]*:[^:]*:\d{4}-\d\d-\d\dT[\d:.+\-]+$')
+
+
+def potfile_entry(line):
+    """(bssid, password) from a quickdic or wpa-sec potfile line, or None."""
+    line = line.rstrip('\r\n')
+    head = _POT_HEAD.match(line)
+    if head is None:
+        return None
+    rest = line[head.end():]
+    tail = _POT_TAIL.search(rest)
+    if tail is not None:
+        rest = rest[:tail.start()]
+    # an ESSID with a colon in it is ambiguous; passwords are taken as what follows the first one
+    _, sep, password = rest.partition(':')
+    if tail is not None and password.startswith(' ') and password.endswith(' '):
+        # quickdic stores the inside of aircrack-ng's "[ key ]" as is
+        password = password[1:-1]
+    if not sep or not WPA_MIN <= len(password) <= WPA_MAX:
+        return None
+    return re.sub(r'[^0-9a-f]', '', head.group(1).lower()), password
+
+
+def _mac_forms(bssid):
+    mac = re.sub(r'[^0-9a-fA-F]', '', bssid or '').lower()
+    if len(mac) != 12:
+        return {}
+    forms = {'mac': mac, 'mac_upper': mac.upper()}
+    for n in (4, 6, 8, 10):
+        forms['tail%d' % n] = mac[-n:]
+        forms['tail%d_upper' % n] = mac[-n:].upper()
+    return forms
+
+
+def _bases(essid):
+    bases = []
+    if not essid or essid in ('<hidden>', 'Unknown'):
+        return bases
+    stripped = SSID_NOISE.sub('', essid)
+    compact = re.sub(r'[\s_\-.]+', '', stripped)
+    for word in (essid, stripped, compact) + tuple(re.split(r'[\s_\-.]+', stripped)):
+        if not word:
+            continue
+        for form in (word, word.lower(), word.upper(), word.capitalize()):
+            if form not in bases:
+                bases.append(form)
+    return bases
+
+
+def essid_candidates(essid, bssid, vendor='', budget=500, years=30):
+    """Bounded, deduplicated password candidates for one network, most likely first."""
+    out = []
+    seen = set()
+
+    def emit(candidate):
+        if WPA_MIN <= len(candidate) <= WPA_MAX and candidate not in seen:
+            seen.add(candidate)
+            out.append(candidate)
+        return len(out) >= budget
+
+    macs = _mac_forms(bssid)
+    vendor = (vendor or '').lower()
+    formats = []
+    for name, fmts in VENDOR_FORMATS.items():
+        if name in vendor:
+            formats.extend(f for f in fmts if f not in formats)
+
+    # vendor defaults and bare BSSID forms are cheap and surprisingly common
+    for fmt in formats + ['tail8', 'tail8_upper', 'mac', 'mac_upper']:
+        if fmt in macs and emit(macs[fmt]):
+            return out
+
+    bases = _bases(essid)
+    this_year = datetime.now().year
+    year_forms = [str(y) for y in range(this_year, this_year - years, -1)]
+    year_forms += [y[2:] for y in year_forms]
+
+    for base in bases:
+        if emit(base):
+            return out
+    for suffix in DIGIT_SUFFIXES:
+        for base in bases:
+            if emit(base + suffix):
+                return out
+    for year in year_forms:
+        for base in bases:
+            if emit(base + year):
+                return out
+    for base in bases:
+        if emit(base + base):
+            return out
+    for base in bases:
+        for tail in ('tail4', 'tail4_upper', 'tail6', 'tail6_upper'):
+            if tail in macs and (emit(base + macs[tail]) or emit(macs[tail] + base)):
+                return out
+    for base in bases:
+        for n in range(1000):
+            if emit('%s%03d' % (base, n)):
+                return out
+    return out
+
+
+class WordlistBloom(object):
+    """Compact membership filter over wordlist lines, rebuilt only when the lists change."""
+
+    def __init__(self, path, error_rate=0.01):
+        self.path = path
+        self.error_rate = error_rate
+        self.manifest = None
+        self.ready = False
+        self._bits = None
+        self._m = 0
+        self._k = 0
+        self._lock = threading.Lock()
+
+    def _hashes(self, line):
+        digest = hashlib.blake2b(line, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self._m for i in range(self._k))
+
+    def __contains__(self, candidate):
+        if not self.ready:
+            return False
+        return all(self._bits[h >> 3] & (1 << (h & 7)) for h in self._hashes(candidate.encode('utf-8')))
+
+    def _load(self, manifest):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as fp:
+            header = json.loads(fp.readline())
+            if header.get('manifest') != manifest:
+                return False
+            self._m, self._k = header['m'], header['k']
+            self._bits = bytearray(fp.read())
+        return len(self._bits) * 8 >= self._m
+
+    def build(self, paths, max_lines=2000000):
+        """Load the cached filter for paths, or stream them into a new one."""
+        manifest = []
+        for path in paths:
+            st = os.stat(path)
+            manifest.append([os.path.basename(path), st.st_size, int(st.st_mtime)])
+
+        with self._lock:
+            try:
+                if self._load(manifest):
+                    self.manifest, self.ready = manifest, True
+                    return
+            except Exception as e:
+                logging.debug("[candidates] discarding bloom cache %s: %s", self.path, e)
+
+            self.ready = False
+            n = max(1, max_lines)
+            self._m = int(-n * math.log(self.error_rate) / (math.log(2) ** 2))
+            self._k = max(1, round(self._m / n * math.log(2)))
+            self._bits = bytearray((self._m + 7) // 8)
+
+            lines = 0
+            for path in paths:
+                with wordlistio.open_wordlist(path) as fp:
+                    for line in fp:
+                        for h in self._hashes(line.rstrip(b'\r\n')):
+                            self._bits[h >> 3] |= 1 << (h & 7)
+                        lines += 1
+                        if lines >= max_lines:
+                            break
+                if lines >= max_lines:
+                    logging.info("[candidates] bloom filter capped at %d lines", max_lines)
+                    break
+
+            tmp = '%s.tmp' % self.path
+            with open(tmp, 'wb') as fp:
+                fp.write((json.dumps({'manifest': manifest, 'm': self._m, 'k': self._k}) + '\n').encode('utf-8'))
+                fp.write(self._bits)
+            os.replace(tmp, self.path)
+
+            self.manifest, self.ready = manifest, True
+            logging.info("[candidates] bloom filter built over %d lines (%d KB)", lines, len(self._bits) // 1024)
+
+
+class PotfileCandidates(object):
+    """Passwords cracked before, from any potfile, most reused first."""
+
+    def __init__(self, paths, limit=POTFILE_MAX):
+        self.paths = list(paths)
+        self.limit = limit
+        self._offsets = {}     # path -> (inode, offset read up to)
+        self._networks = {}    # password -> bssids it cracked
+        self._seen = {}        # password -> sequence number of its latest crack
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def add(self, bssid, password):
+        if not WPA_MIN <= len(password) <= WPA_MAX:
+            return
+        with self._lock:
+            self._seq += 1
+            self._networks.setdefault(password, set()).add(re.sub(r'[^0-9a-f]', '', (bssid or '').lower()))
+            self._seen[password] = self._seq
+
+    def _tail(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        inode, offset = self._offsets.get(path, (None, 0))
+        if inode != st.st_ino or st.st_size < offset:
+            # new or rewritten (wpa-sec replaces its potfile on download); entries are sets, so
+            # reading it all again does not count anything twice
+            offset = 0
+        if st.st_size == offset:
+            self._offsets[path] = (st.st_ino, offset)
+            return
+        with open(path, 'rb') as fp:
+            fp.seek(offset)
+            data = fp.read()
+        # a line still being written is read on the next refresh
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].decode('utf-8', 'replace').splitlines():
+            entry = potfile_entry(line)
+            if entry is not None:
+                self.add(*entry)
+        self._offsets[path] = (st.st_ino, offset + end)
+
+    def refresh(self):
+        """Pick up lines appended to the potfiles since the last call."""
+        for path in self.paths:
+            try:
+                self._tail(path)
+            except Exception as e:
+                logging.debug("[candidates] error reading potfile %s: %s", path, e)
+
+    def candidates(self):
+        self.refresh()
+        with self._lock:
+            ranked = sorted(self._networks, key=lambda pwd: (len(self._networks[pwd]), self._seen[pwd]), reverse=True)
+        return ranked[:self.limit]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._networks)
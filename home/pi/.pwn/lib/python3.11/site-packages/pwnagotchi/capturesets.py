@@ -0,0 +1,111 @@
+import os
+import re
+import hashlib
+import logging
+from collections import namedtuple
+
+from pwnagotchi import pcapcache
+
+# Handshake consolidation. The handshakes directory collects several captures
+# of the same AP over time (other sessions, a renamed or hidden ESSID, copies
+# from another unit); cracking each of them tests the same key again. Here
+# captures are grouped by BSSID (by ESSID when the capture has no BSSID) and
+# each group is reduced to the one capture worth cracking: full 4-way over
+# PMKID over partial. A capture that was already processed wins a tie, so a
+# network is not tested again for an equal capture. When no member has a full
+# handshake on its own, the members' records are concatenated into one pcap -
+# M1/M2 from one session and M3/M4 from another make a full handshake - and
+# the merged capture is used if it parses to something better. It holds every
+# member's frames, so aircrack-ng still finds whatever each member had.
+#
+# Everything else in the group is redundant: it can never crack a key the
+# selected capture would not.
+
+Selection = namedtuple('Selection', ('key', 'essid', 'path', 'kind', 'members', 'redundant', 'merged'))
+
+
+def group_key(meta, path):
+    if meta.get('bssid'):
+        return meta['bssid'].lower()
+    if meta.get('essid'):
+        return 'essid:%s' % meta['essid']
+    # nothing to tell it apart by; a group of its own
+    return 'file:%s' % os.path.abspath(path)
+
+
+def _rank(meta):
+    return pcapcache.HANDSHAKE_RANK.get(meta['handshake'], 0), bool(meta.get('pmkid'))
+
+
+def group(paths, cache=None):
+    """{group key: [(path, meta), ...]} for the captures pcapcache can describe."""
+    cache = cache or pcapcache.default()
+    groups = {}
+    for path in paths:
+        meta = cache.get(path)
+        if meta is None:
+            continue
+        groups.setdefault(group_key(meta, path), []).append((path, meta))
+    return groups
+
+
+def _merged_path(merge_dir, key, members):
+    # named after the group and the exact member contents, so it is rebuilt only when a member changes
+    digest = hashlib.blake2b(digest_size=6)
+    for path, _ in members:
+        digest.update(pcapcache.PcapCache.key(path).encode('utf-8'))
+    stem = re.sub(r'[^0-9A-Za-z]', '', key)[:32] or 'capture'
+    return os.path.join(merge_dir, '%s_%s.pcap' % (stem, digest.hexdigest())), stem
+
+
+def _merge(merge_dir, key, members, cache):
+    path, stem = _merged_path(merge_dir, key, members)
+    if not os.path.exists(path):
+        os.makedirs(merge_dir, exist_ok=True)
+        # an older merge of this group is superseded by this one
+        for name in os.listdir(merge_dir):
+            if name.startswith(stem + '_') and name.endswith('.pcap'):
+                os.unlink(os.path.join(merge_dir, name))
+        if not pcapcache.merge([p for p, _ in members], path):
+            return None, None
+    meta = cache.get(path)
+    return (path, meta) if meta is not None else (None, None)
+
+
+def select(key, members, processed=None, merge_dir=None, cache=None):
+    """The Selection for one group of (path, meta) captures."""
+    cache = cache or pcapcache.default()
+    processed = processed or (lambda path: False)
+
+    def score(item):
+        path, meta = item
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = 0
+        return _rank(meta), processed(path), mtime
+
+    path, meta = max(members, key=score)
+    merged = False
+    useful = [(p, m) for p, m in members if m['handshake'] in ('partial', 'pmkid')]
+    if merge_dir and meta['handshake'] != 'full' and len(useful) > 1:
+        try:
+            merged_path, merged_meta = _merge(merge_dir, key, useful, cache)
+        except (OSError, ValueError) as e:
+            logging.debug("[capturesets] cannot merge %s: %s", key, e)
+            merged_path = merged_meta = None
+        if merged_meta is not None and _rank(merged_meta) > _rank(meta):
+            logging.info("[capturesets] merged %d captures of %s into a %s handshake",
+                         len(useful), key, merged_meta['handshake'])
+            path, meta, merged = merged_path, merged_meta, True
+
+    essid = meta.get('essid') or next((m['essid'] for _, m in members if m.get('essid')), '')
+    return Selection(key, essid, path, meta['handshake'], [p for p, _ in members],
+                     [p for p, _ in members if p != path], merged)
+
+
+def consolidate(paths, processed=None, merge_dir=None, cache=None):
+    """One Selection per network among paths."""
+    cache = cache or pcapcache.default()
+    return [select(key, members, processed, merge_dir, cache)
+            for key, members in group(paths, cache).items()]
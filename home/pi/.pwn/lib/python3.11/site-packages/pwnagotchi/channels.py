@@ -0,0 +1,202 @@
+import sys
+import math
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+
+# Channel scheduling by expected handshake yield. The stock agent visits
+# channels in order of how many APs are on them and lingers a fixed
+# hop_recon_time / min_recon_time. Here every channel keeps an exponentially
+# weighted history of the clients of not-yet-captured APs seen on it and of
+# the handshakes it produced per visit. Channels are ordered by a score made
+# of the live picture and that history, and the time spent on a channel
+# after attacking is scaled by how its score compares to the average.
+#
+# The replay harness runs recorded AP snapshots (see record_snapshot and
+# personality.channel_snapshots) through a simple capture model, once with
+# the stock ordering and once with the scheduler, and compares
+# handshakes per hour:
+#
+#   python3 -m pwnagotchi.channels replay /root/channel_snapshots.jsonl
+
+ALPHA = 0.3                # weight of the newest observation in the per-channel averages
+CLIENT_WEIGHT = 1.0        # uncaptured clients on the channel right now
+AP_WEIGHT = 0.25           # uncaptured APs without (visible) clients
+HISTORY_WEIGHT = 0.5       # averaged uncaptured clients from past epochs
+YIELD_WEIGHT = 4.0         # handshakes per visit
+PRIOR_VISITS = 3.0         # visits before a channel's yield is trusted
+MIN_DWELL_SCALE = 0.5
+MAX_DWELL_SCALE = 2.0
+
+
+class _Channel(object):
+    __slots__ = ('clients', 'aps', 'visits', 'handshakes')
+
+    def __init__(self):
+        self.clients = 0.0
+        self.aps = 0.0
+        self.visits = 0
+        self.handshakes = 0
+
+    def handshake_rate(self):
+        return self.handshakes / (self.visits + PRIOR_VISITS)
+
+
+def _uncaptured(aps, captured):
+    return [ap for ap in aps if ap['mac'].lower() not in captured]
+
+
+class ChannelScheduler(object):
+    def __init__(self, alpha=ALPHA):
+        self.alpha = alpha
+        self._channels = {}
+        self._scores = {}
+        self._lock = threading.Lock()
+
+    def _channel(self, ch):
+        channel = self._channels.get(ch)
+        if channel is None:
+            channel = self._channels[ch] = _Channel()
+        return channel
+
+    def _score(self, channel, aps, captured):
+        fresh = _uncaptured(aps, captured)
+        clients = sum(len(ap.get('clients', ())) for ap in fresh)
+        return CLIENT_WEIGHT * clients + AP_WEIGHT * len(fresh) + \
+            HISTORY_WEIGHT * channel.clients + YIELD_WEIGHT * channel.handshake_rate()
+
+    def order(self, grouped, captured=()):
+        """Sort (channel, aps) pairs by expected yield, updating the per-channel history."""
+        captured = set(mac.lower() for mac in captured)
+        with self._lock:
+            scores = {}
+            for ch, aps in grouped:
+                channel = self._channel(ch)
+                fresh = _uncaptured(aps, captured)
+                channel.clients += self.alpha * (sum(len(ap.get('clients', ())) for ap in fresh) - channel.clients)
+                channel.aps += self.alpha * (len(fresh) - channel.aps)
+                scores[ch] = self._score(channel, aps, captured)
+            self._scores = scores
+        # the stock order (most APs first) breaks ties
+        return sorted(grouped, key=lambda kv: (-scores[kv[0]], -len(kv[1])))
+
+    def visited(self, ch):
+        with self._lock:
+            self._channel(ch).visits += 1
+
+    def record_handshake(self, ch):
+        with self._lock:
+            self._channel(ch).handshakes += 1
+
+    def dwell(self, ch, base):
+        """Time to stay on ch after attacking: base scaled by its score relative to the mean."""
+        with self._lock:
+            if not base or ch not in self._scores or not self._scores:
+                return base
+            mean = sum(self._scores.values()) / len(self._scores)
+            if mean <= 0:
+                return base
+            scale = self._scores[ch] / mean
+        return base * min(MAX_DWELL_SCALE, max(MIN_DWELL_SCALE, scale))
+
+    def summary(self):
+        with self._lock:
+            return {ch: {'score': round(self._scores.get(ch, 0.0), 2), 'clients': round(c.clients, 2),
+                         'visits': c.visits, 'handshakes': c.handshakes}
+                    for ch, c in sorted(self._channels.items())}
+
+
+def record_snapshot(sink, aps):
+    """Append the bits of an AP list the replay harness needs to a logwriter sink."""
+    sink.write_json({'time': time.time(), 'aps': [
+        {'mac': ap['mac'], 'channel': ap['channel'], 'clients': [c['mac'] for c in ap.get('clients', ())]}
+        for ap in aps]})
+
+
+def _grouped(aps):
+    grouped = {}
+    for ap in aps:
+        grouped.setdefault(ap['channel'], []).append(ap)
+    return list(grouped.items())
+
+
+def replay(snapshots, scheduler=None, hop_time=1.0, dwell=10.0, capture_rate=0.02, seed=1):
+    """Handshakes per hour for a run over snapshots; the stock ordering when scheduler is None.
+
+    Every snapshot grants the time until the next one. Channels are visited in
+    order, each costing hop_time plus its dwell; each uncaptured AP on the
+    visited channel is captured with probability 1 - exp(-capture_rate *
+    clients * dwell). The same seed gives both strategies the same luck.
+    """
+    rng = random.Random(seed)
+    captured = set()
+    total = 0.0
+    for i, snap in enumerate(snapshots):
+        budget = snapshots[i + 1]['time'] - snap['time'] if i + 1 < len(snapshots) else 60.0
+        total += budget
+        grouped = _grouped(snap['aps'])
+        if scheduler is None:
+            ordered = sorted(grouped, key=lambda kv: len(kv[1]), reverse=True)
+        else:
+            ordered = scheduler.order(grouped, captured)
+        for ch, aps in ordered:
+            stay = dwell if scheduler is None else scheduler.dwell(ch, dwell)
+            if budget < hop_time + stay:
+                break
+            budget -= hop_time + stay
+            if scheduler is not None:
+                scheduler.visited(ch)
+            for ap in _uncaptured(aps, captured):
+                if rng.random() < 1 - math.exp(-capture_rate * len(ap['clients']) * stay):
+                    captured.add(ap['mac'].lower())
+                    if scheduler is not None:
+                        scheduler.record_handshake(ch)
+    hours = total / 3600.0
+    return {'handshakes': len(captured), 'hours': round(hours, 3),
+            'per_hour': round(len(captured) / hours, 2) if hours else 0.0}
+
+
+def _load(path):
+    snapshots = []
+    with open(path, 'rt') as fp:
+        for line in fp:
+            try:
+                snapshots.append(json.loads(line))
+            except ValueError:
+                continue
+    return snapshots
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pwnagotchi.channels', description='channel scheduler replay')
+    sub = parser.add_subparsers(dest='command', required=True)
+    rep = sub.add_parser('replay', help='compare the stock channel order with the scheduler')
+    rep.add_argument('snapshots', help='JSONL written with personality.channel_snapshots')
+    rep.add_argument('--hop-time', type=float, default=1.0)
+    rep.add_argument('--dwell', type=float, default=10.0, help='hop_recon_time in use')
+    rep.add_argument('--capture-rate', type=float, default=0.02, help='per client per second')
+    rep.add_argument('--seeds', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    snapshots = _load(args.snapshots)
+    if len(snapshots) < 2:
+        print("need at least two snapshots")
+        return 1
+    results = {'stock': [], 'scheduler': []}
+    for seed in range(args.seeds):
+        kwargs = dict(hop_time=args.hop_time, dwell=args.dwell, capture_rate=args.capture_rate, seed=seed)
+        results['stock'].append(replay(snapshots, None, **kwargs))
+        results['scheduler'].append(replay(snapshots, ChannelScheduler(), **kwargs))
+    for name, runs in results.items():
+        per_hour = sum(r['per_hour'] for r in runs) / len(runs)
+        print("%-10s %6.2f handshakes/hour  (%d snapshots, %.2f h, %d seeds)" %
+              (name, per_hour, len(snapshots), runs[0]['hours'], len(runs)))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
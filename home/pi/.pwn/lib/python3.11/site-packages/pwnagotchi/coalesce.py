@@ -0,0 +1,87 @@
+import time
+import logging
+import threading
+
+from pwnagotchi import power
+
+# Rate limiter in front of the View handed out by Agent.view(). Plugins call
+# set() and update(force=True) whenever they like; on e-ink every refresh is
+# slow and blocks the render thread, so here values are diffed against what
+# the view already shows, changed keys are collected, and the refreshes are
+# merged into at most one per interval. An update asked for inside the
+# interval is deferred to a single trailing refresh that picks up everything
+# set in the meantime.
+
+MIN_INTERVAL = 2.0
+
+
+class CoalescingView(object):
+    def __init__(self, view, interval=MIN_INTERVAL):
+        self._view = view
+        self.base_interval = interval
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._last_refresh = 0.0
+        self._trailing = None
+        self.requested = 0
+        self.refreshed = 0
+        self.unchanged = 0
+        power.default().subscribe(self._on_power_profile)
+
+    def __getattr__(self, name):
+        # everything not coalesced goes straight to the real view
+        return getattr(self._view, name)
+
+    def _on_power_profile(self, profile, previous):
+        self.interval = self.base_interval * power.INTERVAL_SCALE[profile]
+
+    def set(self, key, value):
+        try:
+            if self._view.get(key) == value:
+                self.unchanged += 1
+                return
+        except Exception:
+            # unknown key (element not added yet); let the view decide
+            pass
+        self._view.set(key, value)
+        with self._lock:
+            self._dirty.add(key)
+
+    def update(self, force=False, new_data=None):
+        for key, value in (new_data or {}).items():
+            self.set(key, value)
+
+        with self._lock:
+            self.requested += 1
+            if not self._dirty and not force:
+                return
+            wait = self._last_refresh + self.interval - time.time()
+            if wait > 0:
+                # a trailing refresh is (or will be) queued and takes this one with it
+                if self._trailing is None:
+                    self._trailing = threading.Timer(wait, self._refresh)
+                    self._trailing.daemon = True
+                    self._trailing.start()
+                return
+        self._refresh()
+
+    def _refresh(self):
+        with self._lock:
+            self._trailing = None
+            self._dirty.clear()
+            self._last_refresh = time.time()
+            self.refreshed += 1
+        try:
+            self._view.update(force=True)
+        except Exception as e:
+            logging.error("[coalesce] refresh failed: %s", e)
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'requested': self.requested,
+            'refreshed': self.refreshed,
+            'avoided': max(0, self.requested - self.refreshed),
+            'unchanged_sets': self.unchanged,
+        }
@@ -0,0 +1,190 @@
+import os
+import time
+import logging
+import threading
+import subprocess
+from collections import deque, namedtuple
+
+from pwnagotchi import wordlistio
+
+# Sharded aircrack-ng runs. Instead of one aircrack-ng over a comma-joined
+# batch of wordlists followed by a sleep, every wordlist is cut into
+# line-aligned byte ranges and a pool of workers - as many as the CPU budget
+# allows, each pinned to its own core - pipes one range at a time into
+# `aircrack-ng -w -`. The first worker that finds the key stops the others
+# and kills their aircrack-ng, so the remaining ranges are never read.
+#
+# Ranges are at most SEGMENTS per wordlist, the wordlist ranker's hit
+# histogram resolution, and are queued hottest first when the ranker knows
+# where in a list keys have been found before. Compressed lists can't be
+# entered in the middle, so each is one segment streamed through the
+# decompressor (end is None).
+
+SEGMENTS = 16
+MIN_SEGMENT_BYTES = 262144   # smaller lists are not worth another aircrack-ng start
+CHUNK = 65536
+PAUSE_POLL = 30.0
+
+Segment = namedtuple('Segment', ('wordlist', 'path', 'start', 'end', 'size'))
+
+
+def line_aligned_ranges(path, parts):
+    """Split path into at most parts (start, end) byte ranges that begin at a line start."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    bounds = [0]
+    with open(path, 'rb') as fp:
+        for i in range(1, max(1, parts)):
+            target = size * i // parts
+            if target <= bounds[-1]:
+                continue
+            # the line holding byte target - 1 ends right before the next range
+            fp.seek(target - 1)
+            fp.readline()
+            pos = fp.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def segments(wordlist, path, hot=None):
+    """Segments of one wordlist, ordered by hot (ranker segment indices, best first) when given."""
+    size = os.path.getsize(path)
+    if wordlistio.is_compressed(path):
+        return [Segment(wordlist, path, 0, None, size)] if size else []
+    parts = max(1, min(SEGMENTS, size // MIN_SEGMENT_BYTES))
+    result = [Segment(wordlist, path, start, end, size) for start, end in line_aligned_ranges(path, parts)]
+    if hot:
+        rank = {index: position for position, index in enumerate(hot)}
+        result.sort(key=lambda s: rank.get(s.start * SEGMENTS // s.size, SEGMENTS))
+    return result
+
+
+def workers_for_budget(max_cpu_percent, cpus=None, load=None):
+    """Workers that fit in max_cpu_percent of the machine next to what is already running."""
+    cpus = cpus or os.cpu_count() or 1
+    if load is None:
+        try:
+            load = os.getloadavg()[0]
+        except OSError:
+            load = 0.0
+    return max(1, min(cpus, int(cpus * max_cpu_percent / 100.0 - load)))
+
+
+def _cores(workers):
+    # the highest numbered cores we may run on; core 0 takes most interrupts and the agent
+    try:
+        allowed = sorted(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return [None] * workers
+    return [allowed[-1 - (i % len(allowed))] for i in range(workers)]
+
+
+class ShardedCracker(object):
+    def __init__(self, filename, bssid, workers=1, paused=None, aircrack='aircrack-ng'):
+        self.filename = filename
+        self.bssid = bssid
+        self.workers = max(1, workers)
+        self.paused = paused
+        self.aircrack = aircrack
+        self.result = "KEY NOT FOUND"
+        self.cracked_by = None
+        self.seconds = {}        # wordlist -> worker seconds spent on it
+        self._remaining = {}     # wordlist -> segments not finished yet
+        self._queue = deque()
+        self._procs = set()
+        self._found = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def completed(self):
+        """Wordlists whose every segment ran to the end."""
+        with self._lock:
+            return [wl for wl, left in self._remaining.items() if left == 0]
+
+    def _run_segment(self, segment):
+        # one cracking thread per aircrack-ng; the pool is what spreads over the cores
+        cmd = [self.aircrack, '-p', '1', '-w', '-', '-l', '%s.cracked' % self.filename, '-q',
+               '-b', self.bssid, self.filename]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        with self._lock:
+            self._procs.add(proc)
+        start = time.time()
+        try:
+            with wordlistio.open_wordlist(segment.path) as fp:
+                if segment.end is None:
+                    remaining = float('inf')
+                else:
+                    fp.seek(segment.start)
+                    remaining = segment.end - segment.start
+                while remaining > 0 and not self._found.is_set():
+                    chunk = fp.read(int(min(CHUNK, remaining)))
+                    if not chunk:
+                        break
+                    proc.stdin.write(chunk)
+                    remaining -= len(chunk)
+            proc.stdin.close()
+        except (BrokenPipeError, ValueError, OSError):
+            # aircrack-ng exited (key found) or was killed by a peer
+            pass
+        output = proc.stdout.read().decode('utf-8', 'replace')
+        proc.wait()
+        with self._lock:
+            self._procs.discard(proc)
+            self.seconds[segment.wordlist] = self.seconds.get(segment.wordlist, 0.0) + time.time() - start
+
+        for line in output.splitlines():
+            if 'KEY FOUND' in line:
+                return line.strip()
+        return None
+
+    def _worker(self, core):
+        if core is not None:
+            # pid 0 is this thread on linux; the aircrack-ng it starts inherit the mask
+            try:
+                os.sched_setaffinity(0, {core})
+            except OSError:
+                pass
+        while not self._found.is_set():
+            while self.paused is not None and self.paused() and not self._found.is_set():
+                self._found.wait(PAUSE_POLL)
+            with self._lock:
+                if not self._queue or self._found.is_set():
+                    return
+                segment = self._queue.popleft()
+            key = self._run_segment(segment)
+            with self._lock:
+                if key is not None and not self._found.is_set():
+                    self.result = key
+                    self.cracked_by = segment.wordlist
+                    self._found.set()
+                    for proc in self._procs:
+                        proc.kill()
+                elif key is None and not self._found.is_set():
+                    self._remaining[segment.wordlist] -= 1
+                    if self._remaining[segment.wordlist] == 0:
+                        logging.debug("[crackshard] %s exhausted", segment.wordlist)
+
+    def run(self, segment_list):
+        """Crack over segment_list; returns aircrack-ng's key line or "KEY NOT FOUND"."""
+        with self._lock:
+            self._queue.extend(segment_list)
+            for segment in segment_list:
+                self._remaining[segment.wordlist] = self._remaining.get(segment.wordlist, 0) + 1
+        threads = [threading.Thread(target=self._worker, args=(core,), name="crackshard worker", daemon=True)
+                   for core in _cores(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.result
+
+    def cancel(self):
+        with self._lock:
+            self._found.set()
+            for proc in self._procs:
+                proc.kill()
@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import mmap
+import time
+import logging
+import argparse
+import threading
+
+from PIL import Image, ImageOps
+
+# Pre-dithered face sprites for png face packs. The stock face widget opens
+# the PNG, walks every pixel in Python to flatten transparency and converts
+# it to 1-bit on every draw. build() does that once per face and packs the
+# 1-bit rows of every face into a single atlas file: one JSON header line
+# (source manifest, display size, colour, sprite offsets) followed by the raw
+# bitmaps. load() memory-maps the atlas and install() swaps the face
+# widget's draw for a paste of the mapped sprite, so a face change is a blit.
+#
+#   python3 -m pwnagotchi.faceatlas compile /custom-faces /etc/pwnagotchi/faces.atlas --size 250x122
+#   python3 -m pwnagotchi.faceatlas bench /custom-faces
+
+VERSION = 1
+EXTENSIONS = ('.png',)
+
+
+def _faces(face_dir):
+    return sorted(f for f in os.listdir(face_dir) if f.lower().endswith(EXTENSIONS))
+
+
+def _manifest(face_dir):
+    manifest = []
+    for name in _faces(face_dir):
+        st = os.stat(os.path.join(face_dir, name))
+        manifest.append([name, st.st_size, int(st.st_mtime)])
+    return manifest
+
+
+def _legacy_render(path, color=0):
+    """What the stock png face widget does on every draw."""
+    image = Image.open(path).convert('RGBA')
+    pixels = image.load()
+    for y in range(image.size[1]):
+        for x in range(image.size[0]):
+            if pixels[x, y][3] < 255:
+                pixels[x, y] = (255, 255, 255, 255)
+    if color == 255:
+        image = ImageOps.colorize(image.convert('L'), black="white", white="black")
+    return image.convert('1')
+
+
+def _render(path, color=0, size=None):
+    image = Image.open(path).convert('RGBA')
+    # flatten anything not fully opaque to white, as the stock widget does, without the pixel loop
+    alpha = image.getchannel('A').point(lambda a: 255 if a == 255 else 0)
+    flat = Image.new('RGBA', image.size, (255, 255, 255, 255))
+    flat.paste(image, (0, 0), alpha)
+    if color == 255:
+        flat = ImageOps.colorize(flat.convert('L'), black="white", white="black")
+    sprite = flat.convert('1')
+    if size and (sprite.width > size[0] or sprite.height > size[1]):
+        sprite.thumbnail(size)
+        sprite = sprite.convert('1')
+    return sprite
+
+
+def build(face_dir, path, color=0, size=None):
+    """Render every face in face_dir to 1-bit and write them to one atlas file."""
+    manifest = _manifest(face_dir)
+    sprites = {}
+    blobs = []
+    offset = 0
+    for name, _, _ in manifest:
+        sprite = _render(os.path.join(face_dir, name), color, size)
+        data = sprite.tobytes()
+        sprites[name] = [offset, sprite.width, sprite.height]
+        blobs.append(data)
+        offset += len(data)
+
+    header = {'version': VERSION, 'manifest': manifest, 'color': color,
+              'size': list(size) if size else None, 'sprites': sprites}
+    tmp = '%s.tmp' % path
+    with open(tmp, 'wb') as fp:
+        fp.write((json.dumps(header) + '\n').encode('utf-8'))
+        for data in blobs:
+            fp.write(data)
+    os.replace(tmp, path)
+    logging.info("[faceatlas] compiled %d faces from %s into %s (%d bytes)", len(sprites), face_dir, path, offset)
+
+
+class FaceAtlas(object):
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self._fp = None
+        self._map = None
+        self._base = 0
+        self._sprites = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        with open(self.path, 'rb') as fp:
+            line = fp.readline()
+            self.header = json.loads(line)
+            self._base = len(line)
+            self._fp = open(self.path, 'rb')
+            self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def matches(self, face_dir, color=0, size=None):
+        """True if this atlas was compiled from face_dir's current files for this display."""
+        return self.header is not None and \
+            self.header.get('version') == VERSION and \
+            self.header.get('color') == color and \
+            self.header.get('size') == (list(size) if size else None) and \
+            self.header.get('manifest') == _manifest(face_dir)
+
+    def names(self):
+        return list(self.header['sprites']) if self.header else []
+
+    def get(self, face):
+        """1-bit sprite for a face path or file name, or None if it isn't in the atlas."""
+        name = os.path.basename(str(face))
+        sprite = self._sprites.get(name)
+        if sprite is not None:
+            return sprite
+        entry = self.header['sprites'].get(name) if self.header else None
+        if entry is None:
+            return None
+        offset, width, height = entry
+        stride = (width + 7) // 8
+        start = self._base + offset
+        view = memoryview(self._map)[start:start + stride * height]
+        with self._lock:
+            sprite = self._sprites.setdefault(name, Image.frombuffer('1', (width, height), view, 'raw', '1', 0, 1))
+        return sprite
+
+    def close(self):
+        self._sprites.clear()
+        if self._map is not None:
+            self._map.close()
+            self._fp.close()
+            self._map = self._fp = None
+
+
+def load(face_dir, path, color=0, size=None):
+    """The atlas at path, recompiled first if face_dir or the display changed since."""
+    atlas = None
+    if os.path.exists(path):
+        try:
+            atlas = FaceAtlas(path).load()
+            if atlas.matches(face_dir, color, size):
+                return atlas
+            atlas.close()
+        except Exception as e:
+            logging.warning("[faceatlas] discarding unreadable atlas %s: %s", path, e)
+    build(face_dir, path, color, size)
+    return FaceAtlas(path).load()
+
+
+def _face_widget(view, face_key):
+    # View has no public getter for a widget (get() returns its value), so this
+    # is the one place that looks inside; any change there disables the atlas
+    try:
+        widget = view._state._state[face_key]
+    except (AttributeError, KeyError, TypeError) as e:
+        logging.warning("[faceatlas] cannot reach the %s widget (%r), drawing faces from png", face_key, e)
+        return None
+    if not all(hasattr(widget, attr) for attr in ('draw', 'xy', 'value', 'color')):
+        logging.warning("[faceatlas] the %s widget is not a face widget, drawing faces from png", face_key)
+        return None
+    return widget
+
+
+def install(view, path, face_key='face'):
+    """Draw view's png face widget from a memory-mapped atlas instead of decoding PNGs."""
+    widget = _face_widget(view, face_key)
+    if widget is None or not getattr(widget, 'png', False) or not isinstance(widget.value, str):
+        return None
+    face_dir = os.path.dirname(widget.value)
+    atlas = load(face_dir, path, widget.color, (view.width(), view.height()))
+    fallback = widget.draw
+
+    def draw(canvas, drawer):
+        sprite = atlas.get(widget.value) if widget.value is not None else None
+        if sprite is None:
+            # a face from outside the pack (or text); the stock path still handles it
+            return fallback(canvas, drawer)
+        canvas.paste(sprite, widget.xy)
+
+    widget.draw = draw
+    logging.info("[faceatlas] %d faces served from %s", len(atlas.names()), path)
+    return atlas
+
+
+def _bench(face_dir, rounds, size, color):
+    import tempfile
+
+    names = _faces(face_dir)
+    canvas = Image.new('1', size, 255)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for name in names:
+            canvas.paste(_legacy_render(os.path.join(face_dir, name), color), (0, 0))
+    legacy = (time.perf_counter() - start) / (rounds * len(names))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'faces.atlas')
+        start = time.perf_counter()
+        build(face_dir, path, color, size)
+        compiled = time.perf_counter() - start
+        start = time.perf_counter()
+        atlas = FaceAtlas(path).load()
+        loaded = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for name in names:
+                canvas.paste(atlas.get(name), (0, 0))
+        blit = (time.perf_counter() - start) / (rounds * len(names))
+        atlas.close()
+
+    print("faces:            %d" % len(names))
+    print("png switch:       %.3f ms" % (legacy * 1000))
+    print("atlas switch:     %.3f ms  (x%.0f)" % (blit * 1000, legacy / blit if blit else 0))
+    print("atlas compile:    %.1f ms (once)" % (compiled * 1000))
+    print("atlas map:        %.3f ms (per boot)" % (loaded * 1000))
+
+
+def _size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pwnagotchi.faceatlas', description='face pack sprite atlas')
+    sub = parser.add_subparsers(dest='command', required=True)
+    compile_p = sub.add_parser('compile', help='compile a face pack into an atlas')
+    compile_p.add_argument('face_dir')
+    compile_p.add_argument('atlas')
+    bench = sub.add_parser('bench', help='face switch latency, png vs atlas')
+    bench.add_argument('face_dir')
+    bench.add_argument('--rounds', type=int, default=20)
+    for p in (compile_p, bench):
+        p.add_argument('--size', type=_size, default=(250, 122), help='display WIDTHxHEIGHT')
+        p.add_argument('--invert', action='store_true', help='faces drawn white on black')
+    args = parser.parse_args(argv)
+
+    color = 255 if args.invert else 0
+    if args.command == 'compile':
+        build(args.face_dir, args.atlas, color, args.size)
+    else:
+        _bench(args.face_dir, args.rounds, args.size, color)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,323 @@
+import os
+import time
+import mmap
+import zlib
+import shutil
+import struct
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from collections import namedtuple
+
+from pwnagotchi import pcapcache
+
+# Packed handshake archive. Old captures and their .gps.json / .geo.json
+# sidecars are moved out of the handshakes directory into one append-only
+# data file (handshakes.pack) plus an index of fixed size records
+# (handshakes.idx), so the directory the agent, quickdic and wpa3parse list
+# stays small and a capture no longer costs an SD card block per file.
+#
+# An entry is appended to the pack and synced before its index record is, so
+# a crash leaves at most a tail that no record points at; the writer cuts it
+# off the next time it opens the archive. The index is read through mmap and
+# its records are never rewritten, only appended.
+#
+# Tools that need a real file get one from materialize() (a temporary copy,
+# removed afterwards) or extract() (restored into a directory for good).
+
+PACK = 'handshakes.pack'
+INDEX = 'handshakes.idx'
+MAGIC = b'PWNPACK\x01'
+HEADER = struct.Struct('<8sI4x')
+# bssid, handshake rank, pmkid, offset, name/pcap/gps/geo lengths, crc32 of the entry, mtime
+RECORD = struct.Struct('<6sBBQHIIIId')
+SIDECARS = ('.gps.json', '.geo.json')
+RANK_KIND = {rank: kind for kind, rank in pcapcache.HANDSHAKE_RANK.items()}
+
+Entry = namedtuple('Entry', ('index', 'bssid', 'kind', 'pmkid', 'offset', 'name_len', 'pcap_len',
+                             'gps_len', 'geo_len', 'crc', 'mtime'))
+
+
+def count(directory):
+    """Captures archived in directory, from the index size alone."""
+    try:
+        size = os.path.getsize(os.path.join(directory, INDEX))
+    except OSError:
+        return 0
+    return max(0, (size - HEADER.size) // RECORD.size)
+
+
+def unique_count(directory, pack=None):
+    """Distinct capture names in directory and its pack; a restored capture still archived counts once."""
+    try:
+        names = {name for name in os.listdir(directory) if name.endswith('.pcap')}
+    except OSError:
+        names = set()
+    own = pack is None
+    pack = HandshakePack(directory) if own else pack
+    try:
+        names.update(pack.names())
+    except (OSError, ValueError) as e:
+        logging.error("[handshakepack] cannot read the names in %s: %s", directory, e)
+    finally:
+        if own:
+            pack.close()
+    return len(names)
+
+
+def _bssid_bytes(bssid):
+    try:
+        raw = bytes.fromhex((bssid or '').replace(':', '').replace('-', ''))
+    except ValueError:
+        return b'\x00' * 6
+    return raw if len(raw) == 6 else b'\x00' * 6
+
+
+def _entry_size(entry):
+    return entry.name_len + entry.pcap_len + entry.gps_len + entry.geo_len
+
+
+class HandshakePack(object):
+    def __init__(self, directory):
+        self.directory = directory
+        self.pack_path = os.path.join(directory, PACK)
+        self.index_path = os.path.join(directory, INDEX)
+        self._lock = threading.Lock()
+        self._map = None
+        self._map_size = 0
+        self._by_bssid = {}
+        self._names = None
+        self._indexed = 0
+        self._recovered = False
+
+    # -- index --
+
+    def _refresh(self):
+        # map the index again when it grew (another writer, or our own appends)
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            size = 0
+        if size == self._map_size:
+            return
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._map_size = size
+        if size >= HEADER.size:
+            with open(self.index_path, 'rb') as fp:
+                self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, record_size = HEADER.unpack_from(self._map, 0)
+            if magic != MAGIC or record_size != RECORD.size:
+                self._map.close()
+                self._map = None
+                raise ValueError("%s is not a handshake pack index" % self.index_path)
+        for i in range(self._indexed, len(self)):
+            entry = self.entry(i)
+            self._by_bssid.setdefault(entry.bssid, []).append(i)
+        # once loaded, the name table only reads the names of the new records
+        if self._names is not None:
+            self._read_names(self._indexed, len(self))
+        self._indexed = len(self)
+
+    def _read_names(self, start, end):
+        if start >= end:
+            return
+        with open(self.pack_path, 'rb') as fp:
+            for i in range(start, end):
+                entry = self.entry(i)
+                fp.seek(entry.offset)
+                self._names[fp.read(entry.name_len).decode('utf-8', 'replace')] = entry
+
+    def _named(self):
+        # lock held
+        self._refresh()
+        if self._names is None:
+            self._names = {}
+            self._read_names(0, len(self))
+        return self._names
+
+    def __len__(self):
+        return max(0, (self._map_size - HEADER.size) // RECORD.size) if self._map is not None else 0
+
+    def entry(self, i):
+        fields = RECORD.unpack_from(self._map, HEADER.size + i * RECORD.size)
+        bssid = ':'.join('%02x' % b for b in fields[0])
+        return Entry(i, bssid, RANK_KIND.get(fields[1], 'none'), bool(fields[2]), *fields[3:])
+
+    def entries(self):
+        with self._lock:
+            self._refresh()
+            return [self.entry(i) for i in range(len(self))]
+
+    def find(self, bssid):
+        """Entries archived for bssid, best handshake first."""
+        with self._lock:
+            self._refresh()
+            found = [self.entry(i) for i in self._by_bssid.get(bssid.lower().replace('-', ':'), ())]
+        return sorted(found, key=lambda e: (pcapcache.HANDSHAKE_RANK.get(e.kind, 0), e.pmkid, e.mtime), reverse=True)
+
+    def names(self):
+        """{capture file name: entry}"""
+        with self._lock:
+            return dict(self._named())
+
+    # -- reading --
+
+    def _read(self, entry):
+        with open(self.pack_path, 'rb') as fp:
+            fp.seek(entry.offset)
+            blob = fp.read(_entry_size(entry))
+        if len(blob) != _entry_size(entry) or zlib.crc32(blob) != entry.crc:
+            raise ValueError("archived capture %d is damaged" % entry.index)
+        parts = {}
+        pos = 0
+        for field, length in (('name', entry.name_len), ('pcap', entry.pcap_len),
+                              (SIDECARS[0], entry.gps_len), (SIDECARS[1], entry.geo_len)):
+            parts[field] = blob[pos:pos + length]
+            pos += length
+        return parts
+
+    def read(self, entry):
+        """(file name, pcap bytes, {sidecar suffix: bytes}) of an entry."""
+        parts = self._read(entry)
+        sidecars = {suffix: parts[suffix] for suffix in SIDECARS if parts[suffix]}
+        return parts['name'].decode('utf-8', 'replace'), parts['pcap'], sidecars
+
+    def get(self, bssid):
+        """pcap bytes of the best capture archived for bssid, or None."""
+        found = self.find(bssid)
+        return self.read(found[0])[1] if found else None
+
+    def extract(self, entry, directory):
+        """Write an entry back as real files in directory; returns the capture's path."""
+        name, pcap, sidecars = self.read(entry)
+        base = os.path.splitext(name)[0]
+        path = os.path.join(directory, name)
+        for target, data in [(path, pcap)] + [(os.path.join(directory, base + s), d) for s, d in sidecars.items()]:
+            tmp = '%s.tmp' % target
+            with open(tmp, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp, target)
+        # left at now: with the archived mtime, the next compact() would pack it straight back
+        return path
+
+    @contextmanager
+    def materialize(self, entry, directory=None):
+        """A temporary real file for entry (sidecars next to it), for tools that want a path."""
+        tmpdir = tempfile.mkdtemp(prefix='pwnpack-', dir=directory)
+        try:
+            yield self.extract(entry, tmpdir)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    # -- writing --
+
+    def _recover(self):
+        # drop index records that point past the pack and pack bytes no record points at
+        self._refresh()
+        pack_size = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+        valid = 0
+        end = 0
+        for i in range(len(self)):
+            entry = self.entry(i)
+            if entry.offset + _entry_size(entry) > pack_size:
+                break
+            valid = i + 1
+            end = entry.offset + _entry_size(entry)
+        if valid != len(self) or self._map_size != HEADER.size + valid * RECORD.size:
+            logging.warning("[handshakepack] cutting a torn tail off %s after %d records", self.index_path, valid)
+            self._map.close()
+            self._map, self._map_size, self._indexed, self._by_bssid, self._names = None, 0, 0, {}, None
+            with open(self.index_path, 'r+b') as fp:
+                fp.truncate(HEADER.size + valid * RECORD.size)
+            self._refresh()
+        if pack_size > end:
+            with open(self.pack_path, 'r+b') as fp:
+                fp.truncate(end)
+        self._recovered = True
+
+    def add(self, path, meta=None):
+        """Append a capture and its sidecars; returns the new entry, or the existing one for the same content."""
+        name = os.path.basename(path)
+        with open(path, 'rb') as fp:
+            pcap = fp.read()
+        base = os.path.splitext(path)[0]
+        sidecars = []
+        for suffix in SIDECARS:
+            try:
+                with open(base + suffix, 'rb') as fp:
+                    sidecars.append(fp.read())
+            except OSError:
+                sidecars.append(b'')
+        meta = meta or pcapcache.default().get(path) or {}
+        blob = name.encode('utf-8') + pcap + b''.join(sidecars)
+        crc = zlib.crc32(blob)
+
+        with self._lock:
+            existing = self._named().get(name)
+            if existing is not None and existing.crc == crc:
+                return existing
+            if not os.path.exists(self.index_path):
+                with open(self.index_path, 'wb') as fp:
+                    fp.write(HEADER.pack(MAGIC, RECORD.size))
+                    fp.flush()
+                    os.fsync(fp.fileno())
+            if not self._recovered:
+                self._recover()
+            with open(self.pack_path, 'ab') as fp:
+                offset = fp.tell()
+                fp.write(blob)
+                fp.flush()
+                os.fsync(fp.fileno())
+            record = RECORD.pack(_bssid_bytes(meta.get('bssid')), pcapcache.HANDSHAKE_RANK.get(meta.get('handshake'), 0),
+                                 1 if meta.get('pmkid') else 0, offset, len(name.encode('utf-8')),
+                                 len(pcap), len(sidecars[0]), len(sidecars[1]), crc, os.path.getmtime(path))
+            with open(self.index_path, 'ab') as fp:
+                fp.write(record)
+                fp.flush()
+                os.fsync(fp.fileno())
+            self._refresh()
+            return self.entry(len(self) - 1)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._map_size = 0
+
+
+def compact(directory, min_age=7 * 86400, keep=None, stop=None):
+    """Move captures older than min_age (and not rejected by keep(name)) into the pack."""
+    pack = HandshakePack(directory)
+    moved = 0
+    now = time.time()
+    try:
+        for name in sorted(os.listdir(directory)):
+            if stop is not None and stop():
+                break
+            path = os.path.join(directory, name)
+            if not name.endswith('.pcap') or not os.path.isfile(path):
+                continue
+            try:
+                if now - os.path.getmtime(path) < min_age or (keep is not None and keep(name)):
+                    continue
+                entry = pack.add(path)
+                # only delete once the archived copy reads back intact
+                if pack.read(entry)[0] != name:
+                    raise ValueError("archived copy of %s does not match" % name)
+            except (OSError, ValueError) as e:
+                logging.error("[handshakepack] cannot archive %s: %s", name, e)
+                continue
+            base = os.path.splitext(path)[0]
+            for victim in [path] + [base + suffix for suffix in SIDECARS]:
+                if os.path.exists(victim):
+                    os.unlink(victim)
+            moved += 1
+    finally:
+        pack.close()
+    if moved:
+        logging.info("[handshakepack] archived %d captures in %s", moved, directory)
+    return moved
@@ -0,0 +1,88 @@
+import sys
+import math
+import time
+import threading
+from collections import OrderedDict
+
+# Bounded interaction history for Agent._should_interact. The agent used to
+# keep a counter for every MAC it ever associated with or deauthed, for the
+# whole session; on a dense walk that is tens of thousands of entries, all
+# saved into the recovery data. Here counters decay with a half-life, so a
+# device that was left alone for a while becomes fair game again, and the
+# least recently touched entries are evicted past max_entries. While a MAC
+# stays in the table, max_interactions behaves as before.
+
+MAX_ENTRIES = 5000
+HALF_LIFE = 3600.0   # seconds for an interaction count to halve
+
+
+class InteractionHistory(object):
+    def __init__(self, max_entries=MAX_ENTRIES, half_life=HALF_LIFE):
+        self.max_entries = max_entries
+        self.half_life = half_life
+        self.evictions = 0
+        self._entries = OrderedDict()   # who -> [count, last seen]
+        self._lock = threading.Lock()
+
+    def _decayed(self, entry, now):
+        if not self.half_life:
+            return entry[0]
+        # clamped: the clock can step backwards when a pi without RTC gets NTP time
+        return entry[0] * math.pow(0.5, max(0.0, now - entry[1]) / self.half_life)
+
+    def __contains__(self, who):
+        with self._lock:
+            return who in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, who, now=None):
+        """Current (decayed) interaction count for who, 0 if unknown or evicted."""
+        with self._lock:
+            entry = self._entries.get(who)
+            return self._decayed(entry, time.time() if now is None else now) if entry else 0.0
+
+    def hit(self, who, now=None):
+        """Count one more interaction with who; returns the new decayed count."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(who)
+            if entry is None:
+                entry = self._entries[who] = [0.0, now]
+            else:
+                self._entries.move_to_end(who)
+            entry[0] = self._decayed(entry, now) + 1
+            entry[1] = now
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return entry[0]
+
+    def load(self, counts, now=None):
+        """Seed from a {who: count} dict (recovery data); counts restart decaying from now."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._entries.clear()
+            for who, count in counts.items():
+                self._entries[who] = [float(count), now]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def to_dict(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return {who: round(self._decayed(entry, now), 2) for who, entry in self._entries.items()}
+
+    def stats(self):
+        with self._lock:
+            footprint = sys.getsizeof(self._entries)
+            for who, entry in self._entries.items():
+                footprint += sys.getsizeof(who) + sys.getsizeof(entry) + sum(sys.getsizeof(v) for v in entry)
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'evictions': self.evictions,
+                'bytes': footprint,
+            }
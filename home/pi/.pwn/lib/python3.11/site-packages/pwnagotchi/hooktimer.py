@@ -0,0 +1,83 @@
+import time
+import threading
+
+import pwnagotchi.plugins as plugins
+
+# Plugin callback timing shared by the boot profiler and the runtime metrics.
+# A HookTimer wraps whichever plugins function runs the callback: locked_cb
+# in builds where plugins.one() hands callbacks to their own thread (so the
+# callback itself is timed, not the dispatch), one() itself where it calls
+# them inline. Each wrapper holds the function it replaced in a closure, so
+# a callback thread still inside it keeps working after uninstall().
+
+
+class HookTimer(object):
+    def __init__(self, observe):
+        self.observe = observe  # observe(plugin_name, hook, seconds)
+        self._lock = threading.Lock()
+        self._installed = None  # (name of the wrapped plugins function, original, wrapper)
+
+    @property
+    def installed(self):
+        return self._installed[0] if self._installed is not None else None
+
+    def _wrap_locked_cb(self, original):
+        observe = self.observe
+
+        def timed_locked_cb(lock_name, cb, *args):
+            plugin_name, _, hook = lock_name.partition('::')
+            hook = hook[3:] if hook.startswith('on_') else hook
+
+            def timed(*cb_args):
+                start = time.perf_counter()
+                try:
+                    return cb(*cb_args)
+                finally:
+                    observe(plugin_name, hook, time.perf_counter() - start)
+
+            return original(lock_name, timed, *args)
+
+        return timed_locked_cb
+
+    def _wrap_one(self, original):
+        observe = self.observe
+
+        def timed_one(plugin_name, event_name, *args, **kwargs):
+            # one() is called for every loaded plugin; only count the ones with the hook
+            plugin = plugins.loaded.get(plugin_name)
+            if plugin is None or getattr(plugin, 'on_%s' % event_name, None) is None:
+                return original(plugin_name, event_name, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return original(plugin_name, event_name, *args, **kwargs)
+            finally:
+                observe(plugin_name, event_name, time.perf_counter() - start)
+
+        return timed_one
+
+    def install(self):
+        """Start timing; returns the name of the wrapped function, None if already installed."""
+        with self._lock:
+            if self._installed is not None:
+                return None
+            if callable(getattr(plugins, 'locked_cb', None)):
+                name, wrap = 'locked_cb', self._wrap_locked_cb
+            else:
+                name, wrap = 'one', self._wrap_one
+            original = getattr(plugins, name)
+            wrapper = wrap(original)
+            setattr(plugins, name, wrapper)
+            self._installed = (name, original, wrapper)
+            return name
+
+    def uninstall(self):
+        """Put the original function back; False if somebody wrapped ours in the meantime."""
+        with self._lock:
+            if self._installed is None:
+                return True
+            name, original, wrapper = self._installed
+            if getattr(plugins, name) is not wrapper:
+                return False
+            setattr(plugins, name, original)
+            self._installed = None
+            return True
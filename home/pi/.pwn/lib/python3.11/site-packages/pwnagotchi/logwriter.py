@@ -0,0 +1,244 @@
+import os
+import time
+import gzip
+import json
+import atexit
+import shutil
+import logging
+import threading
+import functools
+
+# Shared background writer for the append-only logs our plugins keep on the
+# SD card (deauth detections, security audit, quickdic potfile, processed
+# files). Callers hand lines to a sink and return immediately; a single
+# daemon thread batches them into one write per flush interval, fsyncs
+# periodically, rotates by size and gzips the rotated segments.
+
+FLUSH_INTERVAL = 2.0   # seconds between batched writes
+FSYNC_INTERVAL = 30.0  # seconds between fsyncs of dirty sinks
+MAX_PENDING = 256      # lines buffered before the writer is woken early
+
+_lock = threading.Lock()
+_sinks = {}
+_writer = None
+_hooked = False
+
+
+class Sink(object):
+    def __init__(self, path, max_bytes=0, backups=3, compress=True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.written = 0
+        self.rotations = 0
+        self._pending = []
+        self._fp = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def write(self, line, urgent=False):
+        if not line.endswith('\n'):
+            line += '\n'
+        with self._lock:
+            self._pending.append(line)
+            pending = len(self._pending)
+        if urgent or pending >= MAX_PENDING:
+            _get_writer().wake(fsync=urgent)
+
+    def write_json(self, data, urgent=False):
+        self.write(json.dumps(data), urgent=urgent)
+
+    def flush(self, fsync=True):
+        _get_writer().flush(fsync=fsync)
+
+    def _drain(self):
+        with self._lock:
+            lines, self._pending = self._pending, []
+        if not lines:
+            return False
+
+        if self._fp is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._fp = open(self.path, 'a')
+
+        data = ''.join(lines)
+        self._fp.write(data)
+        self._fp.flush()
+        self.written += len(data)
+        self._dirty = True
+
+        if self.max_bytes and self._fp.tell() >= self.max_bytes:
+            self._rotate()
+        return True
+
+    def _sync(self):
+        if self._fp is not None and self._dirty:
+            os.fsync(self._fp.fileno())
+            self._dirty = False
+
+    def _close(self):
+        if self._fp is not None:
+            self._sync()
+            self._fp.close()
+            self._fp = None
+
+    def _segment(self, n):
+        return '%s.%d%s' % (self.path, n, '.gz' if self.compress else '')
+
+    def _rotate(self):
+        self._close()
+
+        oldest = self._segment(self.backups)
+        if os.path.exists(oldest):
+            os.unlink(oldest)
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(self._segment(n)):
+                os.replace(self._segment(n), self._segment(n + 1))
+
+        if self.backups <= 0:
+            os.unlink(self.path)
+        elif self.compress:
+            staged = '%s.rotating' % self.path
+            os.replace(self.path, staged)
+            with open(staged, 'rb') as src, gzip.open(self._segment(1), 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.unlink(staged)
+        else:
+            os.replace(self.path, self._segment(1))
+
+        self.rotations += 1
+        logging.debug("[logwriter] rotated %s", self.path)
+
+
+class _Writer(threading.Thread):
+    def __init__(self):
+        super(_Writer, self).__init__(name="Log Writer", daemon=True)
+        self._cond = threading.Condition()
+        self._wake = False
+        self._want_fsync = False
+        self._cycles_started = 0
+        self._cycles_done = 0
+        self._last_fsync = time.time()
+
+    def wake(self, fsync=False):
+        with self._cond:
+            self._wake = True
+            self._want_fsync = self._want_fsync or fsync
+            self._cond.notify()
+
+    def flush(self, fsync=True, timeout=5.0):
+        if threading.current_thread() is self:
+            self._cycle(fsync)
+            return
+        with self._cond:
+            # the next cycle to start is guaranteed to see our pending lines
+            target = self._cycles_started + 1
+            self._wake = True
+            self._want_fsync = self._want_fsync or fsync
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._cycles_done >= target, timeout=timeout)
+
+    def _cycle(self, fsync):
+        with _lock:
+            sinks = list(_sinks.values())
+        for sink in sinks:
+            try:
+                sink._drain()
+            except Exception as e:
+                logging.error("[logwriter] error writing %s: %s", sink.path, e)
+
+        if fsync or time.time() - self._last_fsync >= FSYNC_INTERVAL:
+            for sink in sinks:
+                try:
+                    sink._sync()
+                except Exception as e:
+                    logging.error("[logwriter] error syncing %s: %s", sink.path, e)
+            self._last_fsync = time.time()
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._wake, timeout=FLUSH_INTERVAL)
+                fsync = self._want_fsync
+                self._wake = False
+                self._want_fsync = False
+                self._cycles_started += 1
+                cycle = self._cycles_started
+            self._cycle(fsync)
+            with self._cond:
+                self._cycles_done = cycle
+                self._cond.notify_all()
+
+
+def _get_writer():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = _Writer()
+            _writer.start()
+            atexit.register(flush_all)
+        return _writer
+
+
+def sink(path, max_bytes=0, backups=3, compress=True):
+    """Return the shared sink for path, creating it on first use."""
+    install_shutdown_hook()
+    with _lock:
+        s = _sinks.get(path)
+        if s is None:
+            s = _sinks[path] = Sink(path, max_bytes=max_bytes, backups=backups, compress=compress)
+        else:
+            s.max_bytes = max_bytes
+            s.backups = backups
+            s.compress = compress
+    _get_writer()
+    return s
+
+
+def flush_all(fsync=True):
+    """Write out everything pending and fsync it. Safe to call from any thread."""
+    if _writer is not None and _writer.is_alive():
+        _writer.flush(fsync=fsync)
+    else:
+        with _lock:
+            sinks = list(_sinks.values())
+        for s in sinks:
+            try:
+                s._drain()
+                if fsync:
+                    s._sync()
+            except Exception as e:
+                logging.error("[logwriter] error flushing %s: %s", s.path, e)
+
+
+def stats():
+    with _lock:
+        return {path: {'bytes_written': s.written, 'rotations': s.rotations, 'pending': len(s._pending)}
+                for path, s in _sinks.items()}
+
+
+def install_shutdown_hook():
+    """Make pwnagotchi.shutdown/reboot/restart flush pending lines first."""
+    global _hooked
+    if _hooked:
+        return
+    _hooked = True
+
+    import pwnagotchi
+
+    for name in ('shutdown', 'reboot', 'restart'):
+        original = getattr(pwnagotchi, name, None)
+        if original is None or getattr(original, '_flushes_logs', False):
+            continue
+
+        def hooked(*args, __original=original, **kwargs):
+            try:
+                flush_all()
+            except Exception as e:
+                logging.error("[logwriter] flush before %s failed: %s", __original.__name__, e)
+            return __original(*args, **kwargs)
+
+        functools.update_wrapper(hooked, original)
+        hooked._flushes_logs = True
+        setattr(pwnagotchi, name, hooked)
@@ -0,0 +1,178 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+from pwnagotchi.hooktimer import HookTimer
+
+# Runtime metrics: call counts and latency histograms per plugin hook
+# (quickdic_throttled.on_handshake, display-password.on_ui_update, ...) and
+# per agent loop phase, served by the hook_metrics plugin as Prometheus text
+# or JSON. Cheap enough to leave on: two perf_counter() reads, a bisect over
+# a dozen buckets and a short lock per call.
+#
+# install() wraps the plugin callbacks through hooktimer.HookTimer (locked_cb
+# or one(), whichever runs the callback). It is meant to run after the agent is
+# ready (the plugin schedules it with bootprof.defer) so it never stacks on
+# top of the boot profiler's wrapper.
+#
+# Components with counters of their own (the coalescing view, ...) register
+# a stats() callable; its numeric values are served next to the histograms.
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_hooks = {}     # (plugin, hook) -> _Histogram
+_phases = {}    # phase -> _Histogram
+_sources = {}   # name -> callable returning {key: number}
+_enabled = False
+
+
+class _Histogram(object):
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': round(self.sum, 6), 'max': round(self.max, 6),
+                'mean': round(self.sum / self.count, 6) if self.count else 0.0,
+                'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], self.counts))}
+
+
+def _observe(table, key, seconds):
+    with _lock:
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = _Histogram()
+        histogram.observe(seconds)
+
+
+def observe_hook(plugin_name, hook, seconds):
+    _observe(_hooks, (plugin_name, hook), seconds)
+
+
+@contextmanager
+def phase(name):
+    """Time an agent loop phase; a no-op unless metrics are installed."""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _observe(_phases, name, time.perf_counter() - start)
+
+
+_timer = HookTimer(observe_hook)
+
+
+def install():
+    """Start timing plugin hooks and agent phases."""
+    global _enabled
+    name = _timer.install()
+    if name is None:
+        return
+    _enabled = True
+    logging.info("[metrics] timing plugin hooks via plugins.%s", name)
+
+
+def uninstall():
+    global _enabled
+    if _timer.uninstall():
+        _enabled = False
+
+
+def register(name, stats):
+    """Serve the dict returned by stats() under name."""
+    with _lock:
+        _sources[name] = stats
+
+
+def unregister(name):
+    with _lock:
+        _sources.pop(name, None)
+
+
+def _collect():
+    # outside _lock: the sources take locks of their own
+    with _lock:
+        sources = sorted(_sources.items())
+    collected = {}
+    for name, stats in sources:
+        try:
+            collected[name] = stats()
+        except Exception as e:
+            logging.error("[metrics] %s stats failed: %s", name, e)
+    return collected
+
+
+def reset():
+    with _lock:
+        _hooks.clear()
+        _phases.clear()
+
+
+def snapshot():
+    stats = _collect()
+    with _lock:
+        return {
+            'hooks': {'%s.on_%s' % key: h.to_dict() for key, h in sorted(_hooks.items())},
+            'phases': {name: h.to_dict() for name, h in sorted(_phases.items())},
+            'stats': stats,
+        }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _prometheus_histogram(lines, metric, help_text, items):
+    lines.append('# HELP %s %s' % (metric, help_text))
+    lines.append('# TYPE %s histogram' % metric)
+    for labels, h in items:
+        label = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+        cumulative = 0
+        for bound, n in zip(BUCKETS, h.counts):
+            cumulative += n
+            lines.append('%s_bucket{%s,le="%s"} %d' % (metric, label, bound, cumulative))
+        lines.append('%s_bucket{%s,le="+Inf"} %d' % (metric, label, h.count))
+        lines.append('%s_sum{%s} %.6f' % (metric, label, h.sum))
+        lines.append('%s_count{%s} %d' % (metric, label, h.count))
+
+
+def prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    stats = _collect()
+    with _lock:
+        hooks = sorted(_hooks.items())
+        phases = sorted(_phases.items())
+        _prometheus_histogram(lines, 'pwnagotchi_plugin_hook_seconds', 'Time spent in plugin callbacks.',
+                              [((('plugin', p), ('hook', k)), h) for (p, k), h in hooks])
+        _prometheus_histogram(lines, 'pwnagotchi_agent_phase_seconds', 'Time spent in agent loop phases.',
+                              [((('phase', name),), h) for name, h in phases])
+        lines.append('# HELP pwnagotchi_plugin_hook_max_seconds Slowest plugin callback seen.')
+        lines.append('# TYPE pwnagotchi_plugin_hook_max_seconds gauge')
+        for (p, k), h in hooks:
+            lines.append('pwnagotchi_plugin_hook_max_seconds{plugin="%s",hook="%s"} %.6f' % (_escape(p), _escape(k), h.max))
+    for name, values in stats.items():
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            metric = 'pwnagotchi_%s_%s' % (name, key)
+            lines.append('# TYPE %s gauge' % metric)
+            lines.append('%s %s' % (metric, value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,377 @@
+import os
+import json
+import time
+import atexit
+import struct
+import logging
+import threading
+
+# Capture metadata cache shared by every on_handshake consumer. A capture is
+# parsed once, in a single pass, for encryption, ESSID, BSSID, station and
+# handshake type; the result is keyed by (device, inode, size, mtime) so
+# hardlinked copies share an entry and a pcap bettercap appended to since is
+# parsed again. Entries live in memory and are persisted to a JSON file.
+
+CACHE_FILE = '/var/tmp/pwnagotchi/pcap_meta.json'
+SAVE_EVERY = 20       # new entries before the cache is written back
+SAVE_INTERVAL = 60.0  # or seconds since the last write
+
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_RADIOTAP = 127
+EAPOL_SNAP = b'\xaa\xaa\x03\x00\x00\x00\x88\x8e'
+RSN_OUI = b'\x00\x0f\xac'
+WPA_OUI = b'\x00\x50\xf2'
+
+# RSN AKM suite type -> encryption tokens (bettercap/wpa3parse vocabulary)
+AKM_TOKENS = {
+    1: ('WPA2', 'MGT'),
+    2: ('WPA2', 'PSK'),
+    5: ('WPA2', 'MGT'),
+    6: ('WPA2', 'PSK'),
+    8: ('WPA3', 'SAE'),
+    9: ('WPA3', 'SAE'),
+    18: ('OWE',),
+    24: ('WPA3', 'SAE'),
+}
+
+HANDSHAKE_RANK = {'none': 0, 'partial': 1, 'pmkid': 2, 'full': 3}
+
+
+def _mac(raw):
+    return ':'.join('%02x' % b for b in raw)
+
+
+def _header(fp):
+    """(raw 24 byte header, endianness, link type) of a classic pcap."""
+    header = fp.read(24)
+    if len(header) < 24:
+        raise ValueError("truncated pcap header")
+    magic = header[:4]
+    if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+        endian = '<'
+    elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+        endian = '>'
+    else:
+        raise ValueError("not a pcap file (pcapng is not supported)")
+    return header, endian, struct.unpack(endian + 'I', header[20:24])[0]
+
+
+def _raw_records(fp, endian):
+    # (16 byte record header, frame) as stored, up to the first truncated record
+    rec = struct.Struct(endian + 'IIII')
+    while True:
+        head = fp.read(16)
+        if len(head) < 16:
+            return
+        incl_len = rec.unpack(head)[2]
+        data = fp.read(incl_len)
+        if len(data) < incl_len:
+            return
+        yield head, data
+
+
+def _records(fp):
+    _, endian, linktype = _header(fp)
+    for _, data in _raw_records(fp, endian):
+        if linktype == LINKTYPE_RADIOTAP:
+            if len(data) < 4:
+                continue
+            data = data[struct.unpack('<H', data[2:4])[0]:]
+        elif linktype != LINKTYPE_IEEE802_11:
+            raise ValueError("unsupported link type %d" % linktype)
+        yield data
+
+
+def _parse_ies(body):
+    ies = {}
+    i = 0
+    while i + 2 <= len(body):
+        tag, length = body[i], body[i + 1]
+        value = body[i + 2:i + 2 + length]
+        if len(value) < length:
+            break
+        ies.setdefault(tag, []).append(value)
+        i += 2 + length
+    return ies
+
+
+def _crypto(ies, privacy):
+    tokens = []
+    for rsn in ies.get(48, ()):
+        try:
+            pairwise = struct.unpack('<H', rsn[6:8])[0]
+            off = 8 + 4 * pairwise
+            akms = struct.unpack('<H', rsn[off:off + 2])[0]
+            for n in range(akms):
+                suite = rsn[off + 2 + 4 * n:off + 6 + 4 * n]
+                if suite[:3] == RSN_OUI:
+                    tokens.extend(AKM_TOKENS.get(suite[3], ('WPA2',)))
+        except (struct.error, IndexError):
+            tokens.append('WPA2')
+    for vendor in ies.get(221, ()):
+        if vendor[:4] == WPA_OUI + b'\x01':
+            tokens.append('WPA')
+    if not tokens:
+        tokens.append('WEP' if privacy else 'OPEN')
+    seen = []
+    for token in tokens:
+        if token not in seen:
+            seen.append(token)
+    return seen
+
+
+def _eapol_message(key_info):
+    ack = key_info & 0x0080
+    mic = key_info & 0x0100
+    install = key_info & 0x0040
+    secure = key_info & 0x0200
+    if ack and not mic:
+        return 1
+    if ack and mic and install:
+        return 3
+    if mic and not ack and secure:
+        return 4
+    if mic and not ack:
+        return 2
+    return 0
+
+
+def parse(filename):
+    """Single pass over a pcap: encryption, essid, bssid, station and handshake type."""
+    beacons = {}
+    messages = {}
+    pmkid = set()
+
+    with open(filename, 'rb') as fp:
+        for frame in _records(fp):
+            if len(frame) < 24:
+                continue
+            fc0, fc1 = frame[0], frame[1]
+            ftype, subtype = (fc0 >> 2) & 3, fc0 >> 4
+
+            if ftype == 0 and subtype in (5, 8) and len(frame) >= 36:
+                bssid = _mac(frame[16:22])
+                if bssid in beacons and beacons[bssid]['essid']:
+                    continue
+                ies = _parse_ies(frame[36:])
+                essid = ies.get(0, [b''])[0].decode('utf-8', 'replace')
+                privacy = struct.unpack('<H', frame[34:36])[0] & 0x0010
+                beacons[bssid] = {'essid': essid, 'encryption': _crypto(ies, privacy)}
+
+            elif ftype == 2 and not fc1 & 0x40:
+                to_ds, from_ds = fc1 & 0x01, fc1 & 0x02
+                off = 24 + (6 if to_ds and from_ds else 0) + (2 if subtype & 0x08 else 0)
+                if frame[off:off + 8] != EAPOL_SNAP:
+                    continue
+                eapol = frame[off + 8:]
+                if len(eapol) < 99 or eapol[1] != 3:
+                    continue
+                if from_ds:
+                    bssid, station = _mac(frame[10:16]), _mac(frame[4:10])
+                else:
+                    bssid, station = _mac(frame[4:10]), _mac(frame[10:16])
+                key_info = struct.unpack('>H', eapol[5:7])[0]
+                msg = _eapol_message(key_info)
+                if not msg:
+                    continue
+                messages.setdefault((bssid, station), set()).add(msg)
+                if msg == 1:
+                    key_data = eapol[99:]
+                    at = key_data.find(b'\xdd\x14' + RSN_OUI + b'\x04')
+                    if at >= 0 and key_data[at + 6:at + 22].strip(b'\x00'):
+                        pmkid.add((bssid, station))
+
+    best = ('none', None, None)
+    for (bssid, station), seen in messages.items():
+        if {1, 2} <= seen or {2, 3} <= seen:
+            kind = 'full'
+        elif (bssid, station) in pmkid:
+            kind = 'pmkid'
+        else:
+            kind = 'partial'
+        if HANDSHAKE_RANK[kind] > HANDSHAKE_RANK[best[0]]:
+            best = (kind, bssid, station)
+
+    kind, bssid, station = best
+    if bssid is None and beacons:
+        bssid = next(iter(beacons))
+    beacon = beacons.get(bssid, {'essid': '', 'encryption': []})
+    return {
+        'encryption': beacon['encryption'],
+        'essid': beacon['essid'],
+        'bssid': bssid or '',
+        'station': station or '',
+        'handshake': kind,
+        'pmkid': any(key[0] == bssid for key in pmkid),
+    }
+
+
+def _fallback(filename):
+    # pcapng or an unexpected link type; let upstream's scapy parser have a go
+    from pwnagotchi.utils import extract_from_pcap, WifiInfo
+    info = extract_from_pcap(filename, [WifiInfo.BSSID, WifiInfo.ESSID, WifiInfo.ENCRYPTION])
+    encryption = info.get(WifiInfo.ENCRYPTION) or []
+    return {
+        'encryption': sorted(encryption) if not isinstance(encryption, str) else [encryption],
+        'essid': info.get(WifiInfo.ESSID) or '',
+        'bssid': (info.get(WifiInfo.BSSID) or '').lower(),
+        'station': '',
+        'handshake': 'partial',
+        'pmkid': False,
+    }
+
+
+def merge(filenames, out):
+    """Concatenate the records of captures into out; False if their formats differ."""
+    headers = []
+    for filename in filenames:
+        with open(filename, 'rb') as fp:
+            headers.append(_header(fp))
+    # same byte order, timestamp resolution and link type, or the records don't mix
+    if not headers or len({(h[:4], h[20:24]) for h, _, _ in headers}) > 1:
+        return False
+    tmp = '%s.tmp' % out
+    with open(tmp, 'wb') as dst:
+        dst.write(headers[0][0])
+        for filename, (_, endian, _) in zip(filenames, headers):
+            with open(filename, 'rb') as src:
+                src.seek(24)
+                for head, data in _raw_records(src, endian):
+                    dst.write(head)
+                    dst.write(data)
+    os.replace(tmp, out)
+    return True
+
+
+def parse_any(filename):
+    """parse(), falling back to upstream's parser for captures we can't read ourselves."""
+    try:
+        return parse(filename)
+    except ValueError:
+        return _fallback(filename)
+
+
+def pool_parse(path):
+    """Process pool worker: (path, metadata, (dev, ino, size, mtime_ns), error) for one capture."""
+    # lives here rather than in a plugin so forkserver/spawn children can import it
+    try:
+        st = os.stat(path)
+        return path, parse_any(path), (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns), None
+    except Exception as e:
+        return path, None, None, str(e)
+
+
+def pool_init(niceness):
+    try:
+        os.nice(niceness)
+    except OSError:
+        pass
+
+
+class PcapCache(object):
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._unsaved = 0
+        self._last_save = time.time()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rt') as fp:
+                self._entries = json.load(fp)
+        except Exception as e:
+            logging.warning("[pcapcache] ignoring unreadable cache %s: %s", self.path, e)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._unsaved:
+                return
+            data = json.dumps(self._entries)
+            self._unsaved = 0
+            self._last_save = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = '%s.tmp' % self.path
+            with open(tmp, 'wt') as fp:
+                fp.write(data)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logging.error("[pcapcache] error saving %s: %s", self.path, e)
+
+    @staticmethod
+    def key(filename, st=None):
+        st = st or os.stat(filename)
+        return '%d:%d:%d:%d' % (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def lookup(self, filename):
+        """Cached metadata for filename, without parsing it on a miss."""
+        try:
+            key = self.key(filename)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+        return dict(entry) if entry else None
+
+    def put(self, filename, meta, st=None):
+        key = self.key(filename, st)
+        entry = dict(meta, path=os.path.abspath(filename))
+        with self._lock:
+            self._entries[key] = entry
+            self._unsaved += 1
+            due = self._unsaved >= SAVE_EVERY or time.time() - self._last_save >= SAVE_INTERVAL
+        if due:
+            self.save()
+        return dict(entry)
+
+    def get(self, filename):
+        """Metadata for filename, parsing it only if this exact file content is unseen."""
+        try:
+            st = os.stat(filename)
+        except OSError as e:
+            logging.debug("[pcapcache] cannot stat %s: %s", filename, e)
+            return None
+
+        key = self.key(filename, st)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return dict(entry)
+
+        self.misses += 1
+        try:
+            meta = parse_any(filename)
+        except Exception as e:
+            logging.debug("[pcapcache] cannot parse %s: %s", filename, e)
+            return None
+        return self.put(filename, meta, st)
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default():
+    """The process-wide cache every plugin should share."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = PcapCache()
+            atexit.register(_default.save)
+        return _default
+
+
+def is_wpa3(encryption):
+    """True if an encryption list (or bettercap's space/slash separated string) mentions WPA3/SAE."""
+    if isinstance(encryption, str):
+        encryption = encryption.replace('/', ' ').split()
+    return any(str(enc).upper() in ('WPA3', 'SAE') for enc in encryption or ())
@@ -0,0 +1,100 @@
+import time
+import threading
+
+# Adaptive interval for the agent's stats poller. The stock agent asks
+# bettercap for the whole session and redraws uptime, peers, counters and
+# handshakes every 5 seconds, also in an empty field at night. Here every
+# poll is reduced to a small digest (AP count, client count, handshakes,
+# peers); while the digest stays the same the interval grows by BACKOFF per
+# poll up to the maximum, and any change - or a bettercap event, via poke() -
+# drops it back to the base interval right away. The power profile scales
+# both ends, as it scaled the fixed interval before.
+#
+# Skipper answers "did the inputs of this updater change since it last ran"
+# so the poller can leave updaters alone that would draw the same thing.
+
+BASE_INTERVAL = 5.0
+MAX_INTERVAL = 30.0
+BACKOFF = 1.5
+
+
+def session_digest(session):
+    """Cheap fingerprint of what the stats care about in a bettercap session."""
+    try:
+        aps = session['wifi']['aps']
+    except (KeyError, TypeError):
+        return None
+    return len(aps), sum(len(ap.get('clients') or ()) for ap in aps)
+
+
+class AdaptiveInterval(object):
+    def __init__(self, base=BASE_INTERVAL, maximum=MAX_INTERVAL, backoff=BACKOFF):
+        self.base = base
+        self.maximum = max(base, maximum)
+        self.backoff = backoff
+        self.scale = 1
+        self.polls = 0
+        self.changes = 0
+        self._interval = base
+        self._digest = None
+        self._last_poll = time.time()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self):
+        return self._interval * self.scale
+
+    def set_scale(self, scale):
+        self.scale = scale
+
+    def update(self, digest):
+        """Record this poll's digest; returns the seconds to wait before the next one."""
+        with self._lock:
+            self.polls += 1
+            self._last_poll = time.time()
+            if digest != self._digest or digest is None:
+                self.changes += 1
+                self._digest = digest
+                self._interval = self.base
+            else:
+                self._interval = min(self.maximum, self._interval * self.backoff)
+            return self._interval * self.scale
+
+    def poke(self):
+        """Something happened: poll within the base interval and start over from there."""
+        with self._lock:
+            self._interval = self.base
+        self._wake.set()
+
+    def wait(self):
+        deadline = self._last_poll + self.interval
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            if self._wake.wait(remaining):
+                self._wake.clear()
+                # an event never makes us poll more often than the base interval
+                deadline = min(deadline, self._last_poll + self.base * self.scale)
+
+    def stats(self):
+        with self._lock:
+            return {'interval': round(self._interval * self.scale, 2), 'polls': self.polls,
+                    'changes': self.changes, 'scale': self.scale}
+
+
+class Skipper(object):
+    def __init__(self):
+        self.skipped = 0
+        self._last = {}
+
+    def changed(self, name, key, refresh=None):
+        """False if key is what name last ran with (and that was less than refresh seconds ago)."""
+        last = self._last.get(name)
+        now = time.time()
+        if last is not None and last[0] == key and (refresh is None or now - last[1] < refresh):
+            self.skipped += 1
+            return False
+        self._last[name] = (key, now)
+        return True
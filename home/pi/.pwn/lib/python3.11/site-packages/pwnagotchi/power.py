@@ -0,0 +1,163 @@
+import time
+import logging
+import threading
+from collections import deque
+
+# Battery runtime model shared by the agent and the plugins. A UPS plugin
+# (pisugar2) feeds it capacity samples; the discharge rate is the least
+# squares slope over the last WINDOW seconds, which gives a time-remaining
+# estimate. From capacity and time remaining the model picks a power
+# profile, and subscribers are told whenever the profile changes:
+#
+#   full      - on mains or plenty of battery, everything runs as usual
+#   eco       - stretch the session: slower stats polling and display refresh
+#   critical  - minutes left: pause heavy work (cracking), refresh rarely
+#
+# so a long field session winds down gradually instead of running flat out
+# until the UPS plugin's hard shutdown threshold.
+
+FULL = 'full'
+ECO = 'eco'
+CRITICAL = 'critical'
+RANK = {FULL: 0, ECO: 1, CRITICAL: 2}
+
+# how much slower periodic work should run in each profile
+INTERVAL_SCALE = {FULL: 1, ECO: 2, CRITICAL: 6}
+
+WINDOW = 1800.0      # seconds of samples used for the discharge rate
+MIN_SPAN = 300.0     # sample span needed before the rate is trusted
+MIN_SAMPLES = 6
+MAX_SAMPLES = 720
+HYSTERESIS = 5.0     # extra percent (and minutes) needed to step back up a profile
+
+
+class DischargeModel(object):
+    def __init__(self, eco_percent=30, critical_percent=12, eco_minutes=60, critical_minutes=15):
+        self.eco_percent = eco_percent
+        self.critical_percent = critical_percent
+        self.eco_minutes = eco_minutes
+        self.critical_minutes = critical_minutes
+        self.profile = FULL
+        self.capacity = None
+        self.charging = False
+        self._samples = deque(maxlen=MAX_SAMPLES)
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def configure(self, **thresholds):
+        with self._lock:
+            for name, value in thresholds.items():
+                if value is not None and hasattr(self, name):
+                    setattr(self, name, value)
+
+    def subscribe(self, callback):
+        """callback(profile, previous) runs on every profile change; returns the current profile."""
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+            return self.profile
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _rate(self):
+        # percent per second, negative while discharging
+        now = self._samples[-1][0]
+        points = [(t, c) for t, c in self._samples if now - t <= WINDOW]
+        if len(points) < MIN_SAMPLES or points[-1][0] - points[0][0] < MIN_SPAN:
+            return None
+        n = len(points)
+        mean_t = sum(t for t, _ in points) / n
+        mean_c = sum(c for _, c in points) / n
+        var = sum((t - mean_t) ** 2 for t, _ in points)
+        if var <= 0:
+            return None
+        return sum((t - mean_t) * (c - mean_c) for t, c in points) / var
+
+    def rate(self):
+        with self._lock:
+            return self._rate() if self._samples else None
+
+    def _remaining(self):
+        rate = self._rate() if self._samples else None
+        if self.charging or rate is None or rate >= 0:
+            return None
+        return max(0.0, self.capacity / -rate)
+
+    def time_remaining(self):
+        """Estimated seconds until empty, or None while charging or before enough samples."""
+        with self._lock:
+            return self._remaining()
+
+    def _target(self, remaining, margin=0.0):
+        if self.charging:
+            return FULL
+        minutes = remaining / 60.0 if remaining is not None else None
+        if self.capacity <= self.critical_percent + margin or \
+                (minutes is not None and minutes <= self.critical_minutes + margin):
+            return CRITICAL
+        if self.capacity <= self.eco_percent + margin or \
+                (minutes is not None and minutes <= self.eco_minutes + margin):
+            return ECO
+        return FULL
+
+    def add(self, capacity, charging=False, timestamp=None):
+        """Record a capacity sample (percent) and return the resulting profile."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if charging != self.charging:
+                # the slope of the other direction says nothing about this one
+                self._samples.clear()
+            self.capacity = float(capacity)
+            self.charging = charging
+            self._samples.append((timestamp, self.capacity))
+
+            remaining = self._remaining()
+            profile = self._target(remaining)
+            if RANK[profile] < RANK[self.profile] and not charging:
+                # stepping back up needs some margin so noise doesn't flap the profile
+                relaxed = self._target(remaining, HYSTERESIS)
+                profile = relaxed if RANK[relaxed] < RANK[self.profile] else self.profile
+
+            previous = self.profile
+            self.profile = profile
+            if profile == previous:
+                return profile
+            subscribers = list(self._subscribers)
+
+        logging.info("[power] profile %s -> %s (%.0f%%, %s left)", previous, profile, self.capacity,
+                     '%dm' % (remaining // 60) if remaining is not None else '?')
+        for callback in subscribers:
+            try:
+                callback(profile, previous)
+            except Exception as e:
+                logging.error("[power] error notifying %s: %s", callback, e)
+        return profile
+
+    def snapshot(self):
+        with self._lock:
+            rate = self._rate() if self._samples else None
+            remaining = self._remaining()
+            return {
+                'profile': self.profile,
+                'capacity': self.capacity,
+                'charging': self.charging,
+                'rate_per_hour': round(rate * 3600, 2) if rate is not None else None,
+                'remaining_minutes': int(remaining // 60) if remaining is not None else None,
+                'samples': len(self._samples),
+            }
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default():
+    """The process-wide model; with no UPS plugin feeding it, it stays in the full profile."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = DischargeModel()
+        return _default
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from pwnagotchi import logwriter
+
+# Crash-safe recovery data for the agent. Instead of one big JSON dump right
+# before a reboot, changes are appended to a journal as they happen (one
+# short JSON line per handshake, interaction count or last pwnd name) and
+# every COMPACT_EVERY entries the full state is written as a snapshot with
+# temp file + fsync + rename, after which the journal starts over. Loading
+# reads the snapshot and replays the journal on top; a torn last line from a
+# crash is skipped. Handshake events are slimmed to the fields the agent
+# uses, so neither file carries bettercap's full event payloads.
+#
+# The snapshot keeps the old RECOVERY_DATA_FILE name and layout, so data
+# written by the previous agent still loads.
+
+COMPACT_EVERY = 500   # journal entries between snapshots
+MAX_AGE = 600.0       # seconds; older non-final data is a previous session, not a restart
+HANDSHAKE_FIELDS = ('ap', 'station', 'file')
+
+
+def slim_handshake(event):
+    """The part of a wifi.client.handshake event worth keeping across a restart."""
+    data = event.get('data', event) if isinstance(event, dict) else {}
+    slim = {field: data.get(field) for field in HANDSHAKE_FIELDS if data.get(field) is not None}
+    if isinstance(event, dict) and 'time' in event:
+        slim['time'] = event['time']
+    return slim
+
+
+class RecoveryStore(object):
+    def __init__(self, path, state=None, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.journal_path = '%s.journal' % path
+        self.state = state
+        self.compact_every = compact_every
+        self.entries = 0
+        self.snapshots = 0
+        self._lock = threading.Lock()
+        self._journal = logwriter.sink(self.journal_path)
+
+    def _append(self, record):
+        with self._lock:
+            self._journal.write_json(record)
+            self.entries += 1
+            due = self.state is not None and self.entries >= self.compact_every
+        if due:
+            self.snapshot()
+
+    def record_handshake(self, key, handshake):
+        self._append({'h': key, 'v': handshake})
+
+    def record_interaction(self, who, count):
+        self._append({'i': who, 'n': count})
+
+    def record_last_pwnd(self, name):
+        self._append({'p': name})
+
+    def record_session(self, started_at, epoch):
+        self._append({'s': started_at, 'e': epoch})
+
+    def snapshot(self, state=None, final=False):
+        """Atomically write the full state and start a new journal."""
+        with self._lock:
+            # the state is taken under the lock: a record appended after it would be lost with the journal,
+            # one appended before it is covered by this snapshot
+            state = state if state is not None else self.state()
+            data = dict(state, version=2, final=final, saved_at=time.time())
+            data['handshakes'] = {key: slim_handshake(hs) for key, hs in data.get('handshakes', {}).items()}
+            self._journal.flush(fsync=False)
+            tmp = '%s.tmp' % self.path
+            with open(tmp, 'w') as fp:
+                json.dump(data, fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp, self.path)
+            if os.path.exists(self.journal_path):
+                os.truncate(self.journal_path, 0)
+            self.entries = 0
+            self.snapshots += 1
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rt') as fp:
+            data = json.load(fp)
+        if 'version' not in data:
+            # written by the old agent right before a reboot
+            data['final'] = True
+        data['handshakes'] = {key: slim_handshake(hs) for key, hs in data.get('handshakes', {}).items()}
+        return data
+
+    def _replay(self, data):
+        replayed = 0
+        with open(self.journal_path, 'rt') as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn write from a crash; everything before it is intact
+                    break
+                if 'h' in record:
+                    data['handshakes'][record['h']] = record['v']
+                elif 'i' in record:
+                    data['history'][record['i']] = record['n']
+                elif 'p' in record:
+                    data['last_pwnd'] = record['p']
+                elif 's' in record:
+                    data['started_at'], data['epoch'] = record['s'], record['e']
+                replayed += 1
+        return replayed
+
+    def load(self, max_age=MAX_AGE):
+        """Recovered state, or None if there is nothing recent enough to resume."""
+        logwriter.flush_all(fsync=False)
+        data = self._read_snapshot()
+        newest = os.path.getmtime(self.path) if data is not None else 0
+        if data is None:
+            data = {'started_at': time.time(), 'epoch': 0, 'history': {}, 'handshakes': {}, 'last_pwnd': None}
+
+        replayed = 0
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path):
+            newest = max(newest, os.path.getmtime(self.journal_path))
+            replayed = self._replay(data)
+
+        if not newest:
+            return None
+        if not data.get('final') and time.time() - newest > max_age:
+            # no reboot/restart was asked for and nothing was written lately: a past session
+            return None
+        logging.info("recovered %d handshakes, %d history entries (%d journal entries replayed)",
+                     len(data['handshakes']), len(data['history']), replayed)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._journal.flush(fsync=False)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            # truncated rather than unlinked: the log writer keeps it open for appending
+            if os.path.exists(self.journal_path):
+                os.truncate(self.journal_path, 0)
+            self.entries = 0
@@ -0,0 +1,149 @@
+import re
+import threading
+from collections import deque
+
+# One compiled matcher for the whitelists in config.toml (main.whitelist and
+# the per-plugin lists). Entries are sorted once into:
+#
+#   - a set of exact names (SSIDs, compared as written)
+#   - a set of full MAC addresses
+#   - a nibble trie of MAC prefixes (OUIs, or the 13 character prefixes the
+#     stock agent supports), so one walk of at most 12 steps covers them all
+#   - an Aho-Corasick automaton over every entry, lowercased, for the
+#     "entry appears anywhere in the name/MAC" rules some plugins use
+#
+# Lookups are memoized per MAC / name, which is what repeats epoch after
+# epoch. compiled() hands out one matcher per distinct entry list.
+
+MAC_FULL = re.compile(r'^[0-9a-f]{2}([:-][0-9a-f]{2}){5}$')
+MAC_PREFIX = re.compile(r'^[0-9a-f]{2}([:-][0-9a-f]{1,2}){2,4}[:-]?$')
+MEMO_MAX = 8192
+
+
+def _nibbles(mac):
+    return re.sub(r'[^0-9a-f]', '', mac.lower())
+
+
+class _Automaton(object):
+    """Aho-Corasick over lowercased patterns; answers 'does any pattern occur in text'."""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [False]
+        for pattern in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(False)
+                state = nxt
+            self._out[state] = True
+
+        # depth one states fail to the root; the queue never revisits the root itself
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] or self._out[self._fail[nxt]]
+
+    def search(self, text):
+        state = 0
+        for ch in text:
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            if self._out[state]:
+                return True
+        return False
+
+
+class Whitelist(object):
+    def __init__(self, entries=()):
+        self.entries = [str(e) for e in entries or () if str(e)]
+        self._names = set(self.entries)
+        self._macs = set()
+        self._trie = {}
+        for entry in self.entries:
+            low = entry.lower()
+            if MAC_FULL.match(low):
+                self._macs.add(_nibbles(low))
+            elif MAC_PREFIX.match(low):
+                node = self._trie
+                for nibble in _nibbles(low):
+                    node = node.setdefault(nibble, {})
+                node[None] = True
+        self._automaton = _Automaton(set(e.lower() for e in self.entries))
+        self._mac_memo = {}
+        self._search_memo = {}
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    def _memo(self, memo, key, compute):
+        hit = memo.get(key)
+        if hit is None:
+            hit = compute(key)
+            with self._lock:
+                if len(memo) >= MEMO_MAX:
+                    memo.clear()
+                memo[key] = hit
+        return hit
+
+    def _mac(self, mac):
+        nibbles = _nibbles(mac)
+        if nibbles in self._macs:
+            return True
+        node = self._trie
+        for nibble in nibbles:
+            node = node.get(nibble)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    def match_mac(self, mac):
+        """MAC is whitelisted exactly or by one of the prefixes."""
+        if not mac or not (self._macs or self._trie):
+            return False
+        return self._memo(self._mac_memo, mac, self._mac)
+
+    def match_name(self, name):
+        return bool(name) and name in self._names
+
+    def match_ap(self, ap):
+        """The stock agent rule: hostname listed, or the BSSID listed in full or by prefix."""
+        return self.match_name(ap.get('hostname')) or self.match_mac(ap.get('mac'))
+
+    def search(self, text):
+        """Any entry occurs in text, ignoring case."""
+        if not text or not self.entries:
+            return False
+        return self._memo(self._search_memo, str(text), lambda t: self._automaton.search(t.lower()))
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def compiled(entries):
+    """The shared matcher for this list of entries, compiled on first use."""
+    key = tuple(str(e) for e in entries or ())
+    with _compiled_lock:
+        matcher = _compiled.get(key)
+        if matcher is None:
+            matcher = _compiled[key] = Whitelist(key)
+        return matcher
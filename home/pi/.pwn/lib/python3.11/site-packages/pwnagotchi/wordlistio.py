@@ -0,0 +1,152 @@
+import os
+import gzip
+import json
+import lzma
+import shutil
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Wordlists may be plain .txt or compressed with gzip, xz or zstd
+# (rockyou.txt.gz, big.txt.zst, ...). Compressed lists are decompressed as a
+# stream while the cracker reads them, never to a temp file, so a list takes
+# a fraction of the SD card and a pass reads that much less from it.
+#
+# zstd uses the zstandard module when it is installed, otherwise the zstd
+# command line tool.
+#
+# The manifest caches line count and uncompressed size per list, keyed by
+# file size and mtime, so counting lines (the old `wc -l` per batch) and
+# size ordering cost a stream over a list only when the list changes.
+
+PLAIN = '.txt'
+COMPRESSED = ('.gz', '.xz', '.zst')
+CHUNK = 1048576
+
+
+def is_compressed(name):
+    return name.endswith(COMPRESSED)
+
+
+def is_wordlist(name):
+    return not name.startswith('.') and (name.endswith(PLAIN) or is_compressed(name))
+
+
+def base_name(name):
+    """Name without the compression suffix: rockyou-75.txt.gz -> rockyou-75.txt"""
+    for ext in COMPRESSED:
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+
+@contextmanager
+def open_wordlist(path):
+    """Binary stream of the wordlist's (decompressed) contents."""
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as fp:
+            yield fp
+    elif path.endswith('.xz'):
+        with lzma.open(path, 'rb') as fp:
+            yield fp
+    elif path.endswith('.zst'):
+        if zstandard is not None:
+            with open(path, 'rb') as raw:
+                with zstandard.ZstdDecompressor().stream_reader(raw) as fp:
+                    yield fp
+        else:
+            tool = shutil.which('zstd')
+            if tool is None:
+                raise OSError("reading %s needs the zstandard module or the zstd tool" % path)
+            proc = subprocess.Popen([tool, '-dcq', path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            try:
+                yield proc.stdout
+            finally:
+                proc.stdout.close()
+                proc.kill()
+                proc.wait()
+    else:
+        with open(path, 'rb') as fp:
+            yield fp
+
+
+def count(path):
+    """(lines, uncompressed bytes) of a wordlist, by streaming it once."""
+    lines = size = 0
+    last = b'\n'
+    with open_wordlist(path) as fp:
+        while True:
+            chunk = fp.read(CHUNK)
+            if not chunk:
+                break
+            lines += chunk.count(b'\n')
+            size += len(chunk)
+            last = chunk[-1:]
+    # a last line without a newline is still a candidate
+    return lines + (last != b'\n'), size
+
+
+class Manifest(object):
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rt') as fp:
+                self._entries = json.load(fp)
+        except Exception as e:
+            logging.warning("[wordlistio] ignoring unreadable manifest %s: %s", self.path, e)
+
+    def get(self, path):
+        """{'lines', 'bytes'} for path, counted now if the list is new or changed."""
+        st = os.stat(path)
+        name = os.path.basename(path)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+                return entry
+        lines, size = count(path)
+        entry = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'lines': lines, 'bytes': size}
+        with self._lock:
+            self._entries[name] = entry
+            self._dirty = True
+        return entry
+
+    def lines(self, path):
+        return self.get(path)['lines']
+
+    def bytes(self, path):
+        return self.get(path)['bytes']
+
+    def prune(self, names):
+        """Forget lists that are no longer in the folder."""
+        with self._lock:
+            for name in set(self._entries) - set(names):
+                del self._entries[name]
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = dict(self._entries)
+            self._dirty = False
+        try:
+            tmp = '%s.tmp' % self.path
+            with open(tmp, 'wt') as fp:
+                json.dump(data, fp)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logging.error("[wordlistio] error saving manifest %s: %s", self.path, e)
@@ -0,0 +1,131 @@
+import os
+import json
+import logging
+import threading
+
+from pwnagotchi import wordlistio
+
+# Learns which wordlists pay for their CPU time. Every cracking run reports
+# the seconds spent per wordlist and, on a crack, which list (and where in
+# it) held the key. Lists are ranked by a smoothed hits-per-second estimate:
+# an untried list starts from a prior of PRIOR_HITS hits over the time it
+# would take to exhaust it, so small and priority lists get tried early and
+# lists that burn minutes without a hit sink to the back.
+
+SEGMENTS = 16            # hit histogram buckets per wordlist (by byte offset)
+PRIOR_HITS = 1.0
+PRIORITY_PRIOR_HITS = 2.0
+MIN_PRIOR_SECONDS = 60.0
+DEFAULT_BYTES_PER_SEC = 200000.0  # rough pi zero 2w aircrack throughput until we measure it
+MIN_MEASURED_SECONDS = 300.0      # exhausted-list time needed before trusting the measured throughput
+HOT_MIN_HITS = 2         # a password that cracked this many networks is promoted
+HOT_MAX = 200
+
+
+class WordlistRanker(object):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._wordlists = {}
+        self._passwords = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rt') as fp:
+                state = json.load(fp)
+            self._wordlists = state.get('wordlists', {})
+            self._passwords = state.get('passwords', {})
+        except Exception as e:
+            logging.warning("[wordlistrank] ignoring unreadable state %s: %s", self.path, e)
+
+    def save(self):
+        with self._lock:
+            state = {'wordlists': self._wordlists, 'passwords': self._passwords}
+        tmp = '%s.tmp' % self.path
+        try:
+            with open(tmp, 'wt') as fp:
+                json.dump(state, fp)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logging.error("[wordlistrank] error saving %s: %s", self.path, e)
+
+    def _entry(self, name):
+        wl = self._wordlists.get(name)
+        if wl is None:
+            wl = self._wordlists[name] = {'seconds': 0.0, 'bytes': 0, 'hits': 0, 'segments': [0] * SEGMENTS}
+        return wl
+
+    def record_seconds(self, seconds_by_wordlist, sizes=None):
+        """Account compute time (and bytes covered, if sizes are given) per wordlist."""
+        with self._lock:
+            for name, seconds in seconds_by_wordlist.items():
+                wl = self._entry(name)
+                wl['seconds'] += seconds
+                if sizes and name in sizes:
+                    wl['bytes'] += sizes[name]
+
+    def record_hit(self, name, password, offset=None, size=None):
+        """Credit a crack to a wordlist (None for candidate stages) and to the password itself."""
+        with self._lock:
+            if name is not None:
+                wl = self._entry(name)
+                wl['hits'] += 1
+                if offset is not None and size:
+                    wl['segments'][min(SEGMENTS - 1, offset * SEGMENTS // size)] += 1
+            self._passwords[password] = self._passwords.get(password, 0) + 1
+
+    def _bytes_per_sec(self):
+        seconds = sum(wl['seconds'] for wl in self._wordlists.values() if wl['bytes'])
+        covered = sum(wl['bytes'] for wl in self._wordlists.values() if wl['seconds'])
+        if seconds < MIN_MEASURED_SECONDS or covered <= 0:
+            return DEFAULT_BYTES_PER_SEC
+        return covered / seconds
+
+    def rate(self, name, size, priority=False):
+        """Smoothed hits per second of compute for a wordlist of size bytes."""
+        wl = self._wordlists.get(name) or {'seconds': 0.0, 'hits': 0}
+        prior_seconds = max(MIN_PRIOR_SECONDS, size / self._bytes_per_sec())
+        prior_hits = PRIORITY_PRIOR_HITS if priority else PRIOR_HITS
+        return (wl['hits'] + prior_hits) / (wl['seconds'] + prior_seconds)
+
+    def order(self, wordlists, sizes, priority=()):
+        """Sort wordlists by learned yield; the incoming order breaks ties."""
+        priority = set(priority)
+        with self._lock:
+            rates = {name: self.rate(name, sizes.get(name, 0), name in priority) for name in wordlists}
+        index = {name: i for i, name in enumerate(wordlists)}
+        return sorted(wordlists, key=lambda name: (-rates[name], index[name]))
+
+    def hot_segments(self, name):
+        """Segment indices of a wordlist, most productive first."""
+        with self._lock:
+            segments = list(self._wordlists.get(name, {}).get('segments', [0] * SEGMENTS))
+        return sorted(range(SEGMENTS), key=lambda i: -segments[i])
+
+    def hot_passwords(self, limit=HOT_MAX):
+        with self._lock:
+            hot = [(hits, pwd) for pwd, hits in self._passwords.items() if hits >= HOT_MIN_HITS]
+        return [pwd for _, pwd in sorted(hot, reverse=True)[:limit]]
+
+    def summary(self):
+        with self._lock:
+            return {name: {'hits': wl['hits'], 'seconds': round(wl['seconds'], 1)}
+                    for name, wl in self._wordlists.items()}
+
+
+def locate(path, password):
+    """Byte offset of the line equal to password in (decompressed) path, or None."""
+    needle = password.encode('utf-8')
+    offset = 0
+    try:
+        with wordlistio.open_wordlist(path) as fp:
+            for line in fp:
+                if line.rstrip(b'\r\n') == needle:
+                    return offset
+                offset += len(line)
+    except OSError:
+        pass
+    return None
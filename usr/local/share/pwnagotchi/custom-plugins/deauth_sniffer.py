@@ -8,6 +8,8 @@ from pwnagotchi.ui.view import BLACK
 import pwnagotchi.ui.fonts as fonts
 import pwnagotchi.plugins as plugins
 import pwnagotchi.ui.faces as faces
+from pwnagotchi import logwriter
+from pwnagotchi import whitelist
 
 class DeauthSniffer(plugins.Plugin):
     __author__ = 'ZeroDumb'
@@ -23,6 +25,8 @@ class DeauthSniffer(plugins.Plugin):
         'whitelist': ['00:11:22:33:44:55', 'aa:bb:cc:dd:ee:ff'],
         'debug': False,
         'log_file': '/home/pi/deauth_detections.log',
+        'log_max_bytes': 1048576,   # Rotate (and gzip) the detection log past 1MB
+        'log_backups': 3,           # Number of rotated segments to keep
         'cleanup_interval': 3600,  # Cleanup old detections every hour
         'detection_timeout': 300,   # Remove detections after 5 minutes
         'ui_update_interval': 5,    # Update UI every 5 seconds
@@ -33,9 +37,10 @@ class DeauthSniffer(plugins.Plugin):
     def __init__(self):
         self.ready = False
         self.detected_bssids = {}  # Changed to dict to store timestamps
-        self.whitelist = []
+        self.whitelist = whitelist.compiled(())
         self.debug = False
         self.log_file = None
+        self.log_sink = None
         self.last_ui_update = 0
         self.last_cleanup = 0
         self.lock = threading.Lock()
@@ -51,13 +56,11 @@ class DeauthSniffer(plugins.Plugin):
             log_entry = f"[{timestamp}] Deauth detected from MAC: {mac}"
             if frame_data:
                 log_entry += f" | Frame data: {frame_data}"
-            log_entry += "\n"
             
-            with open(self.log_file, 'a') as f:
-                f.write(log_entry)
+            self.log_sink.write(log_entry)
                 
             if self.debug:
-                logging.debug(f"[DeauthSniffer] Logged detection to {self.log_file}")
+                logging.debug(f"[DeauthSniffer] Queued detection for {self.log_file}")
         except Exception as e:
             logging.error(f"[DeauthSniffer] Error writing to log file: {str(e)}")
 
@@ -94,7 +97,7 @@ class DeauthSniffer(plugins.Plugin):
         try:
             # Load whitelist from config
             if 'whitelist' in self.options:
-                self.whitelist = [mac.lower() for mac in self.options['whitelist']]
+                self.whitelist = whitelist.compiled(self.options['whitelist'])
             
             # Load debug setting
             self.debug = self.options.get('debug', False)
@@ -107,8 +110,12 @@ class DeauthSniffer(plugins.Plugin):
                 with open(self.log_file, 'w') as f:
                     f.write(f"Deauth Detection Log - Started {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
                     f.write("=" * 50 + "\n")
+
+            self.log_sink = logwriter.sink(self.log_file,
+                                           max_bytes=self.options.get('log_max_bytes', 1048576),
+                                           backups=self.options.get('log_backups', 3))
             
-            logging.info(f"[DeauthSniffer] Plugin loaded. Whitelist: {self.whitelist}")
+            logging.info(f"[DeauthSniffer] Plugin loaded. Whitelist: {self.whitelist.entries}")
             logging.info(f"[DeauthSniffer] Logging deauth detections to: {self.log_file}")
             if self.debug:
                 logging.info(f"[DeauthSniffer] Debug mode: Enabled")
@@ -122,6 +129,8 @@ class DeauthSniffer(plugins.Plugin):
         Called when the plugin gets unloaded
         """
         try:
+            if self.log_sink:
+                self.log_sink.flush()
             logging.info("[DeauthSniffer] Plugin unloaded")
         except Exception as e:
             logging.error(f"[DeauthSniffer] Error unloading plugin: {str(e)}")
@@ -174,7 +183,7 @@ class DeauthSniffer(plugins.Plugin):
                 is_deauth = False
                 mac = ap.get('mac')
                 
-                if not mac or mac in self.whitelist:
+                if not mac or self.whitelist.match_mac(mac):
                     continue
 
                 # Check various fields for deauth indicators
@@ -0,0 +1,139 @@
+import os
+import time
+import logging
+import threading
+import pwnagotchi.plugins as plugins
+from pwnagotchi import handshakepack
+from pwnagotchi import power
+
+# Periodically moves old captures (and their .gps.json/.geo.json) from the
+# handshakes directory into the packed archive, see handshakepack.py. By
+# default only captures quickdic has already processed are packed, so nothing
+# still waiting to be cracked disappears from the directory.
+#
+# /plugins/handshake_pack/          archive stats
+# /plugins/handshake_pack/list      archived captures
+# /plugins/handshake_pack/get/<mac> best archived capture for a BSSID, as a pcap download
+# POST compact                      compact now
+# POST extract/<mac>                restore a BSSID's captures into the handshakes directory
+
+
+class HandshakePackPlugin(plugins.Plugin):
+    __author__ = 'ZeroDumb'
+    __version__ = '1.0.0'
+    __license__ = 'GPL3'
+    __description__ = 'Compacts old handshake captures and their GPS sidecars into an indexed append-only archive'
+    __defaults__ = {
+        'enabled': False,
+        'handshakes_dir': '/home/pi/handshakes',
+        'min_age_days': 7,  # Only captures older than this are packed
+        'interval': 3600,  # Seconds between compaction runs
+        'processed_log': '/home/pi/handshakes/quickdic_processed_files.log',  # Only pack what quickdic processed, "" = any
+    }
+
+    def __init__(self):
+        self.pack = None
+        self.last_run = None
+        self.last_moved = 0
+        self.power_profile = power.FULL
+        self._stop = threading.Event()
+        self._running = threading.Lock()
+
+    def on_loaded(self):
+        for key, value in self.__defaults__.items():
+            if key not in self.options:
+                self.options[key] = value
+        self.pack = handshakepack.HandshakePack(self.options['handshakes_dir'])
+        self.power_profile = power.default().subscribe(self._on_power_profile)
+        threading.Thread(target=self._loop, name="HandshakePack", daemon=True).start()
+        logging.info("[handshake_pack] plugin loaded, %d captures archived",
+                     handshakepack.count(self.options['handshakes_dir']))
+
+    def on_unload(self, ui):
+        self._stop.set()
+        power.default().unsubscribe(self._on_power_profile)
+        if self.pack is not None:
+            self.pack.close()
+
+    def _on_power_profile(self, profile, previous):
+        self.power_profile = profile
+
+    def _processed(self):
+        path = self.options['processed_log']
+        if not path:
+            return None
+        try:
+            with open(path, 'rt') as fp:
+                return {line.strip() for line in fp if line.strip()}
+        except OSError:
+            return set()
+
+    def compact(self):
+        """One compaction run; returns the number of captures packed (None if one is already running)."""
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            processed = self._processed()
+            keep = None if processed is None else (lambda name: name not in processed)
+            self.last_moved = handshakepack.compact(self.options['handshakes_dir'],
+                                                    min_age=self.options['min_age_days'] * 86400, keep=keep,
+                                                    stop=lambda: self._stop.is_set() or self.power_profile == power.CRITICAL)
+            self.last_run = time.time()
+            return self.last_moved
+        finally:
+            self._running.release()
+
+    def _loop(self):
+        while not self._stop.wait(self.options['interval']):
+            if self.power_profile == power.CRITICAL:
+                continue
+            try:
+                self.compact()
+            except Exception as e:
+                logging.error("[handshake_pack] compaction failed: %s", e)
+
+    def _status(self):
+        entries = self.pack.entries()
+        return {
+            'archived': len(entries),
+            'bssids': len({e.bssid for e in entries}),
+            'pack_bytes': os.path.getsize(self.pack.pack_path) if os.path.exists(self.pack.pack_path) else 0,
+            'last_run': self.last_run,
+            'last_moved': self.last_moved,
+        }
+
+    def on_webhook(self, path, request):
+        from flask import make_response, jsonify
+
+        if self.pack is None:
+            return make_response(jsonify({"status": "error", "message": "Plugin not loaded"}), 503)
+        path = (path or '').strip('/')
+        try:
+            if path == "":
+                return make_response(jsonify(self._status()), 200)
+            if path == "list":
+                return make_response(jsonify([{'name': name, 'bssid': e.bssid, 'handshake': e.kind, 'pmkid': e.pmkid,
+                                               'bytes': e.pcap_len, 'mtime': e.mtime}
+                                              for name, e in sorted(self.pack.names().items())]), 200)
+            if path.startswith("get/"):
+                found = self.pack.find(path[4:])
+                if not found:
+                    return make_response(jsonify({"status": "error", "message": "not archived"}), 404)
+                name, pcap, _ = self.pack.read(found[0])
+                response = make_response(pcap, 200)
+                response.headers['Content-Type'] = 'application/vnd.tcpdump.pcap'
+                response.headers['Content-Disposition'] = 'attachment; filename="%s"' % name
+                return response
+            if request.method == "POST" and path == "compact":
+                moved = self.compact()
+                if moved is None:
+                    return make_response(jsonify({"status": "busy"}), 409)
+                return make_response(jsonify(dict(self._status(), status="ok")), 200)
+            if request.method == "POST" and path.startswith("extract/"):
+                restored = [os.path.basename(self.pack.extract(e, self.options['handshakes_dir']))
+                            for e in self.pack.find(path[8:])]
+                return make_response(jsonify({"status": "ok", "restored": restored}), 200 if restored else 404)
+        except Exception as e:
+            logging.error("[handshake_pack] webhook error: %s", e)
+            return make_response(jsonify({"status": "error", "message": str(e)}), 500)
+        return make_response(jsonify({"status": "error", "message": "Invalid endpoint"}), 404)
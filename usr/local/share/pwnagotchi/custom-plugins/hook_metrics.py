@@ -0,0 +1,33 @@
+import logging
+import pwnagotchi.plugins as plugins
+from pwnagotchi import bootprof
+from pwnagotchi import metrics
+
+
+class HookMetrics(plugins.Plugin):
+    __author__ = 'ZeroDumb'
+    __version__ = '1.0.0'
+    __license__ = 'GPL3'
+    __description__ = 'Per-plugin hook and agent loop timings as Prometheus text or JSON'
+
+    def on_loaded(self):
+        # after boot, so the boot profiler's own wrapper is gone by then
+        bootprof.defer(metrics.install, 'metrics')
+        logging.info("[hook_metrics] plugin loaded")
+
+    def on_unload(self, ui):
+        metrics.uninstall()
+
+    def on_webhook(self, path, request):
+        from flask import make_response, jsonify
+
+        if path == "json":
+            return make_response(jsonify(metrics.snapshot()), 200)
+        if path == "reset" and request.method == "POST":
+            metrics.reset()
+            return make_response(jsonify({"status": "ok"}), 200)
+        if path in ("", "/", "metrics", None):
+            response = make_response(metrics.prometheus(), 200)
+            response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+            return response
+        return make_response(jsonify({"status": "error", "message": "unknown path %s" % path}), 404)
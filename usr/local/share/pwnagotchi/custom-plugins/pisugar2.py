@@ -3,18 +3,72 @@
 #
 # based on https://github.com/evilsocket/pwnagotchi/blob/master/pwnagotchi/plugins/default/ups_lite.py
 # https://www.tindie.com/products/pisugar/pisugar2-battery-for-raspberry-pi-zero/
+#
+# The battery is read on a background thread at poll_interval; on_ui_update only
+# reads the last snapshot, so the UI thread never waits on the I2C bus.
 import logging
+import threading
+from collections import namedtuple
 
 from pwnagotchi.ui.components import LabeledValue
 from pwnagotchi.ui.view import BLACK
 import pwnagotchi.ui.fonts as fonts
 import pwnagotchi.plugins as plugins
+from pwnagotchi import power
+from pwnagotchi import bootprof
 import pwnagotchi
 import time
 
+BatterySnapshot = namedtuple('BatterySnapshot', ['capacity', 'raw_capacity', 'charging', 'timestamp'])
+
+
+class BatterySampler(threading.Thread):
+    """Polls a PiSugar2 (or anything with the same getters) and publishes smoothed snapshots"""
+
+    def __init__(self, ps, is_new_model=False, interval=10, smoothing=0.3, on_sample=None):
+        super(BatterySampler, self).__init__(name="PiSugar2 sampler", daemon=True)
+        self.ps = ps
+        self.is_new_model = is_new_model
+        self.interval = interval
+        self.smoothing = smoothing
+        self.on_sample = on_sample
+        self.snapshot = None
+        self._halt = threading.Event()
+
+    def sample(self):
+        raw = float(self.ps.get_battery_percentage().value)
+        charging = False
+        # new model use battery_power_plugged & battery_allow_charging to detect real charging status
+        if self.is_new_model:
+            charging = bool(self.ps.get_battery_power_plugged().value and self.ps.get_battery_allow_charging().value)
+
+        prev = self.snapshot
+        if prev is None or charging != prev.charging:
+            # start over when the trend flips instead of dragging the old average along
+            capacity = raw
+        else:
+            capacity = prev.capacity + self.smoothing * (raw - prev.capacity)
+
+        self.snapshot = BatterySnapshot(capacity, raw, charging, time.time())
+        if self.on_sample is not None:
+            self.on_sample(self.snapshot)
+        return self.snapshot
+
+    def run(self):
+        while not self._halt.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error(f"[pisugar2] error reading battery: {e}")
+            self._halt.wait(self.interval)
+
+    def stop(self):
+        self._halt.set()
+
+
 class PiSugar(plugins.Plugin):
     __author__ = "10230718+tisboyo@users.noreply.github.com"
-    __version__ = "0.0.1"
+    __version__ = "0.1.0"
     __license__ = "GPL3"
     __description__ = "A plugin that will add a voltage indicator for the PiSugar 2"
 
@@ -22,13 +76,32 @@ class PiSugar(plugins.Plugin):
         self.ps = None
         self.is_charging = False
         self.is_new_model = False
+        self.sampler = None
+        self.ui = None
+        self.shutting_down = False
+        self.low_reads = 0
 
     def on_loaded(self):
+        logging.info("[pisugar2] plugin loaded.")
+        power.default().configure(eco_percent=self.options.get("eco_percent"),
+                                  critical_percent=self.options.get("critical_percent"),
+                                  eco_minutes=self.options.get("eco_minutes"),
+                                  critical_minutes=self.options.get("critical_minutes"))
+        power.default().subscribe(self._on_profile)
+
+        # probing the I2C bus (and syncing the clock) can wait until the agent is ready
+        if self.options.get("lazy_init", False):
+            bootprof.defer(self._probe, "pisugar2")
+        else:
+            self._probe()
+
+    def _probe(self):
         # Load here so it doesn't attempt to load if the plugin is not enabled
-        from pisugar2 import PiSugar2
+        # (a ps assigned beforehand, e.g. a fake for testing, is used as-is)
+        if self.ps is None:
+            from pisugar2 import PiSugar2
 
-        self.ps = PiSugar2()
-        logging.info("[pisugar2] plugin loaded.")
+            self.ps = PiSugar2()
 
         if self.ps.get_battery_led_amount().value == 2:
             self.is_new_model = True
@@ -38,7 +111,42 @@ class PiSugar(plugins.Plugin):
         if self.options["sync_rtc_on_boot"]:
             self.ps.set_pi_from_rtc()
 
+        self.sampler = BatterySampler(self.ps,
+                                      is_new_model=self.is_new_model,
+                                      interval=self.options.get("poll_interval", 10),
+                                      smoothing=self.options.get("smoothing", 0.3),
+                                      on_sample=self._on_sample)
+        self.sampler.start()
+
+    def _on_sample(self, snapshot):
+        """Runs on the sampler thread, so the shutdown wait never blocks the UI"""
+        power.default().add(snapshot.raw_capacity, snapshot.charging, snapshot.timestamp)
+        # the smoothed value lags a fast drop, so two low raw reads in a row also count
+        self.low_reads = self.low_reads + 1 if snapshot.raw_capacity <= self.options["shutdown"] else 0
+        if self.shutting_down or (snapshot.capacity > self.options["shutdown"] and self.low_reads < 2):
+            return
+        self.shutting_down = True
+        logging.info(
+            f"[pisugar2] Empty battery (<= {self.options['shutdown']}): shuting down"
+        )
+        if self.ui is not None:
+            self.ui.update(force=True, new_data={"status": "Battery exhausted, bye ..."})
+        time.sleep(3)
+        pwnagotchi.shutdown()
+
+    def _on_profile(self, profile, previous):
+        if profile == power.CRITICAL and self.ui is not None:
+            self.ui.update(force=True, new_data={"status": "Battery low, saving my strength ..."})
+
+    def on_webhook(self, path, request):
+        from flask import make_response, jsonify
+
+        snapshot = self.sampler.snapshot if self.sampler is not None else None
+        return make_response(jsonify(dict(power.default().snapshot(),
+                                          reading=snapshot._asdict() if snapshot else None)), 200)
+
     def on_ui_setup(self, ui):
+        self.ui = ui
         ui.add_element(
             "bat",
             LabeledValue(
@@ -50,8 +158,8 @@ class PiSugar(plugins.Plugin):
                 text_font=fonts.Medium,
             ),
         )
-        # display charging status
-        if self.is_new_model:
+        # display charging status (the model isn't known yet when probing is deferred)
+        if self.is_new_model or self.options.get("lazy_init", False):
             ui.add_element(
                 "chg",
                 LabeledValue(
@@ -65,16 +173,20 @@ class PiSugar(plugins.Plugin):
             )
 
     def on_unload(self, ui):
+        if self.sampler is not None:
+            self.sampler.stop()
+        power.default().unsubscribe(self._on_profile)
         with ui._lock:
             ui.remove_element("bat")
             ui.remove_element("chg")
 
     def on_ui_update(self, ui):
-        capacity = int(self.ps.get_battery_percentage().value)
+        snapshot = self.sampler.snapshot if self.sampler is not None else None
+        if snapshot is None:
+            return
 
-        # new model use battery_power_plugged & battery_allow_charging to detect real charging status
         if self.is_new_model:
-            if self.ps.get_battery_power_plugged().value and self.ps.get_battery_allow_charging().value:
+            if snapshot.charging:
                 ui.set("chg", "CHG")
                 if not self.is_charging:
                     ui.update(force=True, new_data={"status": "Power!! I can feel it!"})
@@ -83,12 +195,4 @@ class PiSugar(plugins.Plugin):
                 ui.set("chg", "")
                 self.is_charging = False
 
-        ui.set("bat", str(capacity) + "%")
-
-        if capacity <= self.options["shutdown"]:
-            logging.info(
-                f"[pisugar2] Empty battery (<= {self.options['shutdown']}): shuting down"
-            )
-            ui.update(force=True, new_data={"status": "Battery exhausted, bye ..."})
-            time.sleep(3)
-            pwnagotchi.shutdown()
+        ui.set("bat", str(int(round(snapshot.capacity))) + "%")
@@ -1,4 +1,14 @@
 from pwnagotchi import plugins
+from pwnagotchi import logwriter
+from pwnagotchi import pcapcache
+from pwnagotchi import power
+from pwnagotchi import bootprof
+from pwnagotchi import crackshard
+from pwnagotchi import wordlistio
+from pwnagotchi import capturesets
+from pwnagotchi.auditstats import AuditStats
+from pwnagotchi.wordlistrank import WordlistRanker, locate
+from pwnagotchi.candidates import essid_candidates, WordlistBloom, PotfileCandidates
 import logging
 import subprocess
 import string
@@ -7,6 +17,7 @@ import io
 import os
 import time
 import json
+import threading
 from datetime import datetime
 
 # This plugin is a modified version of the quickdic plugin.
@@ -20,10 +31,17 @@ from datetime import datetime
 # files you set in your config.toml then it moves 3 files at a time, smallest to largest, with a 3 second wait between files.
 # As a tool and for education, it also scores password strength based on how fast it was cracked if at all.
 # I built it to run through large .txt files without spiking the cpu to 100%. Enjoy!
+# With sharded = true (off by default) the batches and sleeps are replaced by line-aligned wordlist segments
+# cracked on as many cores as max_cpu_percent leaves room for; the first worker to find the key stops the rest.
+# Wordlists can be .txt or compressed (.gz/.xz/.zst); compressed lists are streamed into aircrack-ng on stdin.
+# Before anything else it tries every password already cracked (this plugin's and wpa-sec's potfiles); people
+# reuse them across home, office and hotspot networks.
+# process_handshakes groups captures by BSSID and queues only the best one (or a merge of the partial ones)
+# per network; the rest are marked processed so the same network is not cracked again.
 
 class QuickDic(plugins.Plugin):
     __author__ = 'ZeroDumb'
-    __version__ = '1.1.4'
+    __version__ = '1.3.0'
     __license__ = 'GPL3'
     __description__ = 'Run a quick dictionary scan against captured handshakes, display password on screen using display-password.py. Optionally send found passwords as qrcode and plain text over to telegram bot.'
     __dependencies__ = {
@@ -40,6 +58,24 @@ class QuickDic(plugins.Plugin):
         'batch_delay': 3,  # Delay between batches in seconds
         'priority_wordlists': ['rockyou-75.txt', 'darkc0de.txt', 'john-the-ripper.txt'],  # Most common wordlists first
         'security_log': '/home/pi/security_audit.log',
+        'security_log_max_bytes': 1048576,  # Rotate (and gzip) the audit log past 1MB
+        'security_log_backups': 3,
+        'audit_stats_file': '/home/pi/security_audit.stats.json',  # Tail position and rolling stats for /stats
+        'adaptive_ordering': True,  # Rank wordlists by past hits per second instead of priority + size only
+        'wordlist_stats_file': '/home/pi/handshakes/quickdic_wordlist_stats.json',
+        'reuse_candidates': True,  # Try passwords already cracked on other networks before anything else
+        'reuse_potfiles': ['/home/pi/handshakes/quickdic.cracked.potfile', '/home/pi/handshakes/wpa-sec.cracked.potfile'],
+        'essid_candidates': True,  # Try ESSID/BSSID/vendor derived candidates before any wordlist
+        'essid_budget': 500,  # Maximum number of generated candidates per handshake
+        'essid_dedup': True,  # Skip generated candidates the wordlists already contain
+        'essid_dedup_max_lines': 2000000,  # Wordlist lines covered by the dedup filter
+        'essid_bloom_file': '/home/pi/handshakes/quickdic_wordlists.bloom',
+        'pause_on_critical': True,  # Hold cracking while the battery is in the critical power profile
+        'lazy_init': False,  # Run the dpkg check and wordlist scan after the agent is ready instead of at load
+        'wordlist_manifest': '/home/pi/handshakes/quickdic_wordlists.manifest.json',  # Cached line counts and sizes
+        'sharded': False,  # Opt-in: crack wordlist segments on parallel pinned workers instead of batches with delays
+        'crack_workers': 0,  # Parallel aircrack-ng workers for sharded cracking, 0 = from max_cpu_percent and load
+        'consolidate_captures': True,  # process_handshakes cracks one capture per BSSID, merging partial ones
         'potfile_path': '/home/pi/handshakes/quickdic.cracked.potfile'
     }
 
@@ -52,6 +88,19 @@ class QuickDic(plugins.Plugin):
         self.total_passwords_checked = 0
         self.processed_files = set()  # Track processed handshake files
         self.processed_files_log = '/home/pi/handshakes/quickdic_processed_files.log'
+        self.audit_log = None
+        self.potfile_log = None
+        self.processed_log = None
+        self.audit_stats = None
+        self.ranker = None
+        self.wordlists = []
+        self.wordlist_sizes = {}
+        self.manifest = None
+        self.bloom = None
+        self.reuse = None
+        self.power_profile = power.FULL
+        self.last_consolidation = None
+        self._consolidating = threading.Lock()
 
     def on_loaded(self):
         logging.info('[quickdic_throttled] plugin loaded')
@@ -78,11 +127,68 @@ class QuickDic(plugins.Plugin):
             self.options['security_log'] = '/home/pi/security_audit.log'
         if 'potfile_path' not in self.options:
             self.options['potfile_path'] = '/home/pi/handshakes/quickdic.cracked.potfile'
+        if 'security_log_max_bytes' not in self.options:
+            self.options['security_log_max_bytes'] = 1048576
+        if 'security_log_backups' not in self.options:
+            self.options['security_log_backups'] = 3
+        if 'audit_stats_file' not in self.options:
+            self.options['audit_stats_file'] = '/home/pi/security_audit.stats.json'
+        if 'adaptive_ordering' not in self.options:
+            self.options['adaptive_ordering'] = True
+        if 'wordlist_stats_file' not in self.options:
+            self.options['wordlist_stats_file'] = '/home/pi/handshakes/quickdic_wordlist_stats.json'
+        if 'reuse_candidates' not in self.options:
+            self.options['reuse_candidates'] = True
+        if 'reuse_potfiles' not in self.options:
+            self.options['reuse_potfiles'] = [self.options['potfile_path'], '/home/pi/handshakes/wpa-sec.cracked.potfile']
+        if 'essid_candidates' not in self.options:
+            self.options['essid_candidates'] = True
+        if 'essid_budget' not in self.options:
+            self.options['essid_budget'] = 500
+        if 'essid_dedup' not in self.options:
+            self.options['essid_dedup'] = True
+        if 'essid_dedup_max_lines' not in self.options:
+            self.options['essid_dedup_max_lines'] = 2000000
+        if 'essid_bloom_file' not in self.options:
+            self.options['essid_bloom_file'] = '/home/pi/handshakes/quickdic_wordlists.bloom'
+        if 'pause_on_critical' not in self.options:
+            self.options['pause_on_critical'] = True
+        if 'lazy_init' not in self.options:
+            self.options['lazy_init'] = False
+        if 'wordlist_manifest' not in self.options:
+            self.options['wordlist_manifest'] = '/home/pi/handshakes/quickdic_wordlists.manifest.json'
+        if 'sharded' not in self.options:
+            self.options['sharded'] = False
+        if 'crack_workers' not in self.options:
+            self.options['crack_workers'] = 0
+        if 'consolidate_captures' not in self.options:
+            self.options['consolidate_captures'] = True
             
         # Debug: Log current configuration
         logging.info(f'[quickdic] Current options: {self.options}')
         logging.info(f'[quickdic] Priority wordlists from config: {self.options.get("priority_wordlists", "NOT SET")}')
             
+        # Load crack history; the wordlists are ordered by it
+        self.ranker = WordlistRanker(self.options['wordlist_stats_file'])
+        self.reuse = PotfileCandidates(self.options['reuse_potfiles'])
+        if self.options['lazy_init']:
+            bootprof.defer(self._heavy_init, 'quickdic_throttled')
+        else:
+            self._heavy_init()
+        
+        # Load previously processed files
+        self._load_processed_files()
+
+        self._open_logs()
+        self.power_profile = power.default().subscribe(self._on_power_profile)
+
+    def _on_power_profile(self, profile, previous):
+        self.power_profile = profile
+        if profile == power.CRITICAL and self.options['pause_on_critical']:
+            logging.info('[quickdic] Battery critical, cracking paused until power recovers')
+
+    def _heavy_init(self):
+        """The slow part of on_loaded: dpkg check and wordlist scan (deferred until ready with lazy_init)"""
         # Check aircrack-ng installation
         check = subprocess.run(
             ('/usr/bin/dpkg -l aircrack-ng | grep aircrack-ng | awk \'{print $2, $3}\''), 
@@ -94,11 +200,19 @@ class QuickDic(plugins.Plugin):
         else:
             logging.warning('[quickdic] aircrack-ng is not installed!')
 
-        # Load wordlists
         self._load_wordlists()
-        
-        # Load previously processed files
-        self._load_processed_files()
+
+    def _power_paused(self):
+        return self.options['pause_on_critical'] and self.power_profile == power.CRITICAL
+
+    def _wait_for_budget(self):
+        """Block until CPU usage is under max_cpu_percent and the battery allows cracking"""
+        while self._get_current_cpu_usage() > self.options['max_cpu_percent']:
+            logging.info(f'[quickdic] CPU usage too high, waiting...')
+            time.sleep(5)
+        # and stay idle while the battery is nearly flat
+        while self._power_paused():
+            time.sleep(30)
 
     def on_config_changed(self, config):
         """Called when configuration changes"""
@@ -109,23 +223,53 @@ class QuickDic(plugins.Plugin):
                 self.options[key] = value
             
             # Reload wordlists with new configuration
+            self.reuse = PotfileCandidates(self.options['reuse_potfiles'])
             self._load_wordlists()
+            self._open_logs()
             logging.info('[quickdic] Configuration updated, reloaded wordlists')
 
+    def _open_logs(self):
+        """Route audit, potfile and processed-file appends through the shared log writer"""
+        self.audit_log = logwriter.sink(self.options['security_log'],
+                                        max_bytes=self.options['security_log_max_bytes'],
+                                        backups=self.options['security_log_backups'])
+        # The potfile and processed log are read back in full, so they never rotate
+        self.potfile_log = logwriter.sink(self.options['potfile_path'])
+        self.processed_log = logwriter.sink(self.processed_files_log)
+        if self.audit_stats is not None:
+            # the replacement resumes from the saved state
+            self.audit_stats.save()
+        self.audit_stats = AuditStats(self.options['security_log'], state_path=self.options['audit_stats_file'])
+
     def _load_wordlists(self):
         """Load and sort wordlists based on current configuration"""
         try:
-            all_wordlists = [f for f in os.listdir(self.options['wordlist_folder']) if f.endswith('.txt')]
+            folder = self.options['wordlist_folder']
             
-            # Sort wordlists: priority first, then by size (smallest first)
-            priority_set = set(self.options['priority_wordlists'])
-            priority_wordlists = [wl for wl in all_wordlists if wl in priority_set]
-            other_wordlists = [wl for wl in all_wordlists if wl not in priority_set]
+            # Sizes for ordering; compressed lists by what they decompress to
+            self.manifest = wordlistio.Manifest(self.options['wordlist_manifest'])
+            self.wordlist_sizes = {}
+            for wl in os.listdir(folder):
+                if not wordlistio.is_wordlist(wl):
+                    continue
+                path = os.path.join(folder, wl)
+                try:
+                    self.wordlist_sizes[wl] = self.manifest.bytes(path) if wordlistio.is_compressed(wl) else os.path.getsize(path)
+                except Exception as e:
+                    logging.error(f'[quickdic] Skipping unreadable wordlist {wl}: {str(e)}')
+            all_wordlists = list(self.wordlist_sizes)
+            self.manifest.prune(all_wordlists)
+            self.manifest.save()
             
-            # Sort other wordlists by size
-            other_wordlists.sort(key=lambda x: os.path.getsize(os.path.join(self.options['wordlist_folder'], x)))
+            # Sort wordlists: priority first (rockyou-75.txt.gz counts as rockyou-75.txt), then by size (smallest first)
+            priority_set = set(self.options['priority_wordlists'])
+            priority_wordlists = [wl for wl in all_wordlists if wordlistio.base_name(wl) in priority_set]
+            other_wordlists = [wl for wl in all_wordlists if wordlistio.base_name(wl) not in priority_set]
+            other_wordlists.sort(key=lambda x: self.wordlist_sizes[x])
             
             self.wordlists = priority_wordlists + other_wordlists
+            self._build_dedup_filter(priority_wordlists + other_wordlists)
+            self._rank_wordlists()
             logging.info(f'[quickdic] Found {len(self.wordlists)} wordlists')
             logging.info(f'[quickdic] Priority wordlists: {", ".join(priority_wordlists)}')
             logging.info(f'[quickdic] Other wordlists: {len(other_wordlists)} files')
@@ -134,6 +278,74 @@ class QuickDic(plugins.Plugin):
             logging.error(f'[quickdic] Error listing wordlists: {str(e)}')
             self.wordlists = []
 
+    def _build_dedup_filter(self, wordlists):
+        """(Re)load the wordlist membership filter used to dedup generated candidates, off-thread"""
+        if not self.options['essid_candidates'] or not self.options['essid_dedup']:
+            self.bloom = None
+            return
+        bloom = WordlistBloom(self.options['essid_bloom_file'])
+        paths = [os.path.join(self.options['wordlist_folder'], wl) for wl in wordlists]
+
+        def build():
+            try:
+                bloom.build(paths, max_lines=self.options['essid_dedup_max_lines'])
+            except Exception as e:
+                logging.error(f'[quickdic] Error building candidate dedup filter: {str(e)}')
+
+        self.bloom = bloom
+        threading.Thread(target=build, name="quickdic dedup filter", daemon=True).start()
+
+    def _rank_wordlists(self):
+        """Reorder wordlists by learned hits per second, keeping the static order for ties"""
+        if not self.options['adaptive_ordering'] or self.ranker is None:
+            return
+        priority_set = set(self.options['priority_wordlists'])
+        self.wordlists = self.ranker.order(self.wordlists, self.wordlist_sizes,
+                                           priority=[wl for wl in self.wordlists
+                                                     if wordlistio.base_name(wl) in priority_set])
+        logging.info(f'[quickdic] Adaptive wordlist order: {", ".join(self.wordlists[:5])}'
+                     f'{" ..." if len(self.wordlists) > 5 else ""}')
+
+    def _locate_in_batch(self, wordlists, pwd):
+        """(wordlist, byte offset) of the first list in a batch that holds pwd, or None"""
+        pwd = pwd.strip()
+        for wl in wordlists:
+            offset = locate(os.path.join(self.options['wordlist_folder'], wl), pwd)
+            if offset is not None:
+                return wl, offset
+        return None
+
+    def _learn_from_run(self, wordlist_seconds, cracked_by, pwd, partial=(), located=None):
+        """Feed a finished run into the ranker and re-rank for the next capture"""
+        if self.ranker is None:
+            return
+        # Only fully exhausted lists tell us how many bytes that time covered
+        exhausted = {wl: self.wordlist_sizes[wl] for wl in wordlist_seconds
+                     if wl in self.wordlist_sizes and wl not in cracked_by and wl not in partial}
+        self.ranker.record_seconds({wl: secs for wl, secs in wordlist_seconds.items() if wl in self.wordlist_sizes},
+                                   sizes=exhausted)
+
+        if pwd is not None:
+            # aircrack-ng prints the key as "[ key ]"
+            pwd = pwd.strip()
+            credited = None
+            if located is not None and located[0] in self.wordlist_sizes:
+                self.ranker.record_hit(located[0], pwd, offset=located[1], size=self.wordlist_sizes[located[0]])
+                credited = located[0]
+            for wl in cracked_by if credited is None else ():
+                if wl not in self.wordlist_sizes:
+                    continue
+                offset = locate(os.path.join(self.options['wordlist_folder'], wl), pwd)
+                if offset is not None:
+                    self.ranker.record_hit(wl, pwd, offset=offset, size=self.wordlist_sizes[wl])
+                    credited = wl
+                    break
+            if credited is None:
+                self.ranker.record_hit(None, pwd)
+
+        self.ranker.save()
+        self._rank_wordlists()
+
     def _load_processed_files(self):
         """Load list of previously processed files from log"""
         try:
@@ -152,8 +364,7 @@ class QuickDic(plugins.Plugin):
     def _save_processed_file(self, filename):
         """Save a processed file to the log"""
         try:
-            with open(self.processed_files_log, 'a') as f:
-                f.write(f'{filename}\n')
+            self.processed_log.write(filename)
             self.processed_files.add(filename)
             logging.info(f'[quickdic] Marked {filename} as processed')
         except Exception as e:
@@ -163,6 +374,66 @@ class QuickDic(plugins.Plugin):
         """Check if a file has already been processed"""
         return filename in self.processed_files
 
+    def _consolidate_handshakes(self, handshake_dir, pcap_files):
+        """Best unprocessed capture per network (oldest first) and how many captures were marked redundant"""
+        def name(path):
+            return os.path.relpath(path, handshake_dir)
+
+        selections = capturesets.consolidate([os.path.join(handshake_dir, f) for f in pcap_files],
+                                             processed=lambda path: self._is_file_processed(name(path)),
+                                             merge_dir=os.path.join(handshake_dir, 'merged'))
+        queue = []
+        redundant = 0
+        for selection in selections:
+            # a better or equal capture of this network exists; these can never crack anything it won't
+            for path in selection.redundant:
+                if not self._is_file_processed(name(path)):
+                    logging.info(f'[quickdic] {name(path)} is redundant, {name(selection.path)} has the {selection.kind} handshake')
+                    self._save_processed_file(name(path))
+                    redundant += 1
+            if not self._is_file_processed(name(selection.path)):
+                queue.append(selection.path)
+        queue.sort(key=os.path.getmtime)
+        return [name(path) for path in queue], redundant
+
+    def _process_next(self, handshake_dir, unprocessed_files):
+        """Mark the oldest unprocessed capture as processed and hand it to on_handshake"""
+        handshake_file = os.path.join(handshake_dir, unprocessed_files[0])
+        logging.info(f'[quickdic] Manually triggered processing of {handshake_file} (oldest unprocessed of {len(unprocessed_files)} unprocessed files)')
+
+        # Mark file as processed before starting
+        self._save_processed_file(unprocessed_files[0])
+
+        # Simulate handshake event
+        from pwnagotchi import plugins
+        # Create a minimal access_point object to prevent auto-tune plugin errors
+        access_point = {
+            'channel': 1,  # Default channel
+            'ssid': 'Unknown',
+            'bssid': 'Unknown'
+        }
+        plugins.on('handshake', None, handshake_file, access_point, None)
+
+    def _consolidate_and_process(self, handshake_dir, pcap_files):
+        """process_handshakes with consolidate_captures; parses and merges every capture, so it runs off the web thread"""
+        try:
+            unprocessed_files, redundant = self._consolidate_handshakes(handshake_dir, pcap_files)
+            self.last_consolidation = {
+                "files_found": len(pcap_files),
+                "unprocessed_files": len(unprocessed_files),
+                "redundant_files": redundant,
+                "processing": unprocessed_files[0] if unprocessed_files else None,
+                "finished_at": time.time()
+            }
+            if unprocessed_files:
+                self._process_next(handshake_dir, unprocessed_files)
+            else:
+                logging.info(f'[quickdic] All {len(pcap_files)} handshake files have already been processed')
+        except Exception as e:
+            logging.error(f'[quickdic] Error consolidating handshakes: {str(e)}')
+        finally:
+            self._consolidating.release()
+
     def _get_current_cpu_usage(self):
         """Get current CPU usage percentage using top command"""
         try:
@@ -175,15 +446,19 @@ class QuickDic(plugins.Plugin):
             return 0
 
     def _get_wordlist_size(self, wordlist):
-        """Get number of lines in wordlist"""
+        """Get number of lines in wordlist (counted once per version of the file, compressed or not)"""
         try:
-            cmd = f"wc -l {os.path.join(self.options['wordlist_folder'], wordlist)}"
-            result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE)
-            return int(result.stdout.decode('utf-8').split()[0])
-        except:
+            if self.manifest is None:
+                self.manifest = wordlistio.Manifest(self.options['wordlist_manifest'])
+            lines = self.manifest.lines(os.path.join(self.options['wordlist_folder'], wordlist))
+            self.manifest.save()
+            return lines
+        except Exception as e:
+            logging.debug(f'[quickdic] Could not count {wordlist}: {str(e)}')
             return 0
 
-    def _log_security_audit(self, filename, bssid, result, time_taken, wordlists_checked):
+    def _log_security_audit(self, filename, bssid, result, time_taken, wordlists_checked,
+                            wordlists=None, cracked_by=None, wordlist_seconds=None):
         """Log security audit results"""
         try:
             audit_data = {
@@ -192,14 +467,16 @@ class QuickDic(plugins.Plugin):
                 'result': result,
                 'time_taken': time_taken,
                 'wordlists_checked': wordlists_checked,
+                'wordlists': wordlists or [],
+                'cracked_by': cracked_by or [],
+                'wordlist_seconds': wordlist_seconds or {},
                 'total_passwords_checked': self.total_passwords_checked,
                 'security_score': self._calculate_security_score(result, time_taken, wordlists_checked)
             }
             
-            with open(self.options['security_log'], 'a') as f:
-                f.write(json.dumps(audit_data) + '\n')
+            self.audit_log.write_json(audit_data)
                 
-            logging.info(f'[quickdic] Security audit logged to {self.options["security_log"]}')
+            logging.info(f'[quickdic] Security audit queued for {self.options["security_log"]}')
         except Exception as e:
             logging.error(f'[quickdic] Error logging security audit: {str(e)}')
 
@@ -232,8 +509,8 @@ class QuickDic(plugins.Plugin):
 
     def _process_wordlist_batch(self, filename, bssid, wordlist_batch):
         """Process a batch of wordlists"""
-        wordlist_paths = [os.path.join(self.options['wordlist_folder'], wl) for wl in wordlist_batch]
-        wordlist_str = ','.join(wordlist_paths)
+        plain = [wl for wl in wordlist_batch if not wordlistio.is_compressed(wl)]
+        compressed = [wl for wl in wordlist_batch if wordlistio.is_compressed(wl)]
         
         # Count passwords in this batch
         for wl in wordlist_batch:
@@ -241,11 +518,137 @@ class QuickDic(plugins.Plugin):
                 self.total_passwords_checked += self._get_wordlist_size(wl)
                 self.attempted_wordlists.add(wl)
         
-        cmd = f'aircrack-ng -w {wordlist_str} -l {filename}.cracked -q -b {bssid} {filename} | grep KEY'
         logging.info(f'[quickdic] Processing batch: {", ".join(wordlist_batch)}')
+        result = "KEY NOT FOUND"
+        if plain:
+            wordlist_str = ','.join(os.path.join(self.options['wordlist_folder'], wl) for wl in plain)
+            cmd = f'aircrack-ng -w {wordlist_str} -l {filename}.cracked -q -b {bssid} {filename} | grep KEY'
+            result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+        # aircrack-ng can't read compressed lists itself; one whole-list segment each, piped in decompressed
+        if compressed and 'KEY FOUND' not in result:
+            cracker = crackshard.ShardedCracker(filename, bssid, 1, paused=self._power_paused)
+            result = cracker.run([seg for wl in compressed for seg in crackshard.segments(
+                wl, os.path.join(self.options['wordlist_folder'], wl))])
+        return result
+
+    def _crack_sharded(self, filename, bssid, wordlists_tried, wordlist_seconds, cracked_by):
+        """All wordlists as line-aligned segments over parallel workers; returns (result, partial wordlists)"""
+        self._wait_for_budget()
+
+        queue = []
+        for wl in self.wordlists:
+            try:
+                hot = self.ranker.hot_segments(wl) if self.ranker is not None else None
+                queue.extend(crackshard.segments(wl, os.path.join(self.options['wordlist_folder'], wl), hot))
+            except OSError as e:
+                logging.error(f'[quickdic] Skipping wordlist {wl}: {str(e)}')
+        workers = self.options['crack_workers'] or crackshard.workers_for_budget(self.options['max_cpu_percent'])
+        logging.info(f'[quickdic] Cracking {len(self.wordlists)} wordlists as {len(queue)} segments on {workers} workers')
+
+        cracker = crackshard.ShardedCracker(filename, bssid, workers, paused=self._power_paused)
+        result = cracker.run(queue)
+
+        for wl in self.wordlists:
+            if wl not in cracker.seconds:
+                continue
+            wordlists_tried.append(wl)
+            wordlist_seconds[wl] = round(wordlist_seconds.get(wl, 0) + cracker.seconds[wl], 3)
+            if wl not in self.attempted_wordlists:
+                self.total_passwords_checked += self._get_wordlist_size(wl)
+                self.attempted_wordlists.add(wl)
+        if cracker.cracked_by is not None:
+            cracked_by.append(cracker.cracked_by)
+        completed = set(cracker.completed)
+        partial = [wl for wl in cracker.seconds if wl not in completed and wl != cracker.cracked_by]
+        return result, partial
+
+    def _crack_candidates(self, filename, bssid, candidates):
+        """Run aircrack-ng over an in-memory candidate list fed on stdin"""
+        if not candidates:
+            return "KEY NOT FOUND"
+        cmd = ['aircrack-ng', '-w', '-', '-l', f'{filename}.cracked', '-q', '-b', bssid, filename]
+        result = subprocess.run(cmd, input=('\n'.join(candidates) + '\n').encode('utf-8'),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        for line in result.stdout.decode('utf-8', 'replace').splitlines():
+            if 'KEY' in line:
+                return line.strip()
+        return "KEY NOT FOUND"
+
+    def _essid_stage(self, filename, bssid, access_point):
+        """Candidates derived from this network's ESSID, BSSID and vendor"""
+        essid, vendor = '', ''
+        if isinstance(access_point, dict):
+            essid = access_point.get('hostname', '') or ''
+            vendor = access_point.get('vendor', '') or ''
+        if not essid or essid in ('<hidden>', 'Unknown'):
+            essid = self._extract_network_info(filename, bssid)['ssid']
+
+        budget = self.options['essid_budget']
+        bloom = self.bloom
+        if bloom is None or not bloom.ready:
+            return essid_candidates(essid, bssid, vendor, budget=budget)
+
+        # Over-generate, then spend the budget on what the wordlists don't already cover
+        candidates = [c for c in essid_candidates(essid, bssid, vendor, budget=budget * 2) if c not in bloom]
+        return candidates[:budget]
+
+    def _candidate_stages(self, filename, bssid, access_point):
+        """Small targeted candidate sets tried before any wordlist, as (label, candidates)"""
+        stages = []
+        if self.options['reuse_candidates'] and self.reuse is not None:
+            stages.append(('stage:reuse', self.reuse.candidates()))
+        if self.options['essid_candidates']:
+            stages.append(('stage:essid', self._essid_stage(filename, bssid, access_point)))
+        if self.ranker is not None:
+            stages.append(('stage:hot', self.ranker.hot_passwords()))
+
+        # a candidate is only worth trying in the first stage that has it
+        seen = set()
+        for i, (label, candidates) in enumerate(stages):
+            fresh = [c for c in candidates if c not in seen]
+            seen.update(fresh)
+            stages[i] = (label, fresh)
+        return stages
+
+    def _on_key_found(self, display, filename, bssid, access_point, result2):
+        """Announce, store and forward a cracked key; returns the password"""
+        key = re.search(r'\[(.*)\]', result2)
+        pwd = str(key.group(1))
+        self.text_to_set = "Cracked password: " + pwd
+        logging.warning(f'[quickdic] Password found: {pwd}')
+        display.set('face', self.options['face'])
+        display.set('status', self.text_to_set)
+        self.text_to_set = ""
+        display.update(force=True)
         
-        result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE)
-        return result.stdout.decode('utf-8').strip()
+        # Write to potfile with GPS data
+        self._write_to_potfile(bssid, pwd, filename)
+        # the potfile write is batched; the reuse set has the password right away
+        if self.reuse is not None:
+            self.reuse.add(bssid, pwd.strip())
+        
+        # Emit cracked event for display-password.py
+        plugins.on('cracked', access_point, pwd)
+        
+        if self.options['id'] != None and self.options['api'] != None:
+            self._send_message(filename, pwd)
+        return pwd
+
+    def _attribute_batch_time(self, wordlist_batch, elapsed, wordlist_seconds):
+        """Split a batch's wall time across its wordlists by file size"""
+        sizes = {}
+        for wl in wordlist_batch:
+            if wl in self.wordlist_sizes:
+                sizes[wl] = self.wordlist_sizes[wl]
+                continue
+            try:
+                sizes[wl] = os.path.getsize(os.path.join(self.options['wordlist_folder'], wl))
+            except OSError:
+                sizes[wl] = 0
+        total = sum(sizes.values())
+        for wl, size in sizes.items():
+            share = size / total if total else 1 / len(sizes)
+            wordlist_seconds[wl] = round(wordlist_seconds.get(wl, 0) + elapsed * share, 3)
 
     def _parse_gps_data(self, filename):
         """Parse GPS data from associated .gps.json or .geo.json files"""
@@ -287,6 +690,13 @@ class QuickDic(plugins.Plugin):
     def _extract_network_info(self, filename, bssid):
         """Extract network information from the pcap file or associated files"""
         network_info = {'ssid': '', 'station_mac': ''}
+
+        # Shared capture metadata cache first; aircrack-ng only if it has nothing
+        meta = pcapcache.default().get(filename)
+        if meta and meta['essid']:
+            network_info['ssid'] = meta['essid']
+            network_info['station_mac'] = meta['station'].upper()
+            return network_info
         
         # Try to get SSID from aircrack-ng output
         try:
@@ -331,9 +741,8 @@ class QuickDic(plugins.Plugin):
             timestamp = datetime.now().isoformat()
             potfile_entry = f"{bssid}:{station_mac}:{ssid}:{password}:{gps_data['lat']}:{gps_data['lon']}:{gps_data['alt']}:{timestamp}\n"
             
-            # Write to potfile
-            with open(self.options['potfile_path'], 'a') as f:
-                f.write(potfile_entry)
+            # Write to potfile; urgent so display-password picks it up right away
+            self.potfile_log.write(potfile_entry, urgent=True)
             
             logging.info(f'[quickdic] Added to potfile: {bssid}:{ssid}:{password}')
             
@@ -351,12 +760,15 @@ class QuickDic(plugins.Plugin):
         logging.info(f'[quickdic] Processing handshake file: {filename}')
         
         try:
-            # Verify handshake
+            # Verify handshake; aircrack-ng stays the authority on whether there is one and for which BSSID
             result = subprocess.run(
                 ('/usr/bin/aircrack-ng ' + filename + ' | grep "1 handshake" | awk \'{print $2}\''),
                 shell=True, 
                 stdout=subprocess.PIPE)
             result = result.stdout.decode('utf-8').translate({ord(c): None for c in string.whitespace})
+            meta = pcapcache.default().get(filename)
+            if meta and (meta['handshake'] == 'none') != (not result):
+                logging.debug(f'[quickdic] Capture cache says {meta["handshake"]} for {filename}, aircrack-ng says {result or "none"}')
             
             if not result:
                 logging.info('[quickdic] No handshake found in file')
@@ -369,12 +781,40 @@ class QuickDic(plugins.Plugin):
             batch_size = self.options['wordlists_per_batch']
             total_wordlists = len(self.wordlists)
             wordlists_checked = 0
+            wordlists_tried = []
+            wordlist_seconds = {}
+            cracked_by = []
+            partial = []
+            pwd = None
+            located = None
+            result2 = "KEY NOT FOUND"
+            sharded = self.options['sharded']
+
+            # Targeted candidate stages first; each is a few hundred lines at most
+            for label, candidates in self._candidate_stages(filename, result, access_point):
+                if not candidates:
+                    continue
+                self._wait_for_budget()
+                stage_start = time.time()
+                result2 = self._crack_candidates(filename, result, candidates)
+                wordlist_seconds[label] = round(time.time() - stage_start, 3)
+                wordlists_tried.append(label)
+                logging.info(f'[quickdic] {label} ({len(candidates)} candidates): {result2}')
+                if result2 != "KEY NOT FOUND":
+                    cracked_by = [label]
+                    pwd = self._on_key_found(display, filename, result, access_point, result2)
+                    break
             
-            for i in range(0, total_wordlists, batch_size):
-                # Check CPU usage
-                while self._get_current_cpu_usage() > self.options['max_cpu_percent']:
-                    logging.info(f'[quickdic] CPU usage too high, waiting...')
-                    time.sleep(5)
+            if pwd is None and sharded and self.wordlists:
+                result2, partial = self._crack_sharded(filename, result, wordlists_tried, wordlist_seconds, cracked_by)
+                wordlists_checked = sum(1 for wl in wordlists_tried if wl in self.wordlist_sizes)
+                logging.info(f'[quickdic] Sharded result: {result2}')
+                if result2 != "KEY NOT FOUND":
+                    pwd = self._on_key_found(display, filename, result, access_point, result2)
+
+            for i in range(0, total_wordlists if pwd is None and not sharded else 0, batch_size):
+                # Check CPU usage and battery
+                self._wait_for_budget()
                 
                 # Get current batch of wordlists
                 current_batch = self.wordlists[i:i + batch_size]
@@ -384,27 +824,21 @@ class QuickDic(plugins.Plugin):
                 logging.info(f'[quickdic] Progress: {progress:.1f}% ({wordlists_checked}/{total_wordlists} wordlists)')
                 
                 # Process batch
+                batch_start = time.time()
                 result2 = self._process_wordlist_batch(filename, result, current_batch)
+                self._attribute_batch_time(current_batch, time.time() - batch_start, wordlist_seconds)
+                wordlists_tried.extend(current_batch)
                 logging.info(f'[quickdic] Batch result: {result2}')
                 
                 if result2 != "KEY NOT FOUND":
-                    key = re.search(r'\[(.*)\]', result2)
-                    pwd = str(key.group(1))
-                    self.text_to_set = "Cracked password: " + pwd
-                    logging.warning(f'[quickdic] Password found: {pwd}')
-                    display.set('face', self.options['face'])
-                    display.set('status', self.text_to_set)
-                    self.text_to_set = ""
-                    display.update(force=True)
-                    
-                    # Write to potfile with GPS data
-                    self._write_to_potfile(result, pwd, filename)
-                    
-                    # Emit cracked event for display-password.py
-                    plugins.on('cracked', access_point, pwd)
-                    
-                    if self.options['id'] != None and self.options['api'] != None:
-                        self._send_message(filename, pwd)
+                    pwd = self._on_key_found(display, filename, result, access_point, result2)
+                    located = self._locate_in_batch(current_batch, pwd)
+                    if located is not None:
+                        # only the list holding the key cracked it; the others may not have been read to the end
+                        cracked_by = [located[0]]
+                        partial = [wl for wl in current_batch if wl != located[0]]
+                    else:
+                        cracked_by = list(current_batch)
                     break
                 
                 # Wait between batches
@@ -414,7 +848,10 @@ class QuickDic(plugins.Plugin):
             
             # Log security audit
             time_taken = time.time() - self.start_time
-            self._log_security_audit(filename, result, result2, time_taken, wordlists_checked)
+            self._log_security_audit(filename, result, result2, time_taken, wordlists_checked,
+                                     wordlists=wordlists_tried, cracked_by=cracked_by,
+                                     wordlist_seconds=wordlist_seconds)
+            self._learn_from_run(wordlist_seconds, cracked_by, pwd, partial, located)
             
             if result2 == "KEY NOT FOUND":
                 logging.info('[quickdic] No password found in any wordlist')
@@ -431,6 +868,27 @@ class QuickDic(plugins.Plugin):
         # Debug: Log the exact path being called
         logging.info(f'[quickdic] Webhook called with path: "{path}" (type: {type(path)})')
         
+        # Rolling security audit stats; only newly appended audit lines are parsed
+        if path == "stats":
+            try:
+                if self.audit_stats is None:
+                    return make_response(jsonify({"status": "error", "message": "Plugin not loaded"}), 503)
+                self.audit_stats.refresh()
+                return make_response(jsonify(self.audit_stats.snapshot()), 200)
+            except Exception as e:
+                logging.error(f'[quickdic] Error serving audit stats: {str(e)}')
+                return make_response(jsonify({"status": "error", "message": str(e)}), 500)
+
+        # Current wordlist order and the history behind it
+        if path == "ranking":
+            summary = self.ranker.summary() if self.ranker is not None else {}
+            return make_response(jsonify({
+                "adaptive": self.options.get('adaptive_ordering', False),
+                "order": self.wordlists,
+                "history": summary,
+                "hot_passwords": len(self.ranker.hot_passwords()) if self.ranker is not None else 0
+            }), 200)
+
         # Handle root path, process_handshakes path, and web UI path
         if path == "process_handshakes" or path == "" or path == "/" or path is None:
             try:
@@ -458,6 +916,37 @@ class QuickDic(plugins.Plugin):
                 # Sort pcap files by modification time (oldest first)
                 pcap_files.sort(key=lambda x: os.path.getmtime(os.path.join(handshake_dir, x)))
                 
+                # Consolidation reads every capture; answer now and queue the capture from a thread
+                if self.options['consolidate_captures']:
+                    if self._consolidating.acquire(blocking=False):
+                        threading.Thread(target=self._consolidate_and_process, args=(handshake_dir, pcap_files),
+                                         name="quickdic consolidate", daemon=True).start()
+                        message = f"Consolidating {len(pcap_files)} handshake files, then processing the oldest unprocessed one"
+                    else:
+                        message = "Consolidation already running"
+                    last = self.last_consolidation
+                    if path == "" or path == "/" or path is None:
+                        summary = f"<p>Last run: {last['files_found']} handshake files, {last['unprocessed_files']} unprocessed, {last['redundant_files']} newly marked redundant.</p>" if last else ""
+                        html = f"""
+                        <html>
+                        <head><title>QuickDic Throttled</title></head>
+                        <body>
+                            <h2>QuickDic Throttled Plugin</h2>
+                            <p style="color: green;">{message}</p>
+                            {summary}
+                            <p>Check the logs for progress: <code>tail -f /etc/pwnagotchi/log/pwnagotchi.log | grep quickdic</code></p>
+                            <p><a href="/plugins/quickdic_throttled/process_handshakes">Process Next Handshake</a></p>
+                        </body>
+                        </html>
+                        """
+                        return make_response(html, 202, {'Content-Type': 'text/html'})
+                    return make_response(jsonify({
+                        "status": "accepted",
+                        "message": message,
+                        "files_found": len(pcap_files),
+                        "last_consolidation": last
+                    }), 202)
+
                 # Filter out already processed files
                 unprocessed_files = [f for f in pcap_files if not self._is_file_processed(f)]
                 
@@ -480,21 +969,7 @@ class QuickDic(plugins.Plugin):
                         return make_response(jsonify({"status": "info", "message": "All files already processed"}), 200)
                 
                 # Process the oldest unprocessed handshake file
-                handshake_file = os.path.join(handshake_dir, unprocessed_files[0])
-                logging.info(f'[quickdic] Manually triggered processing of {handshake_file} (oldest unprocessed of {len(unprocessed_files)} unprocessed files)')
-                
-                # Mark file as processed before starting
-                self._save_processed_file(unprocessed_files[0])
-                
-                # Simulate handshake event
-                from pwnagotchi import plugins
-                # Create a minimal access_point object to prevent auto-tune plugin errors
-                access_point = {
-                    'channel': 1,  # Default channel
-                    'ssid': 'Unknown',
-                    'bssid': 'Unknown'
-                }
-                plugins.on('handshake', None, handshake_file, access_point, None)
+                self._process_next(handshake_dir, unprocessed_files)
                 
                 # Return HTML for web UI or JSON for API
                 if path == "" or path == "/" or path is None:
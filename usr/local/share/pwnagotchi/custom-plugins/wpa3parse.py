@@ -1,77 +1,289 @@
 import logging
 import os
+import errno
+import fcntl
+import queue
 import shutil
 import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pwnagotchi.plugins as plugins
-from pwnagotchi.utils import extract_from_pcap, WifiInfo
+from pwnagotchi import pcapcache
+from pwnagotchi import logwriter
+from pwnagotchi import whitelist
 import pwnagotchi.ui.faces as faces
 
+FICLONE = 0x40049409  # linux ioctl: reflink dst to src on btrfs/xfs
+
+
+def link_or_copy(src, dst):
+    """Hardlink src to dst, fall back to a reflink, then to a real copy. Returns the method used."""
+    if os.path.exists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return 'link'
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        shutil.copystat(src, dst)
+        return 'reflink'
+    except OSError:
+        shutil.copy2(src, dst)
+        return 'copy'
+
+
+class _Stat(object):
+    # just enough of os.stat_result for PcapCache.key
+    def __init__(self, dev, ino, size, mtime_ns):
+        self.st_dev, self.st_ino, self.st_size, self.st_mtime_ns = dev, ino, size, mtime_ns
+
+
+class Backfill(object):
+    """Classify an existing handshakes directory with a process pool, resumably and within a CPU budget"""
+
+    def __init__(self, handshake_dir, store, cpu_percent=50, chunk=32, niceness=15, whitelist=None):
+        self.handshake_dir = handshake_dir
+        self.store = store
+        self.whitelist = whitelist
+        self.cpu_percent = cpu_percent
+        self.chunk = chunk
+        self.niceness = niceness
+        self.progress_file = os.path.join(handshake_dir, 'wpa3', '.backfill_progress')
+        self.running = False
+        self.stop = False
+        self.scanned = 0
+        self.found = 0
+        self.errors = 0
+        self.skipped = 0
+        self.total = 0
+
+    def _budget(self):
+        cores = os.cpu_count() or 1
+        return max(1, int(cores * self.cpu_percent / 100)), cores * self.cpu_percent / 100.0
+
+    def _done(self):
+        done = set()
+        if os.path.exists(self.progress_file):
+            with open(self.progress_file, 'r') as f:
+                done.update(line.strip() for line in f if line.strip())
+        return done
+
+    def _whitelisted(self, meta):
+        # the same BSSID / SSID check the live handshake hook applies
+        return self.whitelist is not None and any(self.whitelist.search(meta.get(field)) for field in ('bssid', 'essid'))
+
+    def status(self):
+        return {'running': self.running, 'total': self.total, 'scanned': self.scanned,
+                'wpa3': self.found, 'whitelisted': self.skipped, 'errors': self.errors}
+
+    def run(self):
+        self.running = True
+        try:
+            os.makedirs(os.path.dirname(self.progress_file), exist_ok=True)
+            done = self._done()
+            pending = sorted(f for f in os.listdir(self.handshake_dir) if f.endswith('.pcap') and f not in done)
+            self.total = len(pending) + len(done)
+            self.scanned = len(done)
+            progress = logwriter.sink(self.progress_file)
+            cache = pcapcache.default()
+            workers, max_load = self._budget()
+            logging.info(f"[WPA3Parse] Backfill: {len(pending)} captures to scan with {workers} workers ({len(done)} already done)")
+
+            # never fork the threaded agent itself; a forked child can inherit a lock some other thread held
+            with ProcessPoolExecutor(max_workers=workers, initializer=pcapcache.pool_init,
+                                     initargs=(self.niceness,),
+                                     mp_context=multiprocessing.get_context('forkserver')) as pool:
+                for i in range(0, len(pending), self.chunk):
+                    if self.stop:
+                        break
+                    # Yield to the live agent while the box is busier than our budget
+                    while os.getloadavg()[0] > max_load and not self.stop:
+                        time.sleep(5)
+
+                    batch = [os.path.join(self.handshake_dir, f) for f in pending[i:i + self.chunk]]
+                    for path, meta, st, error in pool.map(pcapcache.pool_parse, batch):
+                        name = os.path.basename(path)
+                        if error is not None:
+                            self.errors += 1
+                            logging.debug(f"[WPA3Parse] Backfill could not parse {name}: {error}")
+                        else:
+                            cache.put(path, meta, _Stat(*st))
+                            if pcapcache.is_wpa3(meta['encryption']):
+                                if self._whitelisted(meta):
+                                    logging.info(f"[WPA3Parse] Backfill skipping whitelisted capture: {name}")
+                                    self.skipped += 1
+                                else:
+                                    self.store(path)
+                                    self.found += 1
+                        progress.write(name)
+                        self.scanned += 1
+            cache.save()
+            progress.flush()
+            logging.info(f"[WPA3Parse] Backfill finished: {self.found} WPA3 captures, {self.errors} unreadable")
+        except Exception as e:
+            logging.error(f"[WPA3Parse] Backfill failed: {e}")
+        finally:
+            self.running = False
+
+
 class WPA3Parse(plugins.Plugin):
     __author__ = 'ZeroDumb'
-    __version__ = '1.3.0'
+    __version__ = '1.4.1'
     __license__ = 'GPL3'
     __description__ = 'Logs WPA3 handshake captures, copies them (and optionally GPS/geo files), animates the face, and supports whitelisting and false positive reduction.'
 
     def __init__(self):
         self.copy_gps_geo = True
         self.whitelist = []
+        self._whitelist = whitelist.compiled(())
+        self.wpa3_dir = "/home/pi/handshakes/wpa3/"
+        self._queue = queue.Queue()
+        self._worker = None
+        self._animation = None
+        self._animation_lock = threading.Lock()
+        self.backfill = None
 
     def on_loaded(self):
         # Read options from config.toml
         self.copy_gps_geo = self.options.get('copy_gps_geo', True)
         self.whitelist = self.options.get('whitelist', [])
+        self._whitelist = whitelist.compiled(self.whitelist)
+        handshakes_dir = self.options.get('handshakes_dir', '/home/pi/handshakes')
+        self.wpa3_dir = os.path.join(handshakes_dir, 'wpa3') + '/'
+        self._worker = threading.Thread(target=self._work, name="WPA3Parse", daemon=True)
+        self._worker.start()
+        self.backfill = Backfill(handshakes_dir, self._store,
+                                 cpu_percent=self.options.get('backfill_cpu_percent', 50),
+                                 whitelist=self._whitelist)
+        if self.options.get('backfill_on_load', False):
+            self._start_backfill()
         logging.info(f"[WPA3Parse] Plugin loaded. copy_gps_geo={self.copy_gps_geo}, whitelist={self.whitelist}")
 
+    def _start_backfill(self):
+        if self.backfill.running:
+            return False
+        self.backfill.stop = False
+        threading.Thread(target=self.backfill.run, name="WPA3Parse backfill", daemon=True).start()
+        return True
+
+    def on_webhook(self, path, request):
+        """/backfill starts sorting the existing handshakes directory, /backfill/status reports progress"""
+        from flask import make_response, jsonify
+
+        if self.backfill is None:
+            return make_response(jsonify({"status": "error", "message": "Plugin not loaded"}), 503)
+        if path == "backfill":
+            started = self._start_backfill()
+            return make_response(jsonify(dict(self.backfill.status(), started=started)), 200)
+        if path == "backfill/stop":
+            self.backfill.stop = True
+            return make_response(jsonify(self.backfill.status()), 200)
+        if path in ("backfill/status", "", "/", None):
+            return make_response(jsonify(self.backfill.status()), 200)
+        return make_response(jsonify({"status": "error", "message": "Invalid endpoint"}), 404)
+
     def on_handshake(self, agent, filename, access_point, client_station):
+        # Only the cheap checks run on the hook; parsing and copying happen on the worker
         try:
-            # False positive reduction: check both pcap and access_point for WPA3/SAE
-            info = extract_from_pcap(filename, [WifiInfo.ENCRYPTION])
-            encryption = info.get(WifiInfo.ENCRYPTION, [])
-            ap_enc = []
             ap_bssid = None
             ap_ssid = None
             if isinstance(access_point, dict):
-                ap_enc = access_point.get('encryption', [])
                 ap_bssid = access_point.get('mac', None)
                 ap_ssid = access_point.get('hostname', None)
             else:
                 ap_bssid = access_point
             # Whitelist check (by SSID or BSSID)
-            if ap_bssid and any(w.lower() in str(ap_bssid).lower() for w in self.whitelist):
+            if ap_bssid and self._whitelist.search(ap_bssid):
                 logging.info(f"[WPA3Parse] Skipping whitelisted BSSID: {ap_bssid}")
                 return
-            if ap_ssid and any(w.lower() in str(ap_ssid).lower() for w in self.whitelist):
+            if ap_ssid and self._whitelist.search(ap_ssid):
                 logging.info(f"[WPA3Parse] Skipping whitelisted SSID: {ap_ssid}")
                 return
-            # False positive reduction: require both pcap and AP encryption to indicate WPA3/SAE
-            is_wpa3 = any(enc.upper() in ["WPA3", "SAE"] for enc in encryption) and any(enc.upper() in ["WPA3", "SAE"] for enc in ap_enc)
-            if is_wpa3:
-                logging.info(f"[WPA3Parse] WPA3 handshake captured: {filename}, AP: {ap_ssid or ap_bssid}, Client: {client_station}, Encryption: {encryption}")
-                wpa3_dir = "/home/pi/handshakes/wpa3/"
-                os.makedirs(wpa3_dir, exist_ok=True)
-                dest_file = os.path.join(wpa3_dir, os.path.basename(filename))
-                shutil.copy2(filename, dest_file)
-                logging.info(f"[WPA3Parse] Copied WPA3 handshake to {dest_file}")
-                # Optionally copy GPS/geo files
-                if self.copy_gps_geo:
-                    for ext in [".gps.json", ".geo.json"]:
-                        meta_file = filename.replace('.pcap', ext)
-                        if os.path.exists(meta_file):
-                            shutil.copy2(meta_file, os.path.join(wpa3_dir, os.path.basename(meta_file)))
-                            logging.info(f"[WPA3Parse] Copied {ext} to {wpa3_dir}")
-                # Animate the face: alternate between look_r_happy and look_l_happy
-                view = agent.view()
-                for _ in range(3):
-                    view.set('face', faces.LOOK_R_HAPPY)
-                    view.update()
-                    time.sleep(0.4)
-                    view.set('face', faces.LOOK_L_HAPPY)
-                    view.update()
-                    time.sleep(0.4)
-            else:
-                logging.debug(f"[WPA3Parse] Handshake is not WPA3: {filename}, Encryption: {encryption}, AP encryption: {ap_enc}")
+            self._queue.put((agent, filename, access_point, client_station))
         except Exception as e:
-            logging.error(f"[WPA3Parse] Error processing handshake {filename}: {e}")
+            logging.error(f"[WPA3Parse] Error queueing handshake {filename}: {e}")
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self._process(*job)
+            except Exception as e:
+                logging.error(f"[WPA3Parse] Error processing handshake {job[1]}: {e}")
+
+    def _process(self, agent, filename, access_point, client_station):
+        # False positive reduction: check both pcap and access_point for WPA3/SAE.
+        # The shared cache parses each capture once for every plugin that asks.
+        meta = pcapcache.default().get(filename)
+        encryption = meta['encryption'] if meta else []
+        ap_enc = []
+        ap_name = access_point
+        if isinstance(access_point, dict):
+            ap_enc = access_point.get('encryption', [])
+            ap_name = access_point.get('hostname', None) or access_point.get('mac', None)
+        # False positive reduction: require both pcap and AP encryption to indicate WPA3/SAE
+        is_wpa3 = pcapcache.is_wpa3(encryption) and pcapcache.is_wpa3(ap_enc)
+        if not is_wpa3:
+            logging.debug(f"[WPA3Parse] Handshake is not WPA3: {filename}, Encryption: {encryption}, AP encryption: {ap_enc}")
+            return
+
+        logging.info(f"[WPA3Parse] WPA3 handshake captured: {filename}, AP: {ap_name}, Client: {client_station}, Encryption: {encryption}")
+        self._store(filename)
+        if agent is not None:
+            self._animate(agent.view())
+
+    def _store(self, filename):
+        os.makedirs(self.wpa3_dir, exist_ok=True)
+        dest_file = os.path.join(self.wpa3_dir, os.path.basename(filename))
+        method = link_or_copy(filename, dest_file)
+        logging.info(f"[WPA3Parse] Stored WPA3 handshake at {dest_file} ({method})")
+        # Optionally copy GPS/geo files
+        if self.copy_gps_geo:
+            for ext in [".gps.json", ".geo.json"]:
+                meta_file = filename.replace('.pcap', ext)
+                if os.path.exists(meta_file):
+                    link_or_copy(meta_file, os.path.join(self.wpa3_dir, os.path.basename(meta_file)))
+                    logging.info(f"[WPA3Parse] Stored {ext} in {self.wpa3_dir}")
+
+    def _animate(self, view, steps=6, interval=0.4):
+        """Alternate look_r_happy / look_l_happy on timers instead of sleeping on the caller"""
+        frames = [faces.LOOK_R_HAPPY if i % 2 == 0 else faces.LOOK_L_HAPPY for i in range(steps)]
+
+        def step(i):
+            with self._animation_lock:
+                if self._animation is None or i >= len(frames):
+                    self._animation = None
+                    return
+                try:
+                    view.set('face', frames[i])
+                    view.update()
+                except Exception as e:
+                    logging.debug(f"[WPA3Parse] Face animation step failed: {e}")
+                self._animation = threading.Timer(interval, step, (i + 1,))
+                self._animation.daemon = True
+                self._animation.start()
+
+        with self._animation_lock:
+            if self._animation is not None:
+                # already animating for an earlier capture; let it finish
+                return
+            self._animation = threading.Timer(0, step, (0,))
+            self._animation.daemon = True
+            self._animation.start()
 
     def on_unload(self, ui):
-        logging.info("[WPA3Parse] Plugin unloaded.") 
\ No newline at end of file
+        self._queue.put(None)
+        if self.backfill is not None:
+            self.backfill.stop = True
+        with self._animation_lock:
+            if self._animation is not None:
+                self._animation.cancel()
+                self._animation = None
+        logging.info("[WPA3Parse] Plugin unloaded.")